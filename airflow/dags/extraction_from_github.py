@@ -1,7 +1,28 @@
+import os
+import json
 from airflow import DAG
+from airflow.decorators import task
 from airflow.operators.bash import BashOperator
 from datetime import datetime
 
+# Number of mapped tasks per extraction stage, each one handles the repositories of its shard
+EXTRACTION_SHARDS = int(os.getenv("EXTRACTION_SHARDS", "4"))
+SHARD_ARGS = [f"--shard {index}/{EXTRACTION_SHARDS}" for index in range(EXTRACTION_SHARDS)]
+
+
+@task
+def merge_shard_results(stage: str, results) -> dict:
+    # Every shard ends its output with a JSON summary, which BashOperator pushes to XCom
+    summaries = [json.loads(result) for result in results if result]
+    totals = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value
+    print(f"{stage}: {len(summaries)}/{EXTRACTION_SHARDS} shards reported, totals {totals}")
+    return totals
+
+
 default_args = {
     "owner": "airflow",
     "start_date": datetime(2025, 6, 1),
@@ -25,19 +46,40 @@ with DAG(
         bash_command="python /opt/airflow/scripts/extract_repos_from_github.py"
     )
 
-    extract_commits = BashOperator(
-        task_id="extract_commits_from_github",
-        bash_command="python /opt/airflow/scripts/extract_commits_from_github.py"
+    extract_commits = BashOperator.partial(
+        task_id="extract_commits_from_github"
+    ).expand(
+        bash_command=[f"python /opt/airflow/scripts/extract_commits_from_github.py {args}" for args in SHARD_ARGS]
     )
 
-    extract_commit_details = BashOperator(
-        task_id="extract_commits_details_from_github",
-        bash_command="python /opt/airflow/scripts/extract_commits_details_from_github.py"
+    extract_commit_details = BashOperator.partial(
+        task_id="extract_commits_details_from_github"
+    ).expand(
+        bash_command=[
+            f"python /opt/airflow/scripts/extract_commits_details_from_github.py {args}" for args in SHARD_ARGS
+        ]
     )
 
-    extract_blobs = BashOperator(
-        task_id="extract_blob_files",
-        bash_command="python /opt/airflow/scripts/extract_blob_files.py"
+    extract_blobs = BashOperator.partial(
+        task_id="extract_blob_files"
+    ).expand(
+        bash_command=[f"python /opt/airflow/scripts/extract_blob_files.py {args}" for args in SHARD_ARGS]
+    )
+
+    merge_commits = merge_shard_results.override(task_id="merge_commits")("commits", extract_commits.output)
+    merge_commit_details = merge_shard_results.override(task_id="merge_commit_details")(
+        "commit_details", extract_commit_details.output
+    )
+    merge_blobs = merge_shard_results.override(task_id="merge_blobs")("blobs", extract_blobs.output)
+
+    # Before-states are derived from the after-state blobs, so they run once those are stored
+    reconstruct_before_states = BashOperator.partial(
+        task_id="reconstruct_before_states"
+    ).expand(
+        bash_command=[f"python /opt/airflow/scripts/reconstruct_before_states.py {args}" for args in SHARD_ARGS]
+    )
+    merge_before_states = merge_shard_results.override(task_id="merge_before_states")(
+        "before_states", reconstruct_before_states.output
     )
 
     curate_layer = BashOperator(
@@ -45,11 +87,28 @@ with DAG(
         bash_command="python /opt/airflow/scripts/create_curated_layer.py"
     )
 
+    # Only merges what landed since the first curation, i.e. the before-states of today
+    curate_before_states = BashOperator(
+        task_id="curate_before_states",
+        bash_command="python /opt/airflow/scripts/create_curated_layer.py"
+    )
+
+    maintain_tables = BashOperator(
+        task_id="maintain_iceberg_tables",
+        bash_command="python /opt/airflow/scripts/maintain_iceberg_tables.py"
+    )
+
     (
         install_deps
         >> extract_repos 
         >> extract_commits 
+        >> merge_commits
         >> extract_commit_details 
+        >> merge_commit_details
         >> curate_layer 
         >> extract_blobs
-    )
\ No newline at end of file
+    )
+    extract_blobs >> merge_blobs
+    extract_blobs >> reconstruct_before_states >> merge_before_states >> curate_before_states
+    # Compaction and snapshot expiry rewrite the tables the stages above write to, so they run last
+    [merge_blobs, curate_before_states] >> maintain_tables
\ No newline at end of file
@@ -1,27 +1,33 @@
-import os
-import requests
+import argparse
 from dotenv import load_dotenv
-from datetime import date
-from typing import Any, Dict, List
-from utils import TrinoClient
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from utils import (
+    TrinoClient,
+    GitHubClient,
+    METRICS,
+    BufferedLandingWriter,
+    ShardSpec,
+    WorkLedger,
+    add_shard_argument,
+    get_landing_writer,
+    is_retryable,
+    print_shard_summary,
+    stage_run,
+    table_write_report
+)
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 
 load_dotenv()
 
-GITHUB_TOKEN: str = os.getenv("GITHUB_TOKEN")
-HEADERS = {
-    "Authorization": f"token {GITHUB_TOKEN}",
-    "Accept": "application/vnd.github+json"
-}
 
 def fetch_commit_files_for_commit(
+    github: GitHubClient,
     owner_repo: str,
     commit_sha: str
 ) -> List[Dict[str, Any]]:
-    url = f"https://api.github.com/repos/{owner_repo}/commits/{commit_sha}"
-    response = requests.get(url, headers=HEADERS)
-    response.raise_for_status()
-    commit_data = response.json()
+    url = f"/repos/{owner_repo}/commits/{commit_sha}"
+    commit_data = github.get_json(url)
     files = commit_data.get("files", [])
     ingestion_date = date.today().isoformat()
 
@@ -35,63 +41,160 @@ def fetch_commit_files_for_commit(
     return records
 
 
-def fetch_commits_from_trino(client: TrinoClient, ingestion_date: str) -> List[Dict[str, Any]]:
+def fetch_commits_from_trino(
+    client: TrinoClient,
+    ingestion_date: str,
+    shard: ShardSpec = ShardSpec()
+) -> Iterator[Dict[str, Any]]:
     query = f"""
         SELECT 
             id AS sha,
-            CONCAT(
-                CAST(json_extract_scalar(raw_payload, '$.owner') AS varchar), 
-                '/', 
-                CAST(json_extract_scalar(raw_payload, '$.repo') AS varchar)
-            ) AS repo_id
+            CONCAT(owner, '/', repo) AS repo_id
         FROM iceberg.landing.commits
         WHERE ingestion_date = DATE '{ingestion_date}'
+          AND {shard.sql_predicate("CONCAT(owner, '/', repo)")}
     """
-    df = client.read_sql(query)
-    return df.to_dict(orient="records")
+    return client.iter_rows(query)
 
 
-def process_commit(client: TrinoClient, commit: Dict[str, str]) -> None:
+def commit_key(commit: Dict[str, Any]) -> str:
+    # Forks share commit SHAs, the ledger keys commits by repository too
+    return f"{commit['repo_id']}@{commit['sha']}"
+
+
+def ledger_callback(
+    ledger: Optional[WorkLedger],
+    commit: Dict[str, str]
+) -> Optional[Callable[[Optional[Exception]], None]]:
+    if ledger is None:
+        return None
+
+    # The commit is only done once its rows are in the table, not when they are buffered
+    def on_written(error: Optional[Exception]) -> None:
+        if error is None:
+            ledger.done(commit_key(commit))
+        else:
+            ledger.fail(commit_key(commit), error, payload=commit)
+
+    return on_written
+
+
+def process_commit(
+    github: GitHubClient,
+    writer: BufferedLandingWriter,
+    commit: Dict[str, str],
+    ledger: Optional[WorkLedger] = None
+) -> None:
     owner_repo = commit["repo_id"]
     sha = commit["sha"]
-    print(f"Fetching rows for commit details {sha} in {owner_repo}")
 
     try:
-        files = fetch_commit_files_for_commit(owner_repo, sha)
+        files = fetch_commit_files_for_commit(github, owner_repo, sha)
     except Exception as e:
         print(f"Failed to fetch rows for commit details {sha}: {e}")
+        METRICS.inc("pipeline_items_total", kind="commit", result="failed")
+        if ledger is not None:
+            ledger.fail(commit_key(commit), e, retryable=is_retryable(e), payload=commit)
         return
 
     if not files:
-        print(f"No files found for commit {sha}")
+        METRICS.inc("pipeline_items_total", kind="commit", result="empty")
+        if ledger is not None:
+            ledger.done(commit_key(commit))
         return
 
-    try:
-        client.insert_raw_payloads(
-            table_name="iceberg.landing.commit_files",
-            rows=files,
-            id_field="id"
-        )
-        print(f"Inserted {len(files)} rows for commit details {sha}")
-    except Exception as e:
-        print(f"Failed to insert rows for commit details {sha}: {e}")
-
-
-
+    # Rows of every commit are written together by the buffered writer
+    writer.add(files, on_written=ledger_callback(ledger, commit))
+    METRICS.inc("pipeline_items_total", kind="commit", result="fetched")
+    METRICS.inc("pipeline_items_total", len(files), kind="file", result="fetched")
+
+
+def process_commits(
+    executor: ThreadPoolExecutor,
+    github: GitHubClient,
+    writer: BufferedLandingWriter,
+    commits: Iterable[Dict[str, Any]],
+    max_in_flight: int,
+    ledger: Optional[WorkLedger] = None
+) -> int:
+    # Commits are submitted while they stream in, with a bounded number in flight
+    submitted = 0
+    pending = set()
+    for commit in commits:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Unhandled exception in thread: {e}")
+        pending.add(executor.submit(process_commit, github, writer, commit, ledger))
+        submitted += 1
+
+    for future in as_completed(pending):
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Unhandled exception in thread: {e}")
+    return submitted
+
+
+def extract_commit_details(
+    github: GitHubClient,
+    writer: Any,
+    commits: Iterable[Dict[str, Any]],
+    max_workers: int = 5,
+    ledger: Optional[WorkLedger] = None
+) -> Tuple[int, BufferedLandingWriter]:
+    buffered_writer = BufferedLandingWriter(writer, "iceberg.landing.commit_files", id_field="id")
+    if ledger is not None:
+        # Commits done or failed for good by an earlier attempt of this run are not fetched again
+        commits = ledger.pending(commits, commit_key)
+    with buffered_writer, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        submitted = process_commits(executor, github, buffered_writer, commits, max_workers * 4, ledger)
+        if ledger is not None:
+            # Failures are only known once their rows were written or not
+            buffered_writer.flush()
+            for batch in ledger.retry_batches():
+                retried = (commit for _, commit in batch)
+                process_commits(executor, github, buffered_writer, retried, max_workers * 4, ledger)
+                buffered_writer.flush()
+
+    return submitted, buffered_writer
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the changed files of the commits landed today")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
     client = TrinoClient()
+    writer = get_landing_writer(client, buffered=True)
     today_str = date.today().isoformat()
-    commits = fetch_commits_from_trino(client, ingestion_date=today_str)
-    print(f"Found {len(commits)} commits to process...")
 
     max_workers = 5  
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(process_commit, client, commit) for commit in commits]
-
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Unhandled exception in thread: {e}")
\ No newline at end of file
+    github = GitHubClient(pool_maxsize=max_workers)
+    ledger = WorkLedger("commit_details", f"{today_str}#{args.shard}")
+    with stage_run("commit_details", shard=str(args.shard)):
+        run_started_at = datetime.now(timezone.utc)
+        commits = fetch_commits_from_trino(client, ingestion_date=today_str, shard=args.shard)
+        submitted, buffered_writer = extract_commit_details(github, writer, commits, max_workers, ledger)
+
+        print(f"Processed {submitted} commits.")
+        print(buffered_writer.report())
+        print(ledger.report())
+        ledger.close()
+        files_report = table_write_report(client, "iceberg.landing.commit_files", run_started_at)
+        print(
+            f"landing.commit_files: {files_report['snapshots']} snapshots this run, {files_report['files']} data files, "
+            f"avg {files_report['avg_file_bytes'] / 1024 / 1024:.2f} MB per file"
+        )
+        print(client.pool.report())
+        github.print_stats()
+    print_shard_summary(
+        "commit_details",
+        args.shard,
+        commits=submitted,
+        rows=int(buffered_writer.stats["rows"]),
+        failed_rows=int(buffered_writer.stats["failed_rows"])
+    )
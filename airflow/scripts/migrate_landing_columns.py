@@ -0,0 +1,55 @@
+from utils import TrinoClient, stage_run
+from utils.landing_schema import LANDING_COLUMNS
+from create_curated_layer import full_refresh, query_create_state_table
+
+# Brings landing tables created before the typed columns or payload_hash existed in line with
+# post-init.sql, and creates the landing tables added since. Safe to run again: tables and columns
+# are only added when missing and only rows without any projected value are backfilled from
+# raw_payload. payload_hash stays empty for the rows landed before it, the idempotent writer
+# replaces them the next time their id is landed.
+
+
+def migrate_table(client: TrinoClient, table: str) -> None:
+    columns = LANDING_COLUMNS[table]
+    typed_columns = "".join(f",\n            {column.name} {column.sql_type}" for column in columns)
+    client.execute_query(
+        f"""
+        CREATE TABLE IF NOT EXISTS iceberg.landing.{table} (
+            id VARCHAR,
+            ingestion_date DATE,
+            raw_payload VARCHAR,
+            payload_hash VARCHAR{typed_columns}
+        )
+        WITH (
+            format = 'PARQUET',
+            partitioning = ARRAY['ingestion_date']
+        )
+        """
+    )
+    client.execute_query(f"ALTER TABLE iceberg.landing.{table} ADD COLUMN IF NOT EXISTS payload_hash VARCHAR")
+    for column in columns:
+        client.execute_query(
+            f"ALTER TABLE iceberg.landing.{table} ADD COLUMN IF NOT EXISTS {column.name} {column.sql_type}"
+        )
+
+    assignments = ",\n            ".join(f"{column.name} = {column.sql_expression()}" for column in columns)
+    missing = " AND ".join(f"{column.name} IS NULL" for column in columns)
+    print(f"Backfilling {len(columns)} typed columns of landing.{table}...")
+    client.execute_query(
+        f"""
+        UPDATE iceberg.landing.{table}
+        SET
+            {assignments}
+        WHERE {missing}
+        """
+    )
+
+
+if __name__ == "__main__":
+    trino_client = TrinoClient()
+    with stage_run("landing_columns_migration"):
+        for table_name in LANDING_COLUMNS:
+            migrate_table(trino_client, table_name)
+        # curated.commits.timestamp becomes a typed timestamp, so the curated tables are rebuilt once
+        trino_client.execute_query(query_create_state_table)
+        full_refresh(trino_client)
@@ -1,20 +1,9 @@
 CREATE TABLE iceberg.curated.commit_change_metrics AS
 SELECT
-    repo_id,
-    commit_sha,
+    f.repo_id,
+    f.commit_sha,
     COUNT(*) AS number_of_files_changed,
-    SUM(lines_added + lines_removed) AS total_lines_changed,
-    ARRAY_DISTINCT(ARRAY_AGG(file_format)) AS file_types_changed
-FROM (
-    SELECT
-        json_extract_scalar(json_parse(raw_payload), '$.repo_id') AS repo_id,
-        json_extract_scalar(json_parse(raw_payload), '$.commit_sha') AS commit_sha,
-        CAST(json_extract_scalar(json_parse(raw_payload), '$.additions') AS INTEGER) AS lines_added,
-        CAST(json_extract_scalar(json_parse(raw_payload), '$.deletions') AS INTEGER) AS lines_removed,
-        SUBSTR(
-            id,
-            STRPOS(id, '.') + 1
-        ) AS file_format
-    FROM iceberg.landing.commit_files
-)
-GROUP BY repo_id, commit_sha
+    SUM(f.lines_added + f.lines_removed) AS total_lines_changed,
+    ARRAY_DISTINCT(ARRAY_AGG(f.file_format)) AS file_types_changed
+FROM iceberg.curated.commit_files f
+GROUP BY f.repo_id, f.commit_sha
@@ -0,0 +1,21 @@
+CREATE TABLE iceberg.curated.commit_file_before_states AS
+SELECT
+    id,
+    ingestion_date,
+    repo_id,
+    commit_sha,
+    parent_sha,
+    file_path,
+    before_file_path,
+    before_blob_sha,
+    CASE WHEN before_blob_sha IS NOT NULL THEN
+        CONCAT('repositories/blobs/', SUBSTR(before_blob_sha, 1, 2), '/', before_blob_sha)
+    END AS before_s3_path,
+    method
+FROM (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY repo_id, id ORDER BY ingestion_date DESC) AS copy_rank
+    FROM iceberg.landing.commit_file_before_states
+)
+WHERE copy_rank = 1
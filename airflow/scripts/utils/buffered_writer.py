@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+LANDING_FLUSH_ROWS: int = int(os.getenv("LANDING_FLUSH_ROWS", "50000"))
+LANDING_FLUSH_BYTES: int = int(os.getenv("LANDING_FLUSH_BYTES", str(64 * 1024 * 1024)))
+LANDING_FLUSH_SECONDS: float = float(os.getenv("LANDING_FLUSH_SECONDS", "60"))
+
+WrittenCallback = Callable[[Optional[Exception]], None]
+
+
+class BufferedLandingWriter:
+    """Collects landing rows from any number of threads and writes them in large
+    batches, so a run produces a few big files and snapshots instead of one per
+    caller.
+
+    A background thread flushes the buffer once it holds `max_rows` rows or
+    `max_bytes` of JSON, or when the oldest buffered row is `max_seconds` old.
+    Writes happen one at a time on that thread; callers only block when the
+    buffer is twice over its limits. `close()` (or leaving the `with` block)
+    flushes what is left and stops the thread.
+
+    `on_written` callbacks given to `add()` run on the flush thread once the
+    rows are written, with None, or with the exception when the write failed.
+    """
+
+    def __init__(
+        self,
+        writer: Any,
+        table_name: str,
+        id_field: str,
+        max_rows: int = LANDING_FLUSH_ROWS,
+        max_bytes: int = LANDING_FLUSH_BYTES,
+        max_seconds: float = LANDING_FLUSH_SECONDS
+    ):
+        self.writer = writer
+        self.table_name = table_name
+        self.id_field = id_field
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+        self._rows: List[Dict[str, Any]] = []
+        self._callbacks: List[WrittenCallback] = []
+        self._bytes = 0
+        self._first_row_at: Optional[float] = None
+        self._closed = False
+        self._flush_waiters = 0
+        self._writing = False
+        self._condition = threading.Condition()
+        self.stats: Dict[str, float] = {
+            "flushes": 0, "rows": 0, "bytes": 0, "failed_rows": 0, "flush_seconds": 0.0, "commits": 0, "files": 0
+        }
+        self._files_estimated = False
+        self._thread = threading.Thread(target=self._run, name=f"flush-{table_name}", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "BufferedLandingWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _full(self, factor: int = 1) -> bool:
+        return len(self._rows) >= self.max_rows * factor or self._bytes >= self.max_bytes * factor
+
+    def add(self, rows: Iterable[Dict[str, Any]], on_written: Optional[WrittenCallback] = None) -> None:
+        rows = list(rows)
+        if not rows:
+            return
+        size = sum(len(json.dumps(row)) for row in rows)
+        with self._condition:
+            # Back pressure: wait for the flush thread instead of buffering without bound
+            self._condition.wait_for(lambda: not self._full(factor=2) or self._closed)
+            if self._closed:
+                raise RuntimeError(f"Writer for {self.table_name} is closed")
+            if self._first_row_at is None:
+                self._first_row_at = time.monotonic()
+            self._rows.extend(rows)
+            if on_written is not None:
+                self._callbacks.append(on_written)
+            self._bytes += size
+            self._condition.notify_all()
+
+    def _due(self) -> bool:
+        if not self._rows:
+            return False
+        if self._closed or self._flush_waiters or self._full():
+            return True
+        return time.monotonic() - self._first_row_at >= self.max_seconds
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._due():
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._first_row_at is not None:
+                        timeout = max(self.max_seconds - (time.monotonic() - self._first_row_at), 0)
+                    self._condition.wait(timeout)
+                rows, size, callbacks = self._rows, self._bytes, self._callbacks
+                self._rows, self._bytes, self._callbacks, self._first_row_at = [], 0, [], None
+                self._writing = True
+                self._condition.notify_all()
+            try:
+                self._flush(rows, size, callbacks)
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def _notify(self, callbacks: List[WrittenCallback], error: Optional[Exception]) -> None:
+        for callback in callbacks:
+            try:
+                callback(error)
+            except Exception as e:
+                print(f"Write callback for {self.table_name} failed: {e}")
+
+    def _flush(self, rows: List[Dict[str, Any]], size: int, callbacks: List[WrittenCallback]) -> None:
+        start = time.perf_counter()
+        try:
+            results = self.writer.insert_raw_payloads(table_name=self.table_name, rows=rows, id_field=self.id_field)
+        except Exception as e:
+            print(f"Failed to write {len(rows)} rows to {self.table_name}: {e}")
+            self.stats["failed_rows"] += len(rows)
+            self._notify(callbacks, e)
+            return
+        self._notify(callbacks, None)
+        seconds = time.perf_counter() - start
+        # One result per commit; Trino does not say how many files an INSERT wrote, at least one per statement
+        files = sum(result.get("files", 1) for result in results)
+        estimated = any("files" not in result for result in results)
+        self._files_estimated = self._files_estimated or estimated
+        self.stats["flushes"] += 1
+        self.stats["rows"] += len(rows)
+        self.stats["bytes"] += size
+        self.stats["flush_seconds"] += seconds
+        self.stats["commits"] += len(results)
+        self.stats["files"] += files
+        print(
+            f"Flushed {len(rows)} rows ({size / 1024 / 1024:.1f} MB) to {self.table_name} in {seconds:.1f}s: "
+            f"{len(results)} commits, {'at least ' if estimated else ''}{files} data files"
+        )
+
+    def flush(self) -> None:
+        # Writes the buffered rows now and waits until they and any write in progress are done
+        with self._condition:
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                self._condition.wait_for(lambda: (not self._rows and not self._writing) or not self._thread.is_alive())
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def report(self) -> str:
+        return (
+            f"{self.table_name}: {int(self.stats['rows'])} rows in {int(self.stats['flushes'])} flushes, "
+            f"{self.stats['bytes'] / 1024 / 1024:.1f} MB, {int(self.stats['commits'])} commits, "
+            f"{'at least ' if self._files_estimated else ''}{int(self.stats['files'])} data files, "
+            f"{int(self.stats['failed_rows'])} failed rows"
+        )
+
+
+def table_write_report(trino_client: Any, table_name: str, since: datetime) -> Dict[str, Any]:
+    # Snapshots committed since `since` and the live data files of the table, from the Iceberg metadata tables
+    catalog_schema, table = table_name.rsplit(".", 1)
+    since_utc = since.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f")
+    snapshots = trino_client.read_sql(
+        f"""
+        SELECT COUNT(*) AS snapshots
+        FROM {catalog_schema}."{table}$snapshots"
+        WHERE committed_at >= TIMESTAMP '{since_utc} UTC'
+        """
+    )
+    files = trino_client.read_sql(
+        f"""
+        SELECT COUNT(*) AS files, COALESCE(AVG(file_size_in_bytes), 0) AS avg_file_bytes
+        FROM {catalog_schema}."{table}$files"
+        """
+    )
+    return {
+        "snapshots": int(snapshots["snapshots"].iloc[0]),
+        "files": int(files["files"].iloc[0]),
+        "avg_file_bytes": float(files["avg_file_bytes"].iloc[0])
+    }
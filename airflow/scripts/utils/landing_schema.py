@@ -0,0 +1,178 @@
+import re
+import json
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Union
+
+import pyarrow as pa
+
+# Columns every landing table has, as created in post-init.sql
+LANDING_SCHEMA = pa.schema([
+    pa.field("id", pa.string()),
+    pa.field("ingestion_date", pa.date32()),
+    pa.field("raw_payload", pa.string()),
+    pa.field("payload_hash", pa.string())
+])
+
+# Fields the extractors stamp on a payload, left out of its hash so landing it another day is not a change
+HASH_EXCLUDED_FIELDS = ("ingestion_date",)
+
+VARCHAR = "VARCHAR"
+INTEGER = "INTEGER"
+TIMESTAMP = "TIMESTAMP(6) WITH TIME ZONE"
+
+ARROW_TYPES = {
+    VARCHAR: pa.string(),
+    INTEGER: pa.int32(),
+    TIMESTAMP: pa.timestamp("us", tz="UTC")
+}
+
+_PATH_PART = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+
+def parse_json_path(json_path: str) -> List[Union[str, int]]:
+    # "$.parents[0].sha" -> ["parents", 0, "sha"]
+    return [
+        int(index) if index else key
+        for key, index in _PATH_PART.findall(json_path[1:] if json_path.startswith("$") else json_path)
+    ]
+
+
+def payload_hash(row: Dict[str, Any]) -> str:
+    # Canonical JSON, so the same payload hashes the same whatever the key order
+    content = {key: value for key, value in row.items() if key not in HASH_EXCLUDED_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def parse_timestamp(value: str) -> datetime:
+    # fromisoformat only understands the "Z" suffix from Python 3.11 on
+    parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class LandingColumn:
+    """A payload field projected into its own typed landing column at ingest,
+    next to the untouched raw_payload."""
+
+    def __init__(self, name: str, sql_type: str, json_path: str):
+        self.name = name
+        self.sql_type = sql_type
+        self.json_path = json_path
+        self._keys = parse_json_path(json_path)
+
+    @property
+    def arrow_type(self) -> pa.DataType:
+        return ARROW_TYPES[self.sql_type]
+
+    def extract(self, row: Dict[str, Any]) -> Any:
+        value: Any = row
+        for key in self._keys:
+            try:
+                value = value[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        if value is None:
+            return None
+        try:
+            if self.sql_type == INTEGER:
+                return int(value)
+            if self.sql_type == TIMESTAMP:
+                return parse_timestamp(str(value))
+        except ValueError:
+            return None
+        return str(value)
+
+    def sql_literal(self, value: Any) -> str:
+        if value is None:
+            return "NULL"
+        if self.sql_type == INTEGER:
+            return str(int(value))
+        if self.sql_type == TIMESTAMP:
+            return f"TIMESTAMP '{value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')} UTC'"
+        return "'" + str(value).replace("'", "''") + "'"
+
+    def sql_expression(self, payload_column: str = "raw_payload") -> str:
+        # Same projection done in SQL, used to backfill rows landed before the column existed
+        extracted = f"json_extract_scalar({payload_column}, '{self.json_path}')"
+        if self.sql_type == TIMESTAMP:
+            return f"CAST(from_iso8601_timestamp({extracted}) AS {TIMESTAMP})"
+        if self.sql_type == INTEGER:
+            return f"TRY_CAST({extracted} AS INTEGER)"
+        return extracted
+
+
+# Fields projected for each landing table, keep post-init.sql in line when changing them
+LANDING_COLUMNS: Dict[str, List[LandingColumn]] = {
+    "repositories": [
+        LandingColumn("repo_id", VARCHAR, "$.full_name"),
+        LandingColumn("created_at", TIMESTAMP, "$.created_at"),
+        LandingColumn("pushed_at", TIMESTAMP, "$.pushed_at")
+    ],
+    "commits": [
+        LandingColumn("commit_sha", VARCHAR, "$.sha"),
+        LandingColumn("owner", VARCHAR, "$.owner"),
+        LandingColumn("repo", VARCHAR, "$.repo"),
+        LandingColumn("author_name", VARCHAR, "$.commit.author.name"),
+        LandingColumn("author_email", VARCHAR, "$.commit.author.email"),
+        LandingColumn("author_date", TIMESTAMP, "$.commit.author.date"),
+        LandingColumn("message", VARCHAR, "$.commit.message"),
+        LandingColumn("parent_sha", VARCHAR, "$.parents[0].sha")
+    ],
+    "commit_files": [
+        LandingColumn("repo_id", VARCHAR, "$.repo_id"),
+        LandingColumn("commit_sha", VARCHAR, "$.commit_sha"),
+        LandingColumn("blob_sha", VARCHAR, "$.sha"),
+        LandingColumn("filename", VARCHAR, "$.filename"),
+        LandingColumn("status", VARCHAR, "$.status"),
+        LandingColumn("additions", INTEGER, "$.additions"),
+        LandingColumn("deletions", INTEGER, "$.deletions"),
+        LandingColumn("changes", INTEGER, "$.changes")
+    ],
+    "commit_file_before_states": [
+        LandingColumn("repo_id", VARCHAR, "$.repo_id"),
+        LandingColumn("commit_sha", VARCHAR, "$.commit_sha"),
+        LandingColumn("parent_sha", VARCHAR, "$.parent_sha"),
+        LandingColumn("file_path", VARCHAR, "$.file_path"),
+        LandingColumn("before_file_path", VARCHAR, "$.before_file_path"),
+        LandingColumn("before_blob_sha", VARCHAR, "$.before_blob_sha"),
+        LandingColumn("method", VARCHAR, "$.method")
+    ]
+}
+
+
+def landing_columns(table_name: str) -> List[LandingColumn]:
+    # Accepts iceberg.landing.commits, landing.commits or commits
+    return LANDING_COLUMNS.get(table_name.rsplit(".", 1)[-1], [])
+
+
+# Columns naming the repository of a row: forks share commit SHAs, so the ids built from them are only
+# unique within a repository. Repositories are keyed by their full name already
+REPO_KEY_COLUMNS: Dict[str, List[str]] = {
+    "commits": ["owner", "repo"],
+    "commit_files": ["repo_id"],
+    "commit_file_before_states": ["repo_id"]
+}
+
+
+def repo_key_columns(table_name: str) -> List[LandingColumn]:
+    names = REPO_KEY_COLUMNS.get(table_name.rsplit(".", 1)[-1], [])
+    return [column for column in landing_columns(table_name) if column.name in names]
+
+
+def repo_key(columns: List[LandingColumn], row: Dict[str, Any]) -> str:
+    # "owner/repo" for the commits, the repo_id of the commit files
+    return "/".join(str(column.extract(row) or "") for column in columns)
+
+
+def repo_key_sql(columns: List[LandingColumn]) -> str:
+    # Same key computed by Trino from the landed columns
+    if not columns:
+        return "''"
+    return " || '/' || ".join(f"COALESCE({column.name}, '')" for column in columns)
+
+
+def landing_arrow_schema(table_name: str) -> pa.Schema:
+    return pa.schema(
+        list(LANDING_SCHEMA) + [pa.field(column.name, column.arrow_type) for column in landing_columns(table_name)]
+    )
@@ -1,31 +1,100 @@
-from trino.dbapi import connect
 import pandas as pd
+import pyarrow as pa
 from datetime import date
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Iterable, Iterator, Optional, Tuple
 import json
+import asyncio
+import certifi
+import urllib3
 from minio import Minio
-from io import BytesIO
-import tarfile
+from minio.error import S3Error
+from trino.dbapi import connect
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import time
 import os
+from contextlib import contextmanager
+from .landing_schema import landing_columns, payload_hash, repo_key_columns
+from .metrics import METRICS
+from .trino_pool import TRINO_POOL_SIZE, TrinoConnectionPool
+
+# Trino rejects very large query texts, so INSERTs and MERGEs are split into
+# statements bounded by both size and row count.
+MAX_STATEMENT_BYTES: int = 1_000_000
+MAX_ROWS_PER_STATEMENT: int = 1_000
 
 class MinioClient:
+    """MinIO wrapper used for blob and state uploads.
+
+    Bucket existence is checked once per bucket and remembered, the HTTP pool
+    size is tunable, large objects are sent as parallel multipart uploads and
+    uploads can be batched or awaited from asyncio code through an internal
+    thread pool.
+    """
+
     def __init__(
         self,
         endpoint: str = "storage:9000",
         access_key: str = "admin",
         secret_key: str = "password",
-        secure: bool = False
+        secure: bool = False,
+        region: Optional[str] = "us-east-1",
+        max_pool_connections: int = 32,
+        upload_workers: int = 16,
+        parallel_parts: int = 4
     ):
+        # A known region skips the bucket location lookup before the first call on each bucket
+        http_client = urllib3.PoolManager(
+            maxsize=max_pool_connections,
+            timeout=urllib3.Timeout(connect=10, read=300),
+            retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+            cert_reqs="CERT_REQUIRED" if secure else "CERT_NONE",
+            ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where()
+        )
         self.client = Minio(
             endpoint,
             access_key=access_key,
             secret_key=secret_key,
-            secure=secure
+            secure=secure,
+            region=region,
+            http_client=http_client
         )
+        self.upload_workers = upload_workers
+        self.parallel_parts = parallel_parts
+        self._known_buckets = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats: Dict[str, float] = {"objects": 0, "bytes": 0, "seconds": 0.0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.upload_workers)
+            return self._executor
 
     def ensure_bucket(self, bucket_name: str):
+        if bucket_name in self._known_buckets:
+            return
         if not self.client.bucket_exists(bucket_name):
-            self.client.make_bucket(bucket_name)
+            try:
+                self.client.make_bucket(bucket_name)
+            except S3Error as e:
+                # Another worker may have created it in the meantime
+                if e.code not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+                    raise
+        with self._lock:
+            self._known_buckets.add(bucket_name)
+
+    def _record_upload(self, bucket_name: str, size: int, seconds: float) -> None:
+        with self._lock:
+            self.stats["objects"] += 1
+            self.stats["bytes"] += size
+            self.stats["seconds"] += seconds
+        METRICS.inc("minio_uploaded_objects_total", bucket=bucket_name)
+        METRICS.inc("minio_uploaded_bytes_total", size, bucket=bucket_name)
+        METRICS.observe("minio_upload_duration_seconds", seconds, bucket=bucket_name)
 
     def upload_bytes(
         self,
@@ -35,6 +104,7 @@ class MinioClient:
         content_type: str = "application/gzip"
     ):
         self.ensure_bucket(bucket_name)
+        start = time.perf_counter()
         data_stream = BytesIO(data_bytes)
         data_length = len(data_bytes)
         self.client.put_object(
@@ -42,8 +112,144 @@ class MinioClient:
             object_name,
             data_stream,
             data_length,
-            content_type=content_type
+            content_type=content_type,
+            num_parallel_uploads=self.parallel_parts
+        )
+        self._record_upload(bucket_name, data_length, time.perf_counter() - start)
+
+    def upload_stream(
+        self,
+        bucket_name: str,
+        object_name: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024,
+        content_type: str = "application/octet-stream"
+    ):
+        # Unknown lengths are sent as a multipart upload, one part_size buffer at a time
+        self.ensure_bucket(bucket_name)
+        start = time.perf_counter()
+        result = self.client.put_object(
+            bucket_name,
+            object_name,
+            data_stream,
+            length,
+            content_type=content_type,
+            part_size=part_size if length < 0 else 0,
+            num_parallel_uploads=self.parallel_parts
+        )
+        size = length if length >= 0 else getattr(data_stream, "bytes_read", 0)
+        self._record_upload(bucket_name, size, time.perf_counter() - start)
+        return result
+
+    def upload_many(
+        self,
+        bucket_name: str,
+        objects: Iterable[Tuple[str, bytes]],
+        content_type: str = "application/octet-stream"
+    ) -> Dict[str, Any]:
+        # Uploads many small objects concurrently, returns the names that failed with their error
+        self.ensure_bucket(bucket_name)
+        start = time.perf_counter()
+        uploaded = 0
+        failed: Dict[str, str] = {}
+        pending = {}
+        for object_name, data_bytes in objects:
+            if len(pending) >= self.upload_workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    if future.exception():
+                        failed[name] = str(future.exception())
+                    else:
+                        uploaded += 1
+            future = self.executor.submit(self.upload_bytes, bucket_name, object_name, data_bytes, content_type)
+            pending[future] = object_name
+        for future, name in pending.items():
+            if future.exception():
+                failed[name] = str(future.exception())
+            else:
+                uploaded += 1
+        return {"uploaded": uploaded, "failed": failed, "seconds": time.perf_counter() - start}
+
+    async def upload_bytes_async(
+        self,
+        bucket_name: str,
+        object_name: str,
+        data_bytes: bytes,
+        content_type: str = "application/octet-stream"
+    ):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.executor, self.upload_bytes, bucket_name, object_name, data_bytes, content_type
+        )
+
+    async def upload_stream_async(
+        self,
+        bucket_name: str,
+        object_name: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024,
+        content_type: str = "application/octet-stream"
+    ):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor,
+            self.upload_stream,
+            bucket_name,
+            object_name,
+            data_stream,
+            length,
+            part_size,
+            content_type
+        )
+
+    async def upload_many_async(
+        self,
+        bucket_name: str,
+        objects: Iterable[Tuple[str, bytes]],
+        content_type: str = "application/octet-stream"
+    ) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.upload_many, bucket_name, objects, content_type)
+
+    def upload_throughput(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        elapsed = max(stats["seconds"], 1e-9)
+        return (
+            f"{int(stats['objects'])} objects, {stats['bytes'] / 1024 / 1024:.1f} MB uploaded "
+            f"({stats['objects'] / elapsed:.1f} objects/s, {stats['bytes'] / 1024 / 1024 / elapsed:.2f} MB/s per upload thread)"
         )
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def download_bytes(self, bucket_name: str, object_name: str) -> Optional[bytes]:
+        try:
+            response = self.client.get_object(bucket_name, object_name)
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchBucket"):
+                return None
+            raise
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def download_range(self, bucket_name: str, object_name: str, offset: int, length: int) -> bytes:
+        # One ranged GET, e.g. a single blob out of a packed shard
+        if length <= 0:
+            return b""
+        response = self.client.get_object(bucket_name, object_name, offset=offset, length=length)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
     
 def format_value(val):
     if val is None:
@@ -51,6 +257,118 @@ def format_value(val):
     val_str = str(val).replace("'", "''")
     return f"'{val_str}'"
 
+_JSON_ENCODER = json.JSONEncoder()
+
+def format_json_value(buffer: StringIO, row: Dict[str, Any]) -> None:
+    # Escape the encoder chunks as they are produced instead of escaping a full json.dumps copy
+    buffer.write("'")
+    for chunk in _JSON_ENCODER.iterencode(row):
+        buffer.write(chunk.replace("'", "''") if "'" in chunk else chunk)
+    buffer.write("'")
+
+def iter_insert_statements(
+    table_name: str,
+    rows: Iterable[Dict[str, Any]],
+    id_field: str,
+    ingestion_date: str,
+    max_statement_bytes: int = MAX_STATEMENT_BYTES,
+    max_rows: int = MAX_ROWS_PER_STATEMENT,
+    payload_hashes: Optional[Iterable[str]] = None,
+    upsert: bool = False
+) -> Iterator[Tuple[str, int, int]]:
+    # upsert builds MERGE statements replacing the rows with the same repository and id, which must be unique in a call
+    columns = landing_columns(table_name)
+    names = ["id", "ingestion_date", "raw_payload", "payload_hash"] + [column.name for column in columns]
+    if upsert:
+        # Ids are only unique within a repository, forks share commit SHAs
+        on = " AND ".join(
+            ["t.id = s.id"]
+            + [f"t.{column.name} IS NOT DISTINCT FROM s.{column.name}" for column in repo_key_columns(table_name)]
+        )
+        header = f"MERGE INTO {table_name} t\nUSING (\n    VALUES\n"
+        footer = (
+            f"\n) AS s ({', '.join(names)})\n"
+            f"ON {on}\n"
+            f"WHEN MATCHED THEN UPDATE SET {', '.join(f'{name} = s.{name}' for name in names[1:])}\n"
+            f"WHEN NOT MATCHED THEN INSERT ({', '.join(names)}) VALUES ({', '.join(f's.{name}' for name in names)})"
+        )
+    else:
+        header = f"INSERT INTO {table_name} ({', '.join(names)}) VALUES \n"
+        footer = ""
+    overhead = len(header) + len(footer)
+    hashes = iter(payload_hashes) if payload_hashes is not None else None
+    statement = StringIO()
+    statement_rows = 0
+    statement_bytes = 0
+
+    for row in rows:
+        row_sql = StringIO()
+        row_sql.write(f"({format_value(row.get(id_field))}, DATE '{ingestion_date}', ")
+        format_json_value(row_sql, row)
+        row_sql.write(f", '{next(hashes) if hashes is not None else payload_hash(row)}'")
+        for column in columns:
+            row_sql.write(", ")
+            row_sql.write(column.sql_literal(column.extract(row)))
+        row_sql.write(")")
+        value = row_sql.getvalue()
+        # json output is ASCII, so only ids and projected columns with other characters need encoding to be measured
+        value_bytes = len(value) if value.isascii() else len(value.encode("utf-8"))
+
+        if statement_rows and (
+            statement_rows >= max_rows
+            or overhead + statement_bytes + 2 + value_bytes > max_statement_bytes
+        ):
+            yield header + statement.getvalue() + footer, statement_rows, overhead + statement_bytes
+            statement = StringIO()
+            statement_rows = 0
+            statement_bytes = 0
+
+        if statement_rows:
+            statement.write(",\n")
+            statement_bytes += 2
+        statement.write(value)
+        statement_bytes += value_bytes
+        statement_rows += 1
+
+    if statement_rows:
+        yield header + statement.getvalue() + footer, statement_rows, overhead + statement_bytes
+
+# Rows pulled per fetchmany call by the streaming readers
+FETCH_BATCH_ROWS: int = 10_000
+
+_ARROW_TYPES = {
+    "varchar": pa.string(),
+    "char": pa.string(),
+    "boolean": pa.bool_(),
+    "tinyint": pa.int8(),
+    "smallint": pa.int16(),
+    "integer": pa.int32(),
+    "bigint": pa.int64(),
+    "real": pa.float32(),
+    "double": pa.float64(),
+    "date": pa.date32()
+}
+
+
+def arrow_type(trino_type: str) -> Optional[pa.DataType]:
+    # Arrow type for a Trino column type, None lets pyarrow infer it (decimals, arrays, rows...)
+    base = trino_type.split("(", 1)[0].strip()
+    if base == "timestamp":
+        return pa.timestamp("us", tz="UTC") if "with time zone" in trino_type else pa.timestamp("us")
+    return _ARROW_TYPES.get(base)
+
+
+def record_batch(description: List[Any], rows: List[Any]) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=arrow_type(desc[1])) for desc, values in zip(description, zip(*rows))],
+        names=[desc[0] for desc in description]
+    )
+
+def statement_kind(query: str) -> str:
+    # First keyword of the statement (select, insert, merge, alter...), the metrics label for its latency
+    words = query.lstrip().split(None, 1)
+    return words[0].lower() if words else "empty"
+
 class TrinoClient:
     def __init__(
         self,
@@ -58,57 +376,170 @@ class TrinoClient:
         port: int = 8080,
         user: str = "admin",
         catalog: str = "iceberg",
-        schema: str = "landing"
+        schema: str = "landing",
+        pool_size: int = TRINO_POOL_SIZE,
+        connection_factory: Callable[..., Any] = connect,
+        session_properties: Optional[Dict[str, str]] = None
     ):
-        self.conn = connect(
-            host=host,
-            port=port,
-            user=user,
-            catalog=catalog,
-            schema=schema
-        )
+        self.connect_kwargs: Dict[str, Any] = {
+            "host": host,
+            "port": port,
+            "user": user,
+            "catalog": catalog,
+            "schema": schema
+        }
+        if session_properties:
+            # Sent with every statement of every pooled connection, e.g. {"iceberg.target_max_file_size": "128MB"}
+            self.connect_kwargs["session_properties"] = session_properties
+        # trino.dbapi connections are not meant to be shared across threads, every statement checks one out
+        self.pool = TrinoConnectionPool(self.connect_kwargs, size=pool_size, connection_factory=connection_factory)
 
-    def read_table(self, table_name: str) -> pd.DataFrame:
-        cursor = self.conn.cursor()
-        cursor.execute(f'SELECT * FROM {table_name}')
-        columns = [desc[0] for desc in cursor.description]
-        rows = cursor.fetchall()
-        return pd.DataFrame(rows, columns=columns)
+    @contextmanager
+    def _cursor(self, query: str) -> Iterator[Any]:
+        with self.pool.connection() as conn:
+            start = time.perf_counter()
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                yield cursor
+            finally:
+                seconds = time.perf_counter() - start
+                self.pool.record_query(seconds)
+                METRICS.observe("trino_query_duration_seconds", seconds, kind=statement_kind(query))
+
+    def read_table(self, table_name: str, dtype_backend: str = "numpy") -> pd.DataFrame:
+        return self.read_sql(f'SELECT * FROM {table_name}', dtype_backend=dtype_backend)
 
-    def read_sql(self, query: str) -> pd.DataFrame:
-        cursor = self.conn.cursor()
-        cursor.execute(query)
-        columns = [desc[0] for desc in cursor.description]
-        rows = cursor.fetchall()
+    def read_sql(self, query: str, dtype_backend: str = "numpy") -> pd.DataFrame:
+        # dtype_backend="pyarrow" keeps the columns in Arrow memory instead of numpy/object arrays
+        if dtype_backend == "pyarrow":
+            return self.read_arrow(query).to_pandas(types_mapper=pd.ArrowDtype)
+        with self._cursor(query) as cursor:
+            columns = [desc[0] for desc in cursor.description]
+            rows = cursor.fetchall()
         return pd.DataFrame(rows, columns=columns)
-    
-    def insert_raw_payloads(self, table_name: str, rows: List[Dict[str, Any]], id_field: str):
-        if not rows:
-            return
-        
-        ingestion_date = date.today().isoformat()
-        values_sql = []
-        for row in rows:
-            record_id = row.get(id_field)
-            raw_json = json.dumps(row).replace("'", "''")
-            values_sql.append(
-                f"({format_value(record_id)}, DATE '{ingestion_date}', '{raw_json}')"
+
+    def _iter_fetch(self, query: str, batch_size: int) -> Iterator[Tuple[List[Any], List[Any]]]:
+        # Yields (description, rows) per fetchmany call, rows are handed out as they arrive from Trino
+        with self._cursor(query) as cursor:
+            finished = False
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        finished = True
+                        return
+                    yield cursor.description, rows
+            finally:
+                if not finished:
+                    # The caller stopped early, free the query on the coordinator before reusing the connection
+                    cursor.cancel()
+
+    def iter_rows(self, query: str, batch_size: int = FETCH_BATCH_ROWS) -> Iterator[Dict[str, Any]]:
+        for description, rows in self._iter_fetch(query, batch_size):
+            columns = [desc[0] for desc in description]
+            for row in rows:
+                yield dict(zip(columns, row))
+
+    def iter_record_batches(self, query: str, batch_size: int = FETCH_BATCH_ROWS) -> Iterator[pa.RecordBatch]:
+        for description, rows in self._iter_fetch(query, batch_size):
+            yield record_batch(description, rows)
+
+    def read_arrow(self, query: str, batch_size: int = FETCH_BATCH_ROWS) -> pa.Table:
+        with self._cursor(query) as cursor:
+            batches = []
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                batches.append(record_batch(cursor.description, rows))
+            schema = batches[0].schema if batches else pa.schema(
+                [pa.field(desc[0], arrow_type(desc[1]) or pa.string()) for desc in cursor.description]
             )
-        
-        values_sql_str = ",\n".join(values_sql)
-        insert_sql = (
-            f"INSERT INTO {table_name} (id, ingestion_date, raw_payload) VALUES \n{values_sql_str}"
+        return pa.Table.from_batches(batches, schema=schema)
+
+    def _execute_insert(
+        self,
+        table_name: str,
+        batch: int,
+        statement: str,
+        row_count: int,
+        size: int
+    ) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with self._cursor(statement) as cursor:
+            cursor.fetchall()  # Wait for the INSERT to finish
+        METRICS.inc("landing_inserted_rows_total", row_count, table=table_name, writer="trino")
+        METRICS.inc("landing_inserted_bytes_total", size, table=table_name, writer="trino")
+        return {
+            "batch": batch,
+            "rows": row_count,
+            "bytes": size,
+            "seconds": time.perf_counter() - start
+        }
+
+    def insert_raw_payloads(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str,
+        max_statement_bytes: int = MAX_STATEMENT_BYTES,
+        max_rows_per_statement: int = MAX_ROWS_PER_STATEMENT,
+        max_workers: int = 1,
+        payload_hashes: Optional[Iterable[str]] = None,
+        upsert: bool = False
+    ) -> List[Dict[str, Any]]:
+        ingestion_date = date.today().isoformat()
+        statements = iter_insert_statements(
+            table_name,
+            rows,
+            id_field,
+            ingestion_date,
+            max_statement_bytes=max_statement_bytes,
+            max_rows=max_rows_per_statement,
+            payload_hashes=payload_hashes,
+            upsert=upsert
         )
-        
-        cursor = self.conn.cursor()
-        cursor.execute(insert_sql)
+
+        if max_workers <= 1:
+            return [
+                self._execute_insert(table_name, batch, statement, row_count, size)
+                for batch, (statement, row_count, size) in enumerate(statements)
+            ]
+
+        # Keep at most two statements per worker in flight so the rows are never fully materialized
+        results: List[Dict[str, Any]] = []
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch, (statement, row_count, size) in enumerate(statements):
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                pending.add(executor.submit(self._execute_insert, table_name, batch, statement, row_count, size))
+            results.extend(future.result() for future in pending)
+
+        return sorted(results, key=lambda result: result["batch"])
+
+    def upsert_raw_payloads(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str,
+        **kwargs: Any
+    ) -> List[Dict[str, Any]]:
+        # MERGE instead of INSERT: the rows replace those already landed with the same id
+        return self.insert_raw_payloads(table_name, rows, id_field, upsert=True, **kwargs)
+
     def execute_query(self, query: str) -> None:
-        cursor = self.conn.cursor()
-        cursor.execute(query)
+        with self._cursor(query) as cursor:
+            cursor.fetchall()  # Wait for the statement to finish before the next one starts
 
     def execute_sql_file(self, filepath: str) -> None:
         with open(filepath, 'r', encoding='utf-8') as file:
             sql_script = file.read()
         
-        cursor = self.conn.cursor()
-        cursor.execute(sql_script)
+        with self._cursor(sql_script) as cursor:
+            cursor.fetchall()
+
+    def close(self) -> None:
+        self.pool.close()
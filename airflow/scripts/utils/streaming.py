@@ -0,0 +1,48 @@
+import io
+import asyncio
+import aiohttp
+
+
+class AsyncStreamReader(io.RawIOBase):
+    """Blocking file-like view over an aiohttp response body.
+
+    Meant to be read from a worker thread (e.g. by the MinIO client) while the
+    event loop keeps running: each read pulls the next chunks from the loop, so
+    at most one read request worth of data is held in memory.
+    """
+
+    def __init__(
+        self,
+        stream: aiohttp.StreamReader,
+        loop: asyncio.AbstractEventLoop,
+        chunk_size: int = 64 * 1024
+    ):
+        self.stream = stream
+        self.loop = loop
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._buffer = bytearray()
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def _fill(self, size: int) -> None:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = asyncio.run_coroutine_threadsafe(
+                self.stream.read(self.chunk_size), self.loop
+            ).result()
+            if not chunk:
+                self._eof = True
+            self._buffer.extend(chunk)
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+        self.bytes_read += len(data)
+        return data
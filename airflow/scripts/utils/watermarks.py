@@ -0,0 +1,35 @@
+import json
+from typing import Dict, Optional
+from .storage import MinioClient
+
+
+class WatermarkStore:
+    """Last ingested commit per repository, one small JSON object per repo so
+    concurrent runs never overwrite each other's state."""
+
+    def __init__(
+        self,
+        minio_client: MinioClient,
+        bucket_name: str = "state",
+        prefix: str = "watermarks/commits"
+    ):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def _object_name(self, owner_repo: str) -> str:
+        return f"{self.prefix}/{owner_repo}.json"
+
+    def get(self, owner_repo: str) -> Optional[Dict[str, str]]:
+        data = self.minio_client.download_bytes(self.bucket_name, self._object_name(owner_repo))
+        return json.loads(data) if data else None
+
+    def advance(self, owner_repo: str, sha: str, committed_at: str) -> None:
+        # A single PUT replaces the object atomically, so readers see either the old or the new mark
+        payload = json.dumps({"sha": sha, "committed_at": committed_at}).encode("utf-8")
+        self.minio_client.upload_bytes(
+            self.bucket_name,
+            self._object_name(owner_repo),
+            payload,
+            content_type="application/json"
+        )
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts import their helpers as the top level `utils` package, as when they run from src/scripts
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "scripts")
+if SCRIPTS_DIR not in sys.path:
+    sys.path.insert(0, SCRIPTS_DIR)
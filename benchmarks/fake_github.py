@@ -0,0 +1,399 @@
+import io
+import re
+import json
+import math
+import time
+import random
+import tarfile
+import hashlib
+import threading
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from utils.github import endpoint_name
+from utils.rate_limit import resource_for_path
+
+BASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def git_blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\x00" % len(content) + content).hexdigest()
+
+
+def iso(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeDataset:
+    """Deterministic set of repositories, commits and files served by the fake
+    GitHub API. The same parameters always produce the same payloads, so the
+    benchmark can derive every stage's input without running the previous one."""
+
+    def __init__(
+        self,
+        repos: int = 20,
+        commits_per_repo: int = 15,
+        files_per_commit: int = 5,
+        file_size: int = 16 * 1024
+    ):
+        self.repos = repos
+        self.commits_per_repo = commits_per_repo
+        self.files_per_commit = files_per_commit
+        self.file_size = file_size
+        self._repo_names = [f"bench-org-{i % 10}/repo-{i}" for i in range(repos)]
+        self._commit_index = {
+            (repo, self.commit_sha(repo, n)): n
+            for repo in self.repo_names()
+            for n in range(commits_per_repo)
+        }
+
+    def config(self) -> Dict[str, int]:
+        return {
+            "repos": self.repos,
+            "commits_per_repo": self.commits_per_repo,
+            "files_per_commit": self.files_per_commit,
+            "file_size": self.file_size
+        }
+
+    def repo_names(self) -> List[str]:
+        return self._repo_names
+
+    def repository(self, index: int) -> Dict[str, Any]:
+        full_name = self._repo_names[index]
+        owner, name = full_name.split("/")
+        return {
+            "id": 1000 + index,
+            "name": name,
+            "full_name": full_name,
+            "owner": {"login": owner, "type": "Organization"},
+            "private": False,
+            "html_url": f"https://github.com/{full_name}",
+            "description": f"Benchmark repository {index}",
+            "created_at": iso(BASE_DATE - timedelta(days=365 + index)),
+            "pushed_at": iso(BASE_DATE + timedelta(hours=self.commits_per_repo)),
+            "stargazers_count": 100_000 - index,
+            "language": "Python",
+            "default_branch": "main"
+        }
+
+    @staticmethod
+    def commit_sha(repo: str, n: int) -> str:
+        return hashlib.sha1(f"{repo}:commit:{n}".encode("utf-8")).hexdigest()
+
+    def commit_index(self, repo: str, sha: str) -> Optional[int]:
+        return self._commit_index.get((repo, sha))
+
+    def commit(self, repo: str, n: int) -> Dict[str, Any]:
+        committed_at = iso(BASE_DATE + timedelta(hours=n))
+        author = {"name": f"Author {n % 7}", "email": f"author{n % 7}@example.com", "date": committed_at}
+        return {
+            "sha": self.commit_sha(repo, n),
+            "commit": {
+                "author": author,
+                "committer": author,
+                "message": f"Change {n} of {repo}\n\nTouches {self.files_per_commit} files."
+            },
+            "parents": [{"sha": self.commit_sha(repo, n - 1)}] if n else []
+        }
+
+    def file_paths(self, n: int) -> List[str]:
+        # Every commit touches a different set of paths, so no blob is shared between commits
+        return [f"src/module_{n}_{k}.py" for k in range(self.files_per_commit)]
+
+    @lru_cache(maxsize=4096)
+    def content(self, repo: str, n: int, path: str) -> bytes:
+        line = hashlib.sha256(f"{repo}:{n}:{path}".encode("utf-8")).hexdigest().encode("ascii") + b"\n"
+        return (line * (self.file_size // len(line) + 1))[:self.file_size]
+
+    @lru_cache(maxsize=4096)
+    def before_content(self, repo: str, n: int, path: str) -> bytes:
+        # The file at the parent of commit n: the lines added by its patch are missing, the deleted ones still there
+        lines = self.content(repo, n, path).splitlines(keepends=True)
+        additions, deletions = self.line_changes(n, path)
+        removed = [f"removed line {i}\n".encode("ascii") for i in range(deletions)]
+        return b"".join(lines[:4] + removed + lines[4 + additions:])
+
+    def line_changes(self, n: int, path: str) -> Tuple[int, int]:
+        # (additions, deletions) of the k-th file of a commit
+        k = self.file_paths(n).index(path)
+        return 10 + k, k
+
+    def patch(self, repo: str, n: int, path: str) -> Optional[str]:
+        # One hunk replacing lines 5 on, with three lines of context around it
+        lines = self.content(repo, n, path).decode("ascii").splitlines(keepends=True)
+        additions, deletions = self.line_changes(n, path)
+        if len(lines) < 4 + additions + 3:
+            return None
+        header = f"@@ -2,{6 + deletions} +2,{6 + additions} @@\n"
+        body = (
+            [" " + line for line in lines[1:4]]
+            + [f"-removed line {i}\n" for i in range(deletions)]
+            + ["+" + line for line in lines[4:4 + additions]]
+            + [" " + line for line in lines[4 + additions:7 + additions]]
+        )
+        return (header + "".join(body)).rstrip("\n")
+
+    def commit_files(self, repo: str, n: int) -> List[Dict[str, Any]]:
+        files = []
+        for k, path in enumerate(self.file_paths(n)):
+            additions, deletions = self.line_changes(n, path)
+            file = {
+                "sha": git_blob_sha(self.content(repo, n, path)),
+                "filename": path,
+                "status": "modified" if n else "added",
+                "additions": additions,
+                "deletions": deletions,
+                "changes": additions + deletions
+            }
+            # GitHub leaves the patch out of large diffs, here the last file of every fifth commit
+            patch = self.patch(repo, n, path) if n else "@@ -0,0 +1,2 @@\n+line 0\n+line 1"
+            if patch and not (n % 5 == 4 and k == self.files_per_commit - 1):
+                file["patch"] = patch
+            files.append(file)
+        return files
+
+    def commit_detail(self, repo: str, n: int) -> Dict[str, Any]:
+        files = self.commit_files(repo, n)
+        additions = sum(f["additions"] for f in files)
+        deletions = sum(f["deletions"] for f in files)
+        return {
+            **self.commit(repo, n),
+            "stats": {"total": additions + deletions, "additions": additions, "deletions": deletions},
+            "files": files
+        }
+
+    @lru_cache(maxsize=256)
+    def tarball(self, repo: str, n: int) -> bytes:
+        owner, name = repo.split("/")
+        top = f"{owner}-{name}-{self.commit_sha(repo, n)[:7]}"
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            for path in self.file_paths(n):
+                content = self.content(repo, n, path)
+                info = tarfile.TarInfo(f"{top}/{path}")
+                info.size = len(content)
+                archive.addfile(info, io.BytesIO(content))
+        return buffer.getvalue()
+
+    def iter_commits(self) -> Iterator[Tuple[str, str]]:
+        # (repo, sha) of every commit, as landed by the commits stage
+        for repo in self.repo_names():
+            for n in range(self.commits_per_repo):
+                yield repo, self.commit_sha(repo, n)
+
+    def iter_changed_file_rows(self) -> Iterator[Dict[str, Any]]:
+        # Rows of landing.commit_files with the parent of their commit, as read by the before-states stage
+        for repo, sha in self.iter_commits():
+            n = self.commit_index(repo, sha)
+            for f in self.commit_files(repo, n):
+                yield {
+                    "id": f"{sha}_{f['filename'].replace('/', '_')}",
+                    "repo_id": repo,
+                    "commit_sha": sha,
+                    "file_path": f["filename"],
+                    "blob_sha": f["sha"],
+                    "status": f["status"],
+                    "additions": f["additions"],
+                    "deletions": f["deletions"],
+                    "changes": f["changes"],
+                    "previous_file_path": None,
+                    "patch": f.get("patch"),
+                    "parent_sha": self.commit_sha(repo, n - 1) if n else None
+                }
+
+    def iter_file_rows(self) -> Iterator[Dict[str, str]]:
+        # Rows of curated.commit_files, as read by the blobs stage
+        for repo, sha in self.iter_commits():
+            n = self.commit_index(repo, sha)
+            for f in self.commit_files(repo, n):
+                yield {
+                    "object_name": f"{sha}_{f['filename'].replace('/', '_')}",
+                    "file_path": f["filename"],
+                    "commit_sha": sha,
+                    "repo_id": repo,
+                    "blob_sha": f["sha"]
+                }
+
+
+class FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections opened together by the workers, retried a second later
+    request_queue_size = 256
+
+
+class FakeGitHubServer:
+    """Local HTTP server answering the REST endpoints used by the extractors.
+
+    Every response is delayed by `latency` seconds (+/- `jitter` of it) and
+    carries X-RateLimit-* headers for a fixed window of `rate_limit` requests
+    per token and resource, answering 403 "rate limit exceeded" once it is used
+    up. Requests, rate limited responses and body bytes are counted per endpoint.
+    """
+
+    def __init__(
+        self,
+        dataset: FakeDataset,
+        latency: float = 0.02,
+        jitter: float = 0.5,
+        rate_limit: int = 5000,
+        rate_limit_window: float = 3600.0,
+        host: str = "127.0.0.1",
+        port: int = 0
+    ):
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self._windows: Dict[Tuple[str, str], List[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._server = FakeHTTPServer((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGitHubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeGitHubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+    def _record(self, path: str, status: int, size: int) -> None:
+        with self._lock:
+            counts = self._counts.setdefault(endpoint_name(path), {"requests": 0, "rate_limited": 0, "bytes": 0})
+            counts["requests"] += 1
+            counts["rate_limited"] += status == 403
+            counts["bytes"] += size
+
+    def _take_budget(self, token: str, resource: str) -> Tuple[bool, Dict[str, str]]:
+        # Fixed windows like GitHub's: the budget is refilled at the reset time
+        with self._lock:
+            now = time.time()
+            window = self._windows.setdefault((token, resource), [now, 0])
+            if now >= window[0] + self.rate_limit_window:
+                window[0], window[1] = now, 0
+            allowed = window[1] < self.rate_limit
+            window[1] += allowed
+            headers = {
+                "X-RateLimit-Limit": str(self.rate_limit),
+                "X-RateLimit-Remaining": str(self.rate_limit - window[1]),
+                "X-RateLimit-Reset": str(math.ceil(window[0] + self.rate_limit_window)),
+                "X-RateLimit-Resource": resource
+            }
+        return allowed, headers
+
+    def route(self, path: str, query: Dict[str, str]) -> Tuple[int, Any, str]:
+        # Returns (status, body, content type), dict and list bodies are sent as JSON
+        dataset = self.dataset
+        if path == "/search/repositories":
+            per_page, page = int(query.get("per_page", 30)), int(query.get("page", 1))
+            indexes = range((page - 1) * per_page, min(page * per_page, dataset.repos))
+            return 200, {"total_count": dataset.repos, "items": [dataset.repository(i) for i in indexes]}, "json"
+
+        match = re.fullmatch(r"/repos/([^/]+/[^/]+)/(commits|contents|tarball)(?:/(.+))?", path)
+        if not match or match.group(1) not in dataset.repo_names():
+            return 404, {"message": "Not Found"}, "json"
+        repo, kind, rest = match.groups()
+
+        if kind == "commits" and rest is None:
+            per_page, page = int(query.get("per_page", 30)), int(query.get("page", 1))
+            since = query.get("since")
+            newest_first = range(dataset.commits_per_repo - 1, -1, -1)
+            commits = [dataset.commit(repo, n) for n in newest_first]
+            if since:
+                commits = [c for c in commits if c["commit"]["committer"]["date"] >= since]
+            return 200, commits[(page - 1) * per_page:page * per_page], "json"
+        if kind == "commits":
+            n = dataset.commit_index(repo, rest)
+            if n is None:
+                return 404, {"message": "No commit found for SHA: " + rest}, "json"
+            return 200, dataset.commit_detail(repo, n), "json"
+        if kind == "contents":
+            n = dataset.commit_index(repo, query.get("ref", ""))
+            if n is None:
+                return 404, {"message": "Not Found"}, "json"
+            if rest in dataset.file_paths(n):
+                return 200, dataset.content(repo, n, rest), "raw"
+            if n + 1 < dataset.commits_per_repo and rest in dataset.file_paths(n + 1):
+                # A path changed by the next commit, as it was before it
+                return 200, dataset.before_content(repo, n + 1, rest), "raw"
+            return 404, {"message": "Not Found"}, "json"
+
+        n = dataset.commit_index(repo, rest or "")
+        if n is None:
+            return 404, {"message": "Not Found"}, "json"
+        return 200, dataset.tarball(repo, n), "tarball"
+
+    def _handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, Nagle would hold the body for the delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: Dict[str, str]) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                parts = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+                token = self.headers.get("Authorization", "anonymous")
+                resource = resource_for_path(parts.path)
+
+                if server.latency:
+                    time.sleep(server.latency * (1 + server.jitter * (2 * random.random() - 1)))
+
+                allowed, headers = server._take_budget(token, resource)
+                if not allowed:
+                    body = json.dumps({"message": "API rate limit exceeded"}).encode("utf-8")
+                    server._record(parts.path, 403, len(body))
+                    self._send(403, body, "application/json", headers)
+                    return
+
+                status, payload, kind = server.route(parts.path, query)
+                if kind == "json":
+                    body = json.dumps(payload).encode("utf-8")
+                    content_type = "application/json"
+                    if isinstance(payload, list) and len(payload) == int(query.get("per_page", 30)):
+                        # A full page may be followed by another one
+                        page = int(query.get("page", 1))
+                        next_query = urlencode({**query, "page": page + 1})
+                        headers["Link"] = f'<http://{self.headers["Host"]}{parts.path}?{next_query}>; rel="next"'
+                elif kind == "tarball":
+                    body, content_type = payload, "application/x-gzip"
+                else:
+                    body, content_type = payload, "application/octet-stream"
+                server._record(parts.path, status, len(body))
+                self._send(status, body, content_type, headers)
+
+        return Handler
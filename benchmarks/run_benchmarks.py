@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+RESULTS_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+BENCH_TOKEN = "bench-token"
+# Metrics compared with a previous run, True when higher is better
+COMPARED_METRICS: Dict[str, bool] = {
+    "items_per_second": True,
+    "github.p50_ms": False,
+    "github.p99_ms": False,
+    "peak_rss_mb": False
+}
+STAGES = ("repos", "commits", "commit_details", "blobs", "before_states")
+# Below this many requests, latency and throughput are mostly noise
+MIN_COMPARED_REQUESTS: int = 20
+
+
+def env_setting(value: str) -> Tuple[str, str]:
+    key, separator, setting = value.partition("=")
+    if not key or not separator:
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got '{value}'")
+    return key, setting
+
+
+def pipeline_env(args: argparse.Namespace) -> Dict[str, str]:
+    env = {
+        # Results must not depend on a response cache left by a previous run
+        "GITHUB_CACHE_PATH": "",
+        "LANDING_WRITER": "trino",
+        "INITIAL_COMMIT_LIMIT": str(args.commits_per_repo)
+    }
+    env.update(args.env)
+    return env
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def diff_counts(before: Dict[str, Dict[str, int]], after: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+    diff = {}
+    for endpoint, counts in after.items():
+        previous = before.get(endpoint, {})
+        delta = {key: value - previous.get(key, 0) for key, value in counts.items()}
+        if delta["requests"]:
+            diff[endpoint] = delta
+    return diff
+
+
+def metric(result: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = result
+    for key in path.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    rate_limited = sum(counts["rate_limited"] for counts in result["server"].values())
+    print(
+        f"{result['stage']}: {result['items']} items in {result['seconds']:.2f}s "
+        f"({result['items_per_second']:.1f}/s), {result['github']['requests']} GitHub requests "
+        f"(p50 {result['github']['p50_ms']:.1f} ms, p99 {result['github']['p99_ms']:.1f} ms, "
+        f"{rate_limited} rate limited), {result['trino']['statements']} Trino statements, "
+        f"{result['minio']['objects']} MinIO objects, peak RSS {result['peak_rss_mb']:.0f} MB"
+    )
+
+
+def run_stages(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported once the pipeline environment is set, the scripts read it at import time
+    from benchmarks.fake_github import FakeDataset, FakeGitHubServer
+    from benchmarks.stages import run_stage
+
+    dataset = FakeDataset(
+        repos=args.repos,
+        commits_per_repo=args.commits_per_repo,
+        files_per_commit=args.files_per_commit,
+        file_size=args.file_size
+    )
+    config = {
+        "dataset": dataset.config(),
+        "token": BENCH_TOKEN,
+        "trino_latency": args.trino_latency_ms / 1000,
+        "minio_latency": args.minio_latency_ms / 1000,
+        "verbose": args.verbose
+    }
+    server = FakeGitHubServer(
+        dataset,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        rate_limit_window=args.rate_limit_window
+    )
+
+    results = {}
+    with server:
+        config["base_url"] = server.url
+        for stage in args.stages:
+            before = server.counts()
+            # A fresh process per stage, so imports, pools and peak memory are not shared between stages
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(run_stage, stage, config).result()
+            result["server"] = diff_counts(before, server.counts())
+            print_result(result)
+            results[stage] = result
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {
+            **config,
+            "latency_ms": args.latency_ms,
+            "jitter": args.jitter,
+            "rate_limit": args.rate_limit,
+            "rate_limit_window": args.rate_limit_window,
+            "env": pipeline_env(args)
+        },
+        "stages": results
+    }
+
+
+def compare(report: Dict[str, Any], previous: Dict[str, Any], max_regression: float) -> List[str]:
+    if {**report["config"], "base_url": None} != {**previous["config"], "base_url": None}:
+        print("Warning: the previous run used a different configuration, the comparison may not be meaningful")
+
+    regressions = []
+    print(f"Compared with {previous.get('revision') or 'unknown revision'} from {previous['created_at']}:")
+    for stage, result in report["stages"].items():
+        previous_result = previous["stages"].get(stage)
+        if previous_result is None or result["github"]["requests"] < MIN_COMPARED_REQUESTS:
+            continue
+        for path, higher_is_better in COMPARED_METRICS.items():
+            current, before = metric(result, path), metric(previous_result, path)
+            if current is None or not before:
+                continue
+            change = (current - before) / before
+            regressed = (-change if higher_is_better else change) > max_regression
+            print(
+                f"  {stage} {path}: {before:.2f} -> {current:.2f} ({change:+.1%})"
+                + (" REGRESSION" if regressed else "")
+            )
+            if regressed:
+                regressions.append(f"{stage} {path}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run the extraction stages against a fake GitHub API and in-memory Trino/MinIO stand-ins"
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repos", type=int, default=20)
+    parser.add_argument("--commits-per-repo", type=int, default=15)
+    parser.add_argument("--files-per-commit", type=int, default=5)
+    parser.add_argument("--file-size", type=int, default=16 * 1024, help="size of every file in bytes")
+    parser.add_argument("--latency-ms", type=float, default=20, help="fake GitHub response latency")
+    parser.add_argument("--jitter", type=float, default=0.5, help="latency varies by +/- this fraction")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="requests per window, token and resource")
+    parser.add_argument("--rate-limit-window", type=float, default=3600, help="rate limit window in seconds")
+    parser.add_argument("--trino-latency-ms", type=float, default=5, help="duration of every Trino statement")
+    parser.add_argument("--minio-latency-ms", type=float, default=0, help="duration of every MinIO upload")
+    parser.add_argument(
+        "--env", action="append", type=env_setting, default=[], metavar="KEY=VALUE",
+        help="pipeline setting for the stages, e.g. BLOB_WORKERS=40 (repeatable)"
+    )
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    parser.add_argument(
+        "--max-regression", type=float, default=0.2,
+        help="relative change counted as a regression by --compare, exits with status 1"
+    )
+    parser.add_argument("--verbose", action="store_true", help="show the output of the stages")
+    args = parser.parse_args()
+
+    os.environ.update(pipeline_env(args))
+    report = run_stages(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
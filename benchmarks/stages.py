@@ -0,0 +1,201 @@
+import io
+import os
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict
+
+from benchmarks.fake_github import FakeDataset
+
+
+def rss_mb() -> float:
+    # Peak resident set size of this process, ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def landing_writer(trino: Any) -> Any:
+    # The production writer for LANDING_WRITE_MODE, with a payload index that has seen nothing yet
+    from utils import get_landing_writer
+
+    return get_landing_writer(trino, os.path.join(tempfile.mkdtemp(prefix="payload-index-"), "payload_index.sqlite"))
+
+
+def run_repos(dataset: FakeDataset, github: Any, trino: Any, minio: Any) -> Callable[[], Dict[str, Any]]:
+    from extract_repos_from_github import discover_repositories_with_full_metadata
+
+    writer = landing_writer(trino)
+
+    def run() -> Dict[str, Any]:
+        repos = discover_repositories_with_full_metadata(github, limit=dataset.repos)
+        writer.insert_raw_payloads(table_name="iceberg.landing.repositories", rows=repos, id_field="full_name")
+        return {"items": len(repos)}
+
+    return run
+
+
+def run_commits(dataset: FakeDataset, github: Any, trino: Any, minio: Any) -> Callable[[], Dict[str, Any]]:
+    from utils import WatermarkStore
+    from extract_commits_from_github import extract_with_rest
+
+    repo_names = dataset.repo_names()
+    writer = landing_writer(trino)
+
+    def run() -> Dict[str, Any]:
+        return {"items": extract_with_rest(github, writer, WatermarkStore(minio), repo_names)}
+
+    return run
+
+
+def fresh_ledger(stage: str) -> Any:
+    # Nothing is finished yet, like the first attempt of a run
+    from utils import WorkLedger
+
+    return WorkLedger(stage, "benchmark", path=os.path.join(tempfile.mkdtemp(prefix="work-ledger-"), "ledger.sqlite"))
+
+
+def run_commit_details(dataset: FakeDataset, github: Any, trino: Any, minio: Any) -> Callable[[], Dict[str, Any]]:
+    from extract_commits_details_from_github import extract_commit_details
+
+    commits = [{"sha": sha, "repo_id": repo} for repo, sha in dataset.iter_commits()]
+    ledger = fresh_ledger("commit_details")
+    landing = landing_writer(trino)
+
+    def run() -> Dict[str, Any]:
+        submitted, writer = extract_commit_details(github, landing, commits, ledger=ledger)
+        ledger.close()
+        return {"items": submitted, "rows": int(writer.stats["rows"]), "failed_rows": int(writer.stats["failed_rows"])}
+
+    return run
+
+
+def run_blobs(dataset: FakeDataset, github: Any, trino: Any, minio: Any) -> Callable[[], Dict[str, Any]]:
+    from utils.work_ledger import FAILED
+    from extract_blob_files import FetchPlan, create_blob_store, store_blobs_with_retries
+
+    # The fresh index makes every blob missing, like a first run
+    index_dir = tempfile.mkdtemp(prefix="blob-index-")
+    blob_store = create_blob_store(minio, "repositories", index_path=os.path.join(index_dir, "blob_index.sqlite"))
+    # Ordered by commit, like the Trino query
+    files = list(dataset.iter_file_rows())
+    ledger = fresh_ledger("blobs")
+
+    async def fetch(plan: FetchPlan) -> Any:
+        try:
+            stats = await store_blobs_with_retries(github, blob_store, plan.iter_items(files), ledger)
+            plan.link_duplicates()
+            return stats
+        finally:
+            blob_store.close()
+            await github.aclose()
+
+    def run() -> Dict[str, Any]:
+        plan = FetchPlan(blob_store, ledger.finished_keys((FAILED,)))
+        stats = asyncio.run(fetch(plan))
+        ledger.close()
+        return {
+            "items": stats.files,
+            "blobs": stats.blobs,
+            "bytes": stats.bytes,
+            "failures": stats.failures,
+            "tarballs": plan.tarballs
+        }
+
+    return run
+
+
+def run_before_states(dataset: FakeDataset, github: Any, trino: Any, minio: Any) -> Callable[[], Dict[str, Any]]:
+    from extract_blob_files import create_blob_store
+    from reconstruct_before_states import FAILED, PARENT, PATCH, reconstruct_before_states
+
+    # The after-states are stored beforehand like the blobs stage does, only the reconstruction is measured.
+    # They are read back, so the stand-in keeps the content of every object, packed shards included
+    minio.client.keep_bytes = sys.maxsize
+    index_dir = tempfile.mkdtemp(prefix="blob-index-")
+    blob_store = create_blob_store(minio, "repositories", index_path=os.path.join(index_dir, "blob_index.sqlite"))
+    files = list(dataset.iter_changed_file_rows())
+    for file in files:
+        if file["status"] != "added" and not blob_store.has(file["blob_sha"]):
+            n = dataset.commit_index(file["repo_id"], file["commit_sha"])
+            blob_store.put(file["blob_sha"], dataset.content(file["repo_id"], n, file["file_path"]))
+    blob_store.flush()
+    minio.stats.update(objects=0, bytes=0, seconds=0.0)
+    writer = landing_writer(trino)
+
+    def run() -> Dict[str, Any]:
+        try:
+            methods, _ = reconstruct_before_states(github, blob_store, writer, files)
+        finally:
+            blob_store.close()
+        return {
+            "items": sum(methods.values()),
+            "from_patch": methods[PATCH],
+            "from_parent": methods[PARENT],
+            "failures": methods[FAILED]
+        }
+
+    return run
+
+
+STAGE_RUNNERS = {
+    "repos": run_repos,
+    "commits": run_commits,
+    "commit_details": run_commit_details,
+    "blobs": run_blobs,
+    "before_states": run_before_states
+}
+
+
+def run_stage(stage: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one stage against the fake GitHub server and the in-memory stand-ins.
+
+    Meant to be the only work of a fresh process, which inherits the pipeline
+    settings through its environment: they are read when the scripts are
+    imported, and the peak RSS is only meaningful for a process that ran
+    nothing else.
+    """
+    from utils import METRICS
+    from benchmarks.stand_ins import InMemoryMinioClient, InMemoryTrinoClient, RecordingGitHubClient, percentile
+
+    dataset = FakeDataset(**config["dataset"])
+    github = RecordingGitHubClient(tokens=[config["token"]], base_url=config["base_url"])
+    trino = InMemoryTrinoClient(latency=config["trino_latency"])
+    minio = InMemoryMinioClient(latency=config["minio_latency"])
+    run = STAGE_RUNNERS[stage](dataset, github, trino, minio)
+    baseline_rss = rss_mb()
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(sys.stdout if config["verbose"] else output):
+        result = run()
+    seconds = time.perf_counter() - start
+    minio.close()
+    trino.close()
+    github.close()
+
+    pool_stats = trino.pool.stats()
+    result.update({
+        "stage": stage,
+        "seconds": seconds,
+        "items_per_second": result["items"] / max(seconds, 1e-9),
+        "github": {
+            "requests": len(github.latencies),
+            "p50_ms": percentile(github.latencies, 0.50) * 1000,
+            "p99_ms": percentile(github.latencies, 0.99) * 1000
+        },
+        "trino": {
+            **trino.statements.stats(),
+            "checkouts": int(pool_stats["checkouts"]),
+            "max_wait_ms": pool_stats["max_wait_seconds"] * 1000
+        },
+        "minio": {"objects": int(minio.stats["objects"]), "bytes": int(minio.stats["bytes"])},
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": rss_mb(),
+        "printed_lines": output.getvalue().count("\n"),
+        "time_breakdown_seconds": METRICS.time_breakdown()
+    })
+    if "bytes" in result:
+        result["mb_per_second"] = result["bytes"] / 1024 / 1024 / max(seconds, 1e-9)
+    return result
@@ -0,0 +1,218 @@
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from minio.error import S3Error
+from utils import GitHubClient, MinioClient, TrinoClient
+from utils.trino_pool import TRINO_POOL_SIZE
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    # Nearest rank, 0.0 for an empty sample
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class StatementLog:
+    """Statements received by the in-memory Trino connections."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.statements = 0
+        self.bytes = 0
+        self.inserted_rows = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation: str) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        rows = 0
+        if operation.lstrip().upper().startswith(("INSERT", "MERGE")):
+            # Rows are separated by ",\n" and JSON payloads never hold a raw newline
+            rows = operation.count(",\n") + 1
+        with self._lock:
+            self.statements += 1
+            self.bytes += len(operation)
+            self.inserted_rows += rows
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"statements": self.statements, "bytes": self.bytes, "inserted_rows": self.inserted_rows}
+
+
+class InMemoryCursor:
+    def __init__(self, log: StatementLog):
+        self.log = log
+        self.description: Optional[List[Any]] = None
+        self._rows: List[Any] = []
+
+    def execute(self, operation: str, params: Any = None) -> None:
+        self.log.record(operation)
+        # Only the pool health check returns rows, the stages' inputs come from the fake dataset
+        self._rows = [[1]] if operation.strip().upper() == "SELECT 1" else []
+        self.description = [("_col0", "integer")] if self._rows else []
+
+    def fetchall(self) -> List[Any]:
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size: int) -> List[Any]:
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def cancel(self) -> None:
+        self._rows = []
+
+
+class InMemoryTrinoConnection:
+    def __init__(self, log: StatementLog):
+        self.log = log
+
+    def cursor(self) -> InMemoryCursor:
+        return InMemoryCursor(self.log)
+
+    def close(self) -> None:
+        pass
+
+
+class InMemoryTrinoClient(TrinoClient):
+    """TrinoClient whose pooled connections only record the statements, so the
+    statement building, batching and pooling code runs as in production.
+    Every statement takes `latency` seconds."""
+
+    def __init__(self, latency: float = 0.0, pool_size: int = TRINO_POOL_SIZE):
+        self.statements = StatementLog(latency)
+        super().__init__(
+            pool_size=pool_size,
+            connection_factory=lambda **kwargs: InMemoryTrinoConnection(self.statements)
+        )
+
+
+class StoredObject:
+    def __init__(self, object_name: str, size: int, etag: str, data: Optional[bytes]):
+        self.object_name = object_name
+        self.size = size
+        self.etag = etag
+        self.data = data
+
+
+class ObjectResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read(self) -> bytes:
+        return self.data
+
+    def close(self) -> None:
+        pass
+
+    def release_conn(self) -> None:
+        pass
+
+
+class InMemoryObjectStore:
+    """Stand-in for the minio.Minio calls made by MinioClient and BlobStore.
+
+    Uploads are read to the end in part sized reads like the real client, but
+    only objects up to `keep_bytes` (state files) keep their content, larger
+    ones only their size and MD5 so blobs do not inflate the measured memory.
+    """
+
+    def __init__(self, latency: float = 0.0, keep_bytes: int = 64 * 1024):
+        self.latency = latency
+        self.keep_bytes = keep_bytes
+        self.buckets: Dict[str, Dict[str, StoredObject]] = {}
+        self._lock = threading.Lock()
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name: str) -> None:
+        with self._lock:
+            self.buckets.setdefault(bucket_name, {})
+
+    def _error(self, code: str, bucket_name: str, object_name: str = "") -> S3Error:
+        return S3Error(
+            response=None,
+            code=code,
+            message=code,
+            resource=f"/{bucket_name}/{object_name}",
+            request_id=None,
+            host_id=None,
+            bucket_name=bucket_name,
+            object_name=object_name
+        )
+
+    def put_object(
+        self,
+        bucket_name: str,
+        object_name: str,
+        data: Any,
+        length: int,
+        part_size: int = 0,
+        **kwargs: Any
+    ) -> StoredObject:
+        if bucket_name not in self.buckets:
+            raise self._error("NoSuchBucket", bucket_name, object_name)
+        if self.latency:
+            time.sleep(self.latency)
+        read_size = part_size or 5 * 1024 * 1024
+        digest = hashlib.md5()
+        kept = bytearray()
+        size = 0
+        while length < 0 or size < length:
+            chunk = data.read(read_size if length < 0 else min(read_size, length - size))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if size <= self.keep_bytes:
+                kept.extend(chunk)
+        stored = StoredObject(object_name, size, digest.hexdigest(), bytes(kept) if size <= self.keep_bytes else None)
+        with self._lock:
+            self.buckets[bucket_name][object_name] = stored
+        return stored
+
+    def get_object(self, bucket_name: str, object_name: str, offset: int = 0, length: int = 0) -> ObjectResponse:
+        stored = self.buckets.get(bucket_name, {}).get(object_name)
+        if stored is None:
+            raise self._error("NoSuchKey", bucket_name, object_name)
+        if stored.data is None:
+            raise ValueError(f"Content of {object_name} ({stored.size} bytes) was not kept")
+        return ObjectResponse(stored.data[offset:offset + length] if length else stored.data[offset:])
+
+    def stat_object(self, bucket_name: str, object_name: str) -> StoredObject:
+        stored = self.buckets.get(bucket_name, {}).get(object_name)
+        if stored is None:
+            raise self._error("NoSuchKey", bucket_name, object_name)
+        return stored
+
+    def list_objects(self, bucket_name: str, prefix: str = "", recursive: bool = False) -> Iterator[StoredObject]:
+        with self._lock:
+            objects = list(self.buckets.get(bucket_name, {}).values())
+        return (obj for obj in objects if obj.object_name.startswith(prefix))
+
+
+class InMemoryMinioClient(MinioClient):
+    """MinioClient writing to an InMemoryObjectStore: upload threads, batching
+    and throughput accounting are the production ones."""
+
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.client = InMemoryObjectStore(latency)
+
+
+class RecordingGitHubClient(GitHubClient):
+    """GitHubClient keeping the latency of every request for percentiles."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.latencies: List[float] = []
+
+    def _record(self, url: str, status: int, seconds: float) -> None:
+        super()._record(url, status, seconds)
+        with self._stats_lock:
+            self.latencies.append(seconds)
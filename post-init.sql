@@ -3,7 +3,11 @@ CREATE SCHEMA iceberg.curated WITH (location = 's3://iceberg/curated');
 CREATE TABLE iceberg.landing.repositories (
     id VARCHAR,
     ingestion_date DATE,
-    raw_payload VARCHAR
+    raw_payload VARCHAR,
+    payload_hash VARCHAR,
+    repo_id VARCHAR,
+    created_at TIMESTAMP(6) WITH TIME ZONE,
+    pushed_at TIMESTAMP(6) WITH TIME ZONE
 )
 WITH (
     format = 'PARQUET',
@@ -13,7 +17,16 @@ WITH (
 CREATE TABLE iceberg.landing.commits (
     id VARCHAR,
     ingestion_date DATE,
-    raw_payload VARCHAR
+    raw_payload VARCHAR,
+    payload_hash VARCHAR,
+    commit_sha VARCHAR,
+    owner VARCHAR,
+    repo VARCHAR,
+    author_name VARCHAR,
+    author_email VARCHAR,
+    author_date TIMESTAMP(6) WITH TIME ZONE,
+    message VARCHAR,
+    parent_sha VARCHAR
 )
 WITH (
     format = 'PARQUET',
@@ -22,7 +35,33 @@ WITH (
 CREATE TABLE iceberg.landing.commit_files (
     id VARCHAR,
     ingestion_date DATE,
-    raw_payload VARCHAR
+    raw_payload VARCHAR,
+    payload_hash VARCHAR,
+    repo_id VARCHAR,
+    commit_sha VARCHAR,
+    blob_sha VARCHAR,
+    filename VARCHAR,
+    status VARCHAR,
+    additions INTEGER,
+    deletions INTEGER,
+    changes INTEGER
+)
+WITH (
+    format = 'PARQUET',
+    partitioning = ARRAY['ingestion_date']
+);
+CREATE TABLE iceberg.landing.commit_file_before_states (
+    id VARCHAR,
+    ingestion_date DATE,
+    raw_payload VARCHAR,
+    payload_hash VARCHAR,
+    repo_id VARCHAR,
+    commit_sha VARCHAR,
+    parent_sha VARCHAR,
+    file_path VARCHAR,
+    before_file_path VARCHAR,
+    before_blob_sha VARCHAR,
+    method VARCHAR
 )
 WITH (
     format = 'PARQUET',
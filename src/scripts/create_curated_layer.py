@@ -1,75 +1,317 @@
-from utils import TrinoClient
+import argparse
+from typing import Callable, List, Optional, Tuple
+from utils import TrinoClient, stage_run
 
-query_create_curated_commit_files = """
-        CREATE TABLE iceberg.curated.commit_files AS
+STATE_TABLE = "iceberg.curated.curation_state"
 
+COMMIT_FILES_COLUMNS = [
+    "id", "ingestion_date", "repo_id", "commit_sha", "blob_sha", "file_path", "status",
+    "lines_added", "lines_removed", "total_changes", "file_format", "s3_path"
+]
+COMMIT_CHANGE_METRICS_COLUMNS = [
+    "repo_id", "commit_sha", "number_of_files_changed", "total_lines_changed", "file_types_changed"
+]
+COMMITS_COLUMNS = [
+    "commit_sha", "author_name", "author_email", "message", "timestamp", "owner", "repo", "parent_sha",
+    "ingestion_date"
+]
+COMMIT_FILE_BEFORE_STATES_COLUMNS = [
+    "id", "ingestion_date", "repo_id", "commit_sha", "parent_sha", "file_path", "before_file_path",
+    "before_blob_sha", "before_s3_path", "method"
+]
+
+# Landing tables are append only and a rerun can land the same id twice, only the latest copy is kept.
+# Forks share commit SHAs, so ids are only unique within a repository
+query_select_commit_files = """
         SELECT
             id,
             ingestion_date,
-            json_extract_scalar(json_parse(raw_payload), '$.repo_id') AS repo_id,
-            json_extract_scalar(json_parse(raw_payload), '$.commit_sha') AS commit_sha,
-            json_extract_scalar(json_parse(raw_payload), '$.sha') AS blob_sha,
-            json_extract_scalar(json_parse(raw_payload), '$.filename') AS file_path,
-            json_extract_scalar(json_parse(raw_payload), '$.status') AS status,
-            CAST(json_extract_scalar(json_parse(raw_payload), '$.additions') AS INTEGER) AS lines_added,
-            CAST(json_extract_scalar(json_parse(raw_payload), '$.deletions') AS INTEGER) AS lines_removed,
-            CAST(json_extract_scalar(json_parse(raw_payload), '$.changes') AS INTEGER) AS total_changes,
+            repo_id,
+            commit_sha,
+            blob_sha,
+            filename AS file_path,
+            status,
+            additions AS lines_added,
+            deletions AS lines_removed,
+            changes AS total_changes,
             SUBSTR(
                 id,
                 STRPOS(id, '.') + 1
             ) AS file_format,
-            CONCAT(
-                'repositories/',
-                json_extract_scalar(json_parse(raw_payload), '$.repo_id'), '/',
-                json_extract_scalar(json_parse(raw_payload), '$.commit_sha'), '/',
-                json_extract_scalar(json_parse(raw_payload), '$.filename')
-            ) AS s3_path
-        FROM iceberg.landing.commit_files
+            CONCAT('repositories/blobs/', SUBSTR(blob_sha, 1, 2), '/', blob_sha) AS s3_path
+        FROM (
+            SELECT
+                *,
+                ROW_NUMBER() OVER (PARTITION BY repo_id, id ORDER BY ingestion_date DESC) AS copy_rank
+            FROM iceberg.landing.commit_files
+            WHERE {source_filter}
+        )
+        WHERE copy_rank = 1
     """
 
-query_create_curated_commit_change_metrics = """
-        CREATE TABLE iceberg.curated.commit_change_metrics AS
-            SELECT
-                repo_id,
-                commit_sha,
-                COUNT(*) AS number_of_files_changed,
-                SUM(lines_added + lines_removed) AS total_lines_changed,
-                ARRAY_DISTINCT(ARRAY_AGG(file_format)) AS file_types_changed
-            FROM (
-                SELECT
-                    json_extract_scalar(json_parse(raw_payload), '$.repo_id') AS repo_id,
-                    json_extract_scalar(json_parse(raw_payload), '$.commit_sha') AS commit_sha,
-                    CAST(json_extract_scalar(json_parse(raw_payload), '$.additions') AS INTEGER) AS lines_added,
-                    CAST(json_extract_scalar(json_parse(raw_payload), '$.deletions') AS INTEGER) AS lines_removed,
-                    SUBSTR(
-                        id,
-                        STRPOS(id, '.') + 1
-                    ) AS file_format
-                FROM iceberg.landing.commit_files
-            )
-            GROUP BY repo_id, commit_sha
+# Metrics are recomputed from all the curated files of a commit, so late files keep the aggregates correct
+query_select_commit_change_metrics = """
+        SELECT
+            f.repo_id,
+            f.commit_sha,
+            COUNT(*) AS number_of_files_changed,
+            SUM(f.lines_added + f.lines_removed) AS total_lines_changed,
+            ARRAY_DISTINCT(ARRAY_AGG(f.file_format)) AS file_types_changed
+        FROM iceberg.curated.commit_files f
+        {affected_commits}
+        GROUP BY f.repo_id, f.commit_sha
+    """
+
+# Commits with files in the processed landing partitions
+query_affected_commits = """
+        JOIN (
+            SELECT DISTINCT repo_id, commit_sha
+            FROM iceberg.landing.commit_files
+            WHERE {source_filter}
+        ) a
+        ON f.repo_id = a.repo_id AND f.commit_sha = a.commit_sha
     """
-query_create_curated_commit = """
-        CREATE TABLE iceberg.curated.commits AS
+
+query_select_commits = """
+        SELECT
+            commit_sha,
+            author_name,
+            author_email,
+            message,
+            author_date AS timestamp,
+            owner,
+            repo,
+            parent_sha,
+            ingestion_date
+        FROM (
             SELECT
-                CAST(json_extract_scalar(raw_payload, '$.sha') AS VARCHAR) AS commit_sha,
-                json_extract_scalar(raw_payload, '$.commit.author.name') AS author_name,
-                json_extract_scalar(raw_payload, '$.commit.author.email') AS author_email,
-                json_extract_scalar(raw_payload, '$.commit.message') AS message,
-                json_extract_scalar(raw_payload, '$.commit.author.date') AS timestamp,
-                json_extract_scalar(raw_payload, '$.owner') AS owner,
-                json_extract_scalar(raw_payload, '$.repo') AS repo,
-                json_extract_scalar(raw_payload, '$.parents[0].sha') AS parent_sha,
-                ingestion_date
+                *,
+                ROW_NUMBER() OVER (PARTITION BY owner, repo, id ORDER BY ingestion_date DESC) AS copy_rank
             FROM iceberg.landing.commits
+            WHERE {source_filter}
+        )
+        WHERE copy_rank = 1
+    """
+
+# Same id as curated.commit_files, before_blob_sha is NULL for added files
+query_select_commit_file_before_states = """
+        SELECT
+            id,
+            ingestion_date,
+            repo_id,
+            commit_sha,
+            parent_sha,
+            file_path,
+            before_file_path,
+            before_blob_sha,
+            CASE WHEN before_blob_sha IS NOT NULL THEN
+                CONCAT('repositories/blobs/', SUBSTR(before_blob_sha, 1, 2), '/', before_blob_sha)
+            END AS before_s3_path,
+            method
+        FROM (
+            SELECT
+                *,
+                ROW_NUMBER() OVER (PARTITION BY repo_id, id ORDER BY ingestion_date DESC) AS copy_rank
+            FROM iceberg.landing.commit_file_before_states
+            WHERE {source_filter}
+        )
+        WHERE copy_rank = 1
+    """
+
+query_create_state_table = f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            source_table VARCHAR,
+            last_ingestion_date DATE,
+            last_snapshot_id BIGINT,
+            updated_at TIMESTAMP(6) WITH TIME ZONE
+        )
+    """
+
 
+def build_merge(target: str, source: str, keys: List[str], columns: List[str]) -> str:
+    on = " AND ".join(f't."{key}" = s."{key}"' for key in keys)
+    updates = ", ".join(f'"{column}" = s."{column}"' for column in columns if column not in keys)
+    names = ", ".join(f'"{column}"' for column in columns)
+    values = ", ".join(f's."{column}"' for column in columns)
+    return f"""
+        MERGE INTO {target} t
+        USING ({source}) s
+        ON {on}
+        WHEN MATCHED THEN UPDATE SET {updates}
+        WHEN NOT MATCHED THEN INSERT ({names}) VALUES ({values})
     """
-trino_client = TrinoClient()
 
-trino_client.execute_query("DROP TABLE IF EXISTS iceberg.curated.commit_files") 
-trino_client.execute_query("DROP TABLE IF EXISTS iceberg.curated.commit_change_metrics") 
-trino_client.execute_query("DROP TABLE IF EXISTS iceberg.curated.commits") 
 
-trino_client.execute_query(query_create_curated_commit_files)
-trino_client.execute_query(query_create_curated_commit_change_metrics)
-trino_client.execute_query(query_create_curated_commit)
\ No newline at end of file
+def landing_position(client: TrinoClient, source_table: str) -> Tuple[Optional[int], Optional[str]]:
+    # Latest snapshot and partition of a landing table, read before curating so later appends are picked up next run
+    snapshot = client.read_sql(
+        f'SELECT snapshot_id FROM iceberg.landing."{source_table}$snapshots" ORDER BY committed_at DESC LIMIT 1'
+    )
+    latest = client.read_sql(f"SELECT CAST(MAX(ingestion_date) AS VARCHAR) AS day FROM iceberg.landing.{source_table}")
+    snapshot_id = int(snapshot["snapshot_id"].iloc[0]) if len(snapshot) else None
+    return snapshot_id, latest["day"].iloc[0] if len(latest) else None
+
+
+def read_state(client: TrinoClient, source_table: str) -> Tuple[Optional[int], Optional[str]]:
+    state = client.read_sql(
+        f"""
+        SELECT last_snapshot_id, CAST(last_ingestion_date AS VARCHAR) AS last_ingestion_date
+        FROM {STATE_TABLE}
+        WHERE source_table = '{source_table}'
+        """
+    )
+    if not len(state):
+        return None, None
+    return int(state["last_snapshot_id"].iloc[0]), state["last_ingestion_date"].iloc[0]
+
+
+def save_state(client: TrinoClient, source_table: str, snapshot_id: int, ingestion_date: str) -> None:
+    client.execute_query(
+        f"""
+        MERGE INTO {STATE_TABLE} t
+        USING (
+            SELECT
+                '{source_table}' AS source_table,
+                DATE '{ingestion_date}' AS last_ingestion_date,
+                CAST({snapshot_id} AS BIGINT) AS last_snapshot_id,
+                current_timestamp AS updated_at
+        ) s
+        ON t.source_table = s.source_table
+        WHEN MATCHED THEN UPDATE SET
+            last_ingestion_date = s.last_ingestion_date,
+            last_snapshot_id = s.last_snapshot_id,
+            updated_at = s.updated_at
+        WHEN NOT MATCHED THEN INSERT VALUES (s.source_table, s.last_ingestion_date, s.last_snapshot_id, s.updated_at)
+        """
+    )
+
+
+# CREATE OR REPLACE keeps the previous table readable until the new version is committed
+def rebuild_commit_files(client: TrinoClient) -> None:
+    client.execute_query(
+        "CREATE OR REPLACE TABLE iceberg.curated.commit_files AS "
+        + query_select_commit_files.format(source_filter="TRUE")
+    )
+    client.execute_query(
+        "CREATE OR REPLACE TABLE iceberg.curated.commit_change_metrics AS "
+        + query_select_commit_change_metrics.format(affected_commits="")
+    )
+
+
+def rebuild_commits(client: TrinoClient) -> None:
+    client.execute_query(
+        "CREATE OR REPLACE TABLE iceberg.curated.commits AS "
+        + query_select_commits.format(source_filter="TRUE")
+    )
+
+
+def rebuild_commit_file_before_states(client: TrinoClient) -> None:
+    client.execute_query(
+        "CREATE OR REPLACE TABLE iceberg.curated.commit_file_before_states AS "
+        + query_select_commit_file_before_states.format(source_filter="TRUE")
+    )
+
+
+def rebuild_table(client: TrinoClient, source_table: str, rebuild: Callable[[TrinoClient], None]) -> None:
+    # The position is read first, rows landed while rebuilding are merged by the next run
+    snapshot_id, ingestion_date = landing_position(client, source_table)
+    rebuild(client)
+    if snapshot_id is not None and ingestion_date is not None:
+        save_state(client, source_table, snapshot_id, ingestion_date)
+
+
+def curate_commit_files(client: TrinoClient, source_filter: str) -> None:
+    client.execute_query(
+        build_merge(
+            "iceberg.curated.commit_files",
+            query_select_commit_files.format(source_filter=source_filter),
+            ["repo_id", "id"],
+            COMMIT_FILES_COLUMNS
+        )
+    )
+    client.execute_query(
+        build_merge(
+            "iceberg.curated.commit_change_metrics",
+            query_select_commit_change_metrics.format(
+                affected_commits=query_affected_commits.format(source_filter=source_filter)
+            ),
+            ["repo_id", "commit_sha"],
+            COMMIT_CHANGE_METRICS_COLUMNS
+        )
+    )
+
+
+def curate_commits(client: TrinoClient, source_filter: str) -> None:
+    client.execute_query(
+        build_merge(
+            "iceberg.curated.commits",
+            query_select_commits.format(source_filter=source_filter),
+            ["owner", "repo", "commit_sha"],
+            COMMITS_COLUMNS
+        )
+    )
+
+
+def curate_commit_file_before_states(client: TrinoClient, source_filter: str) -> None:
+    client.execute_query(
+        build_merge(
+            "iceberg.curated.commit_file_before_states",
+            query_select_commit_file_before_states.format(source_filter=source_filter),
+            ["repo_id", "id"],
+            COMMIT_FILE_BEFORE_STATES_COLUMNS
+        )
+    )
+
+
+# (landing table, merge of its new partitions, rebuild from its whole history)
+CURATION_STEPS: List[Tuple[str, Callable[[TrinoClient, str], None], Callable[[TrinoClient], None]]] = [
+    ("commit_files", curate_commit_files, rebuild_commit_files),
+    ("commits", curate_commits, rebuild_commits),
+    ("commit_file_before_states", curate_commit_file_before_states, rebuild_commit_file_before_states)
+]
+
+
+def full_refresh(client: TrinoClient) -> None:
+    print("Rebuilding curated tables from the whole landing history...")
+    for table, _, rebuild in CURATION_STEPS:
+        rebuild_table(client, table, rebuild)
+
+
+def incremental_refresh(client: TrinoClient) -> None:
+    for table, curate, rebuild in CURATION_STEPS:
+        last_snapshot_id, last_ingestion_date = read_state(client, table)
+        if last_snapshot_id is None:
+            # e.g. the first run, or a curated table added since the last one
+            print(f"No curation state found for landing.{table}, rebuilding it...")
+            rebuild_table(client, table, rebuild)
+            continue
+        snapshot_id, latest_ingestion_date = landing_position(client, table)
+        if snapshot_id is None or snapshot_id == last_snapshot_id:
+            print(f"No new data in landing.{table} since snapshot {last_snapshot_id}.")
+            continue
+        # The last processed partition is read again, later runs of the same day append to it
+        print(f"Curating landing.{table} from partition {last_ingestion_date} (snapshot {snapshot_id})...")
+        curate(client, f"ingestion_date >= DATE '{last_ingestion_date}'")
+        save_state(client, table, snapshot_id, latest_ingestion_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the curated layer from the landing tables")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="rebuild the curated tables from the whole landing history instead of merging new partitions"
+    )
+    args = parser.parse_args()
+
+    trino_client = TrinoClient()
+    with stage_run("curated_layer"):
+        trino_client.execute_query(query_create_state_table)
+        if args.full_refresh:
+            full_refresh(trino_client)
+        else:
+            incremental_refresh(trino_client)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,74 @@
 import os
+import argparse
+import time
 import asyncio
-import aiohttp
 from dotenv import load_dotenv
 from datetime import date
-from typing import Optional, List, Dict
-from utils import TrinoClient, MinioClient
-from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, Optional, List, Dict, Set, Tuple
+from concurrent.futures import Executor
+from utils import (
+    TrinoClient,
+    AsyncTrinoClient,
+    MinioClient,
+    GitHubClient,
+    METRICS,
+    BlobStore,
+    PackedBlobStore,
+    AsyncStreamReader,
+    BlobMismatchError,
+    ShardSpec,
+    VerifiedBlobReader,
+    WorkLedger,
+    add_shard_argument,
+    is_retryable,
+    iter_archive_files,
+    print_shard_summary,
+    stage_run
+)
+from utils.github import ACCEPT_RAW
+from utils.work_ledger import FAILED, RETRYABLE
 
 load_dotenv()
 
-GITHUB_TOKEN: str = os.getenv("GITHUB_TOKEN")
-HEADERS = {
-    "Authorization": f"token {GITHUB_TOKEN}",
-    "Accept": "application/vnd.github.v3.raw"
-}
+# Peak memory is about BLOB_WORKERS * BLOB_PART_SIZE whatever the number or size of the files
+BLOB_WORKERS: int = int(os.getenv("BLOB_WORKERS", "20"))
+BLOB_QUEUE_SIZE: int = int(os.getenv("BLOB_QUEUE_SIZE", str(BLOB_WORKERS * 2)))
+BLOB_PART_SIZE: int = int(os.getenv("BLOB_PART_SIZE", str(5 * 1024 * 1024)))  # S3 minimum part size
+BLOB_CHUNK_SIZE: int = int(os.getenv("BLOB_CHUNK_SIZE", str(64 * 1024)))
+# Parts uploaded concurrently for blobs larger than one part
+BLOB_PARALLEL_PARTS: int = int(os.getenv("BLOB_PARALLEL_PARTS", "4"))
+# "packed" stores the blobs in zstd compressed shards with a Parquet manifest instead of one object each
+BLOB_STORAGE_MODE: str = os.getenv("BLOB_STORAGE_MODE", "objects").lower()
+# Commits with at least this many missing blobs are fetched as one tarball instead of
+# one contents call per file, 0 disables the tarball mode
+TARBALL_MIN_FILES: int = int(os.getenv("TARBALL_MIN_FILES", "20"))
+
+
+def create_blob_store(minio_client: MinioClient, bucket_name: str = "repositories", **kwargs: Any) -> BlobStore:
+    if BLOB_STORAGE_MODE == "packed":
+        return PackedBlobStore(minio_client, bucket_name, **kwargs)
+    return BlobStore(minio_client, bucket_name, **kwargs)
+
+
+class PipelineStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.blobs = 0
+        self.files = 0
+        self.bytes = 0
+        self.failures = 0
+
+    def report(self) -> str:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return (
+            f"{self.blobs} blobs for {self.files} files, {self.bytes / 1024 / 1024:.1f} MB in {elapsed:.1f}s "
+            f"({self.files / elapsed:.1f} files/s, {self.bytes / 1024 / 1024 / elapsed:.2f} MB/s), "
+            f"{self.failures} failures"
+        )
 
 
 async def fetch_file_content(
-    session: aiohttp.ClientSession,
+    github: GitHubClient,
     file_metadata: Dict[str, str]
 ) -> Optional[bytes]:
 
@@ -25,92 +76,352 @@ async def fetch_file_content(
     commit_sha = file_metadata["commit_sha"]
     file_path = file_metadata["file_path"]
 
-    url = f"https://api.github.com/repos/{owner_repo}/contents/{file_path}"
+    url = f"/repos/{owner_repo}/contents/{file_path}"
     params = {"ref": commit_sha}
 
-    print(f"Fetching file '{file_path}' at commit '{commit_sha}' from repo '{owner_repo}'...")
-
-    async with session.get(url, params=params) as response:
-        if response.status != 200:
-            print(f"Failed to fetch file '{file_path}' at commit '{commit_sha}' in repo '{owner_repo}': {response.status}")
-            return None
-        content = await response.read()
-        return content
+    response = await github.aget(url, params=params, accept=ACCEPT_RAW, use_cache=False)
+    if response.status != 200:
+        print(f"Failed to fetch file '{file_path}' at commit '{commit_sha}' in repo '{owner_repo}': {response.status}")
+        return None
+    return response.content
 
 
-def fetch_files_from_trino(client: TrinoClient, ingestion_date: str) -> List[Dict[str, str]]:
+def fetch_files_from_trino(
+    client: TrinoClient,
+    ingestion_date: str,
+    shard: ShardSpec = ShardSpec()
+) -> Iterator[Dict[str, str]]:
     query = f"""
         SELECT 
             id AS object_name,
             file_path,
             commit_sha,
-            repo_id
+            repo_id,
+            blob_sha
         FROM iceberg.curated.commit_files
         WHERE ingestion_date = DATE'{ingestion_date}'
+          AND status <> 'removed'
+          AND {shard.sql_predicate('repo_id')}
+        ORDER BY repo_id, commit_sha
         """
-    file_list = client.read_sql(query).to_dict(orient="records")
-    return file_list
-
-
-async def upload_file(
-    minio_client: MinioClient,
-    bucket_name: str,
-    object_name: str,
-    data_bytes: bytes,
-    executor: ThreadPoolExecutor
-):
-    loop = asyncio.get_event_loop()
+    # Rows are streamed grouped by commit, only the files of the current commit are kept in memory
+    return client.iter_rows(query)
+
+
+async def stream_blob(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    blob_sha: str,
+    files: List[Dict[str, str]],
+    stats: PipelineStats,
+    ledger: Optional[WorkLedger] = None
+) -> None:
+    # Every file in `files` has the same content, it is downloaded once through the first one
+    file_metadata = files[0]
+    url = f"/repos/{file_metadata['repo_id']}/contents/{file_metadata['file_path']}"
+    params = {"ref": file_metadata["commit_sha"]}
+    loop = asyncio.get_running_loop()
+
     try:
-        await loop.run_in_executor(
-            executor,
-            minio_client.upload_bytes,
-            bucket_name,
-            object_name,
-            data_bytes,
-            "application/octet-stream"
-        )
-        print(f"Uploaded '{object_name}' to MinIO bucket '{bucket_name}'.")
+        async with github.astream(url, params=params, accept=ACCEPT_RAW) as response:
+            if response.status != 200:
+                print(f"Failed to fetch file '{file_metadata['file_path']}' at commit '{file_metadata['commit_sha']}': {response.status}")
+                stats.failures += 1
+                METRICS.inc("pipeline_items_total", kind="blob", result="failed")
+                if ledger is not None:
+                    ledger.fail(blob_sha, f"HTTP {response.status}", is_retryable(response.status), {"files": files})
+                return
+            # Content-Length is only the stored size when the body is not compressed in transit
+            length = response.content_length
+            if length is None or response.headers.get("Content-Encoding"):
+                length = -1
+            reader = AsyncStreamReader(response.content, loop, BLOB_CHUNK_SIZE)
+            await blob_store.put_stream_async(blob_sha, reader, length, BLOB_PART_SIZE)
+    except Exception as e:
+        print(f"Failed to store blob '{blob_sha}' for '{file_metadata['object_name']}': {e}")
+        stats.failures += 1
+        METRICS.inc("pipeline_items_total", kind="blob", result="failed")
+        if ledger is not None:
+            ledger.fail(blob_sha, e, payload={"files": files})
+        return
+
+    blob_store.link((f["repo_id"], f["commit_sha"], f["file_path"], blob_sha) for f in files)
+    if ledger is not None:
+        ledger.done(blob_sha)
+    stats.blobs += 1
+    stats.files += len(files)
+    stats.bytes += reader.bytes_read
+    METRICS.inc("pipeline_items_total", kind="blob", result="contents")
+
+
+def store_archive_blobs(
+    blob_store: BlobStore,
+    archive: AsyncStreamReader,
+    wanted: Dict[str, str]
+) -> Dict[str, int]:
+    # Runs in a worker thread: the tarball is read as a stream, so every member is uploaded before moving on
+    stored: Dict[str, int] = {}
+    for file_path, content, size in iter_archive_files(archive, wanted):
+        blob_sha = wanted[file_path]
+        if blob_sha in stored:
+            continue
+        # The archive applies export attributes, content that is not the blob is fetched from the contents API
+        try:
+            blob_store.put_stream(blob_sha, VerifiedBlobReader(content, blob_sha, size), size, BLOB_PART_SIZE)
+        except BlobMismatchError as e:
+            print(f"Skipping '{file_path}' from the tarball: {e}")
+            METRICS.inc("pipeline_items_total", kind="blob", result="tarball_mismatch")
+            continue
+        stored[blob_sha] = size
+    return stored
+
+
+async def stream_tarball(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    repo_id: str,
+    commit_sha: str,
+    blobs: Dict[str, List[Dict[str, str]]],
+    stats: PipelineStats,
+    ledger: Optional[WorkLedger] = None
+) -> List[str]:
+    # Stores the blobs found in the commit tarball, returns the ones still missing
+    wanted = {
+        f["file_path"]: blob_sha
+        for blob_sha, files in blobs.items()
+        for f in files
+        if f["repo_id"] == repo_id and f["commit_sha"] == commit_sha
+    }
+    loop = asyncio.get_running_loop()
+
+    try:
+        async with github.astream(f"/repos/{repo_id}/tarball/{commit_sha}") as response:
+            if response.status != 200:
+                print(f"Failed to fetch tarball for commit '{commit_sha}' in repo '{repo_id}': {response.status}")
+                return list(blobs)
+            archive = AsyncStreamReader(response.content, loop, BLOB_CHUNK_SIZE)
+            stored = await loop.run_in_executor(
+                blob_store.minio_client.executor, store_archive_blobs, blob_store, archive, wanted
+            )
     except Exception as e:
-        print(f"Failed to upload '{object_name}' to MinIO: {e}")
-
-
-async def process_file(
-    session: aiohttp.ClientSession,
-    minio_client: MinioClient,
-    bucket_name: str,
-    file_metadata: Dict[str, str],
-    executor: ThreadPoolExecutor
-):
-    content = await fetch_file_content(session, file_metadata)
-    if content:
-        safe_file_path = file_metadata["file_path"].replace("/", "_")
-        object_name = f"{file_metadata['repo_id'].replace('/', '_')}/{file_metadata['commit_sha']}/{safe_file_path}"
-        await upload_file(minio_client, bucket_name, object_name, content, executor)
-    else:
-        print(f"Skipping upload for '{file_metadata['object_name']}' due to fetch failure.")
-
-
-async def main():
+        print(f"Failed to extract tarball for commit '{commit_sha}' in repo '{repo_id}': {e}")
+        return list(blobs)
+
+    for blob_sha, size in stored.items():
+        files = blobs[blob_sha]
+        blob_store.link((f["repo_id"], f["commit_sha"], f["file_path"], blob_sha) for f in files)
+        if ledger is not None:
+            ledger.done(blob_sha)
+        stats.blobs += 1
+        stats.files += len(files)
+        stats.bytes += size
+    METRICS.inc("pipeline_items_total", len(stored), kind="blob", result="tarball")
+    return [blob_sha for blob_sha in blobs if blob_sha not in stored]
+
+
+async def blob_worker(
+    queue: asyncio.Queue,
+    github: GitHubClient,
+    blob_store: BlobStore,
+    stats: PipelineStats,
+    ledger: Optional[WorkLedger] = None
+) -> None:
+    while True:
+        item: Optional[Tuple[str, Any]] = await queue.get()
+        if item is None:
+            return
+        mode, work = item
+        if mode == "tarball":
+            (repo_id, commit_sha), blobs = work
+            left = await stream_tarball(github, blob_store, repo_id, commit_sha, blobs, stats, ledger)
+            # Paths missing from the archive (e.g. submodules) fall back to the contents API
+            for blob_sha in left:
+                await stream_blob(github, blob_store, blob_sha, blobs[blob_sha], stats, ledger)
+        else:
+            blob_sha, files = work
+            await stream_blob(github, blob_store, blob_sha, files, stats, ledger)
+
+
+class FetchPlan:
+    """Turns the file rows of the day, ordered by commit, into fetch work while
+    they stream in: when the commit changes, its missing blobs become one
+    tarball (at least `min_files` of them) or one contents call each.
+
+    Stored blobs are linked to their new files right away and `skipped` ones
+    (e.g. failed for good) are not fetched again. Only the SHAs of the queued
+    blobs are kept for the whole run, plus the files of a blob already queued
+    by an earlier commit, linked by `link_duplicates` once the fetches are done.
+    """
+
+    def __init__(
+        self,
+        blob_store: BlobStore,
+        skipped: Optional[Set[str]] = None,
+        min_files: int = TARBALL_MIN_FILES
+    ):
+        self.blob_store = blob_store
+        self.skipped = skipped or set()
+        self.min_files = min_files
+        self.queued: Set[str] = set()
+        self.duplicates: List[Tuple[str, str, str, str]] = []
+        self.files = 0
+        self.blobs = 0
+        self.tarballs = 0
+
+    def _plan_commit(
+        self,
+        commit: Tuple[str, str],
+        files: List[Dict[str, str]]
+    ) -> Iterator[Tuple[str, Any]]:
+        blobs: Dict[str, List[Dict[str, str]]] = {}
+        for file_meta in files:
+            blobs.setdefault(file_meta["blob_sha"], []).append(file_meta)
+        self.queued.update(blobs)
+        self.blobs += len(blobs)
+        if self.min_files > 0 and len(blobs) >= self.min_files:
+            self.tarballs += 1
+            yield "tarball", (commit, blobs)
+        else:
+            for item in blobs.items():
+                yield "contents", item
+
+    def iter_items(self, file_rows: Iterable[Dict[str, str]]) -> Iterator[Tuple[str, Any]]:
+        commit: Optional[Tuple[str, str]] = None
+        missing: List[Dict[str, str]] = []
+        known: List[Tuple[str, str, str, str]] = []
+        for file_meta in file_rows:
+            self.files += 1
+            row_commit = (file_meta["repo_id"], file_meta["commit_sha"])
+            if row_commit != commit:
+                if missing:
+                    yield from self._plan_commit(commit, missing)
+                commit, missing = row_commit, []
+
+            blob_sha = file_meta["blob_sha"]
+            ref = (file_meta["repo_id"], file_meta["commit_sha"], file_meta["file_path"], blob_sha)
+            if not blob_sha:
+                continue
+            if blob_sha in self.queued:
+                self.duplicates.append(ref)
+            elif self.blob_store.has(blob_sha):
+                known.append(ref)
+            elif blob_sha not in self.skipped:
+                missing.append(file_meta)
+            if len(known) >= 10_000:
+                self.blob_store.link(known)
+                known = []
+        if missing:
+            yield from self._plan_commit(commit, missing)
+        self.blob_store.link(known)
+
+    def link_duplicates(self) -> None:
+        # Called before the blob store is closed: in packed mode the blobs of this run are not uploaded yet
+        self.blob_store.link(ref for ref in self.duplicates if self.blob_store.accepted(ref[3]))
+
+
+async def store_blobs(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    items: Iterable[Tuple[str, Any]],
+    ledger: Optional[WorkLedger] = None,
+    stats: Optional[PipelineStats] = None,
+    executor: Optional[Executor] = None
+) -> PipelineStats:
+    stats = stats or PipelineStats()
+    # The bounded queue keeps the producer at most BLOB_QUEUE_SIZE blobs ahead of the workers
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BLOB_QUEUE_SIZE)
+    workers = [
+        asyncio.create_task(blob_worker(queue, github, blob_store, stats, ledger))
+        for _ in range(BLOB_WORKERS)
+    ]
+    # Items may come from rows still streaming in, they are pulled on `executor` to keep the event loop free
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    try:
+        while True:
+            item = await loop.run_in_executor(executor, next, iterator, None)
+            if item is None:
+                break
+            await queue.put(item)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    return stats
+
+
+async def store_blobs_with_retries(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    items: Iterable[Tuple[str, Any]],
+    ledger: WorkLedger,
+    executor: Optional[Executor] = None
+) -> PipelineStats:
+    stats = await store_blobs(github, blob_store, items, ledger, executor=executor)
+    # Failed blobs are fetched again one by one through the contents API once their backoff elapsed
+    async for batch in ledger.aretry_batches():
+        retried = [("contents", (blob_sha, payload["files"])) for blob_sha, payload in batch]
+        await store_blobs(github, blob_store, retried, ledger, stats)
+    # A blob that made it on a retry is not a failure of the run
+    counts = ledger.counts()
+    stats.failures = counts.get(RETRYABLE, 0) + counts.get(FAILED, 0)
+    return stats
+
+
+async def main(shard: ShardSpec) -> PipelineStats:
     trino_client = TrinoClient()
-    minio_client = MinioClient()
+    async_trino = AsyncTrinoClient(trino_client)
+    # MinIO uploads are blocking, every worker gets an upload thread and its own pooled connection
+    minio_client = MinioClient(
+        max_pool_connections=BLOB_WORKERS * BLOB_PARALLEL_PARTS,
+        upload_workers=BLOB_WORKERS,
+        parallel_parts=BLOB_PARALLEL_PARTS
+    )
     today_str = date.today().isoformat()
     bucket_name = "repositories"
+    blob_store = create_blob_store(minio_client, bucket_name)
+    # Blobs are keyed by SHA. Stored ones are skipped through the blob index, which packed blobs
+    # only enter once their shard is uploaded, so the ledger only rules out those failed for good
+    ledger = WorkLedger("blobs", f"{today_str}#{shard}")
 
-    file_list = fetch_files_from_trino(trino_client, today_str)
-    print(f"Found {len(file_list)} files to process...")
-
-    connector = aiohttp.TCPConnector(limit=20)  # Limit concurrency of HTTP connections
-    timeout = aiohttp.ClientTimeout(total=60)
+    plan = FetchPlan(blob_store, ledger.finished_keys((FAILED,)))
+    files = fetch_files_from_trino(trino_client, today_str, shard)
 
-    executor = ThreadPoolExecutor(max_workers=10)  # For MinIO uploads (if blocking)
+    github = GitHubClient(async_pool_size=BLOB_WORKERS)
+    try:
+        # Fetches start with the first commit, while the rest of the query result streams in on a Trino pool thread
+        stats = await store_blobs_with_retries(
+            github, blob_store, plan.iter_items(files), ledger, executor=async_trino.executor
+        )
+        plan.link_duplicates()
+    finally:
+        ledger.flush()
+        # Uploads the open shards and the manifest in packed mode
+        blob_store.close()
+        await github.aclose()
+        minio_client.close()
+        async_trino.close()
+        trino_client.close()
 
-    async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout) as session:
-        tasks = [
-            process_file(session, minio_client, bucket_name, file_meta, executor)
-            for file_meta in file_list
-        ]
-        await asyncio.gather(*tasks)
+    print(
+        f"Read {plan.files} files, {plan.blobs} blobs were not stored yet, "
+        f"{plan.tarballs} commits fetched as tarballs"
+    )
+    print(stats.report())
+    print(ledger.report())
+    ledger.close()
+    print(f"MinIO uploads: {minio_client.upload_throughput()}")
+    print(trino_client.pool.report())
+    github.print_stats()
+    return stats
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Store the blobs of the files changed by today's commits")
+    add_shard_argument(parser)
+    shard = parser.parse_args().shard
+    with stage_run("blobs", shard=str(shard)):
+        stats = asyncio.run(main(shard))
+    print_shard_summary(
+        "blobs", shard, blobs=stats.blobs, files=stats.files, bytes=stats.bytes, failures=stats.failures
+    )
@@ -1,75 +1,249 @@
 import os
-import requests
+import argparse
 from dotenv import load_dotenv
 from datetime import date
-from typing import Any, Dict, List, Optional
-from utils import TrinoClient
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from utils import (
+    TrinoClient,
+    MinioClient,
+    GitHubClient,
+    METRICS,
+    GraphQLCommitFetcher,
+    RepoHistoryState,
+    WatermarkStore,
+    ShardSpec,
+    add_shard_argument,
+    get_landing_writer,
+    print_shard_summary,
+    stage_run
+)
 
 load_dotenv()
 
-GITHUB_TOKEN: str = os.getenv("GITHUB_TOKEN")
-GITHUB_API_URL = "https://api.github.com"
+# Number of commits pulled for a repo that has no watermark yet
+INITIAL_COMMIT_LIMIT: int = int(os.getenv("INITIAL_COMMIT_LIMIT", "15"))
+# "rest" pages through each repository, "graphql" fetches many repositories per query
+COMMITS_EXTRACTION_MODE: str = os.getenv("COMMITS_EXTRACTION_MODE", "rest").lower()
 
 
-HEADERS: Dict[str, str] = {
-    "Authorization": f"token {GITHUB_TOKEN}",
-    "Accept": "application/vnd.github+json"
-}
-
-def fetch_commits_for_repo(
+def iter_commit_pages(
+    github: GitHubClient,
     owner_repo: str,
-    limit: int = 15,
+    limit: Optional[int] = 15,
     since: Optional[str] = None,
-    until: Optional[str] = None
-) -> List[Dict[str, Any]]:
-
-    url = f"{GITHUB_API_URL}/repos/{owner_repo}/commits"
+    until: Optional[str] = None,
+    stop_sha: Optional[str] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    # Date bounds are applied by the API, the count and SHA bounds while paging
     params = {
-        "per_page": limit
+        "per_page": min(limit, 100) if limit else 100
     }
     if since:
         params["since"] = since
     if until:
         params["until"] = until
 
-    response = requests.get(url, headers=HEADERS, params=params)
-    response.raise_for_status()
-    commits_raw = response.json()
-    return commits_raw
+    fetched = 0
+    for page in github.iter_pages(f"/repos/{owner_repo}/commits", params=params):
+        commits: List[Dict[str, Any]] = []
+        done = not page
+        for commit in page:
+            if commit["sha"] == stop_sha or (limit and fetched >= limit):
+                done = True
+                break
+            commits.append(commit)
+            fetched += 1
+        if commits:
+            yield commits
+        if done or (limit and fetched >= limit):
+            return
+
+
+def fetch_commits_for_repo(
+    github: GitHubClient,
+    owner_repo: str,
+    limit: Optional[int] = 15,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    stop_sha: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    pages = iter_commit_pages(github, owner_repo, limit, since, until, stop_sha)
+    return [commit for page in pages for commit in page]
+
 
-def fetch_repo_names_from_table(client: TrinoClient, ingestion_date: str) -> List[str]:
+def iter_new_commit_pages(
+    github: GitHubClient,
+    owner_repo: str,
+    watermark: Optional[Dict[str, str]]
+) -> Iterator[List[Dict[str, Any]]]:
+    if watermark is None:
+        return iter_commit_pages(github, owner_repo, limit=INITIAL_COMMIT_LIMIT)
+    # `since` is inclusive, the watermark SHA marks where the previous run stopped
+    return iter_commit_pages(
+        github,
+        owner_repo,
+        limit=None,
+        since=watermark["committed_at"],
+        stop_sha=watermark["sha"]
+    )
+
+
+def ingest_commit_pages(
+    writer: Any,
+    owner_repo: str,
+    pages: Iterable[List[Dict[str, Any]]],
+    executor: ThreadPoolExecutor
+) -> Tuple[Optional[Dict[str, Any]], int]:
+    # Each page is inserted while the next one is fetched, with a single insert in flight
+    owner, repo_name = owner_repo.split("/")  # Split "owner/repo" string
+    newest: Optional[Dict[str, Any]] = None
+    inserted = 0
+    pending: Optional[Future] = None
+
+    try:
+        for commits in pages:
+            for commit in commits:
+                commit["owner"] = owner
+                commit["repo"] = repo_name
+            newest = newest or commits[0]
+
+            if pending is not None:
+                pending.result()
+            pending = executor.submit(
+                writer.insert_raw_payloads,
+                table_name="iceberg.landing.commits",
+                rows=commits,
+                id_field="sha"
+            )
+            inserted += len(commits)
+    finally:
+        if pending is not None:
+            pending.result()
+
+    return newest, inserted
+
+
+def fetch_repo_names_from_table(
+    client: TrinoClient,
+    ingestion_date: str,
+    shard: ShardSpec = ShardSpec()
+) -> List[str]:
     query = f"""
         SELECT id
         FROM iceberg.landing.repositories
         WHERE ingestion_date = DATE '{ingestion_date}'
+          AND {shard.sql_predicate("id")}
     """
-    df = client.read_sql(query)
-    return df["id"].tolist()
+    return [row["id"] for row in client.iter_rows(query)]
 
-if __name__ == "__main__":
-    client = TrinoClient()
-    today_str = date.today().isoformat()  # Parameter can be controlled by Airflow or environment
-
-    repo_names = fetch_repo_names_from_table(client, ingestion_date=today_str)
+def extract_with_rest(
+    github: GitHubClient,
+    writer: Any,
+    watermarks: WatermarkStore,
+    repo_names: List[str]
+) -> int:
+    insert_executor = ThreadPoolExecutor(max_workers=1)
+    total = 0
 
     for repo in repo_names:
-        print(f"\nFetching commits for: {repo}")
         try:
-            commits = fetch_commits_for_repo(repo)
-            if commits:
-                owner, repo_name = repo.split("/")  # Split "owner/repo" string
-                for commit in commits:
-                    commit["owner"] = owner
-                    commit["repo"] = repo_name
-
-                client.insert_raw_payloads(
-                    table_name="iceberg.landing.commits",
-                    rows=commits,
-                    id_field="sha"
-                )
-                print(f"Inserted {len(commits)} commits for repo {repo}.")
+            watermark = watermarks.get(repo)
+            pages = iter_new_commit_pages(github, repo, watermark)
+            newest, inserted = ingest_commit_pages(writer, repo, pages, insert_executor)
+            total += inserted
+            METRICS.inc("pipeline_items_total", inserted, kind="commit", result="inserted")
+            if newest:
+                print(f"Inserted {inserted} commits for repo {repo}.")
 
+                # Only move the watermark once all the pages are safely in the landing table
+                watermarks.advance(repo, newest["sha"], newest["commit"]["committer"]["date"])
+                METRICS.inc("pipeline_items_total", kind="repo", result="new_commits")
             else:
-                print(f"No commits found for repo {repo}.")
+                METRICS.inc("pipeline_items_total", kind="repo", result="up_to_date")
         except Exception as e:
             print(f"Failed to fetch commits for {repo}: {e}")
+            METRICS.inc("pipeline_items_total", kind="repo", result="failed")
+
+    insert_executor.shutdown()
+    return total
+
+
+def extract_with_graphql(
+    github: GitHubClient,
+    writer: Any,
+    watermarks: WatermarkStore,
+    repo_names: List[str]
+) -> int:
+    states = []
+    for repo in repo_names:
+        watermark = watermarks.get(repo)
+        if watermark is None:
+            states.append(RepoHistoryState(repo, limit=INITIAL_COMMIT_LIMIT))
+        else:
+            states.append(RepoHistoryState(repo, since=watermark["committed_at"], stop_sha=watermark["sha"]))
+
+    fetcher = GraphQLCommitFetcher(github)
+    newest: Dict[str, Dict[str, Any]] = {}
+    failed = set()
+    total = 0
+    for results in fetcher.iter_batches(states):
+        rows: List[Dict[str, Any]] = []
+        for repo, commits, _ in results:
+            owner, repo_name = repo.split("/")
+            for commit in commits:
+                commit["owner"] = owner
+                commit["repo"] = repo_name
+            if commits:
+                newest.setdefault(repo, commits[0])
+            rows.extend(commits)
+
+        try:
+            writer.insert_raw_payloads(
+                table_name="iceberg.landing.commits",
+                rows=rows,
+                id_field="sha"
+            )
+        except Exception as e:
+            # Watermarks of this batch stay where they were, so the next run fetches these commits again
+            print(f"Failed to insert commits for {', '.join(repo for repo, _, _ in results)}: {e}")
+            failed.update(repo for repo, _, _ in results)
+            METRICS.inc("pipeline_items_total", len(results), kind="repo", result="failed")
+            continue
+        total += len(rows)
+        METRICS.inc("pipeline_items_total", len(rows), kind="commit", result="inserted")
+
+        for repo, commits, finished in results:
+            print(f"Inserted {len(commits)} commits for repo {repo}.")
+            if finished and repo in newest and repo not in failed:
+                commit = newest[repo]
+                watermarks.advance(repo, commit["sha"], commit["commit"]["committer"]["date"])
+
+    print(
+        f"GraphQL: {fetcher.queries} queries, {fetcher.total_cost} rate limit points, "
+        f"{fetcher.total_cost / max(fetcher.pages, 1):.2f} points per repository page."
+    )
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract new commits of the repositories landed today")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    client = TrinoClient()
+    writer = get_landing_writer(client)
+    github = GitHubClient()
+    watermarks = WatermarkStore(MinioClient())
+    today_str = date.today().isoformat()  # Parameter can be controlled by Airflow or environment
+
+    with stage_run("commits", shard=str(args.shard)):
+        repo_names = fetch_repo_names_from_table(client, ingestion_date=today_str, shard=args.shard)
+
+        if COMMITS_EXTRACTION_MODE == "graphql":
+            inserted = extract_with_graphql(github, writer, watermarks, repo_names)
+        else:
+            inserted = extract_with_rest(github, writer, watermarks, repo_names)
+
+        github.print_stats()
+    print_shard_summary("commits", args.shard, repos=len(repo_names), commits=inserted)
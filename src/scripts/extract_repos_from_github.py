@@ -1,28 +1,22 @@
 import os
-import requests
 from dotenv import load_dotenv
 from datetime import date
 from typing import Any, Dict, List, Optional
-from utils import TrinoClient
+from utils import TrinoClient, GitHubClient, get_landing_writer, stage_run
 
 load_dotenv()
 
-GITHUB_TOKEN: str = os.getenv("GITHUB_TOKEN")
-GITHUB_API_URL = "https://api.github.com"
-LIMIT: int = int(os.getenv("LIMIT"))
-
-HEADERS: Dict[str, str] = {
-    "Authorization": f"token {GITHUB_TOKEN}",
-    "Accept": "application/vnd.github+json"
-}
+LIMIT: int = int(os.getenv("LIMIT", "10"))
+SEARCH_RESULTS_CAP: int = 1000
 
 
 def discover_repositories_with_full_metadata(
+    github: GitHubClient,
     limit: int = 10,
     created_after: Optional[date] = None,
     pushed_after: Optional[date] = None
 ) -> List[Dict[str, Any]]:
-    url = f"{GITHUB_API_URL}/search/repositories"
+    url = "/search/repositories"
     query = "stars:>1000"
 
     if created_after:
@@ -31,43 +25,44 @@ def discover_repositories_with_full_metadata(
         query += f" pushed:>{pushed_after.isoformat()}"
 
     items: List[Dict[str, Any]] = []
-    per_page = 100
+    per_page = min(100, limit)
     page = 1
 
     while len(items) < limit:
-        remaining = limit - len(items)
         params = {
             "q": query,
             "sort": "stars",
             "order": "desc",
-            "per_page": min(per_page, remaining),
+            "per_page": per_page,
             "page": page
         }
 
-        response = requests.get(url, headers=HEADERS, params=params)
-        response.raise_for_status()
-        batch = response.json().get("items", [])
+        batch = github.get_json(url, params=params).get("items", [])
 
         if not batch:
             break
         
         items.extend(batch)
-        page += 1
-        if page == 11: ## Rate Limit in the api
+        if page * per_page >= SEARCH_RESULTS_CAP:  # Search only exposes the first 1000 results
             break
+        page += 1
 
-    return items
+    return items[:limit]
 
 if __name__ == "__main__":
     client = TrinoClient()
+    writer = get_landing_writer(client)
+    github = GitHubClient()
 
-    repos: List[Dict[str, Any]] = discover_repositories_with_full_metadata(limit=LIMIT)
+    with stage_run("repositories"):
+        repos: List[Dict[str, Any]] = discover_repositories_with_full_metadata(github, limit=LIMIT)
 
-    # Insert raw payload, using "full_name" as the ID field
-    client.insert_raw_payloads(
-        table_name="iceberg.landing.repositories",
-        rows=repos,
-        id_field="full_name"
-    )
+        # Insert raw payload, using "full_name" as the ID field
+        writer.insert_raw_payloads(
+            table_name="iceberg.landing.repositories",
+            rows=repos,
+            id_field="full_name"
+        )
 
     print(f"Retrieved and inserted {len(repos)} repositories with full metadata (raw schema).\n")
+    github.print_stats()
@@ -0,0 +1,127 @@
+import os
+import argparse
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+from utils import TrinoClient, stage_run
+
+load_dotenv()
+
+# Files below SMALL_FILE_BYTES count as small, a partition is compacted once it has
+# MIN_SMALL_FILES of them and only its small files are rewritten, into files of about
+# TARGET_FILE_SIZE. Retentions use Trino duration strings and cannot go below the
+# iceberg.*.min-retention values in iceberg.properties.
+TARGET_FILE_SIZE: str = os.getenv("MAINTENANCE_TARGET_FILE_SIZE", "128MB")
+SMALL_FILE_BYTES: int = int(os.getenv("MAINTENANCE_SMALL_FILE_BYTES", str(32 * 1024 * 1024)))
+MIN_SMALL_FILES: int = int(os.getenv("MAINTENANCE_MIN_SMALL_FILES", "5"))
+SNAPSHOT_RETENTION: str = os.getenv("MAINTENANCE_SNAPSHOT_RETENTION", "7d")
+ORPHAN_RETENTION: str = os.getenv("MAINTENANCE_ORPHAN_RETENTION", "7d")
+
+# Tables created in post-init.sql and by create_curated_layer.py, with their partition column
+TABLES: Dict[str, Optional[str]] = {
+    "iceberg.landing.repositories": "ingestion_date",
+    "iceberg.landing.commits": "ingestion_date",
+    "iceberg.landing.commit_files": "ingestion_date",
+    "iceberg.landing.commit_file_before_states": "ingestion_date",
+    "iceberg.curated.commit_files": None,
+    "iceberg.curated.commit_change_metrics": None,
+    "iceberg.curated.commits": None,
+    "iceberg.curated.commit_file_before_states": None,
+    "iceberg.curated.curation_state": None
+}
+
+
+def metadata_table(table_name: str, suffix: str) -> str:
+    catalog_schema, table = table_name.rsplit(".", 1)
+    return f'{catalog_schema}."{table}${suffix}"'
+
+
+def partition_file_stats(client: TrinoClient, table_name: str, partition_column: Optional[str]) -> List[Dict[str, Any]]:
+    # One row per partition (a single row for unpartitioned tables) with its file count, bytes and small files
+    partition = (
+        f'CAST("partition".{partition_column} AS VARCHAR)' if partition_column else "CAST(NULL AS VARCHAR)"
+    )
+    stats = client.read_sql(
+        f"""
+        SELECT
+            {partition} AS partition_value,
+            COUNT(*) AS files,
+            COALESCE(SUM(file_size_in_bytes), 0) AS bytes,
+            COUNT_IF(file_size_in_bytes < {SMALL_FILE_BYTES}) AS small_files
+        FROM {metadata_table(table_name, "files")}
+        GROUP BY 1
+        """
+    )
+    return stats.to_dict(orient="records")
+
+
+def totals(partitions: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "files": int(sum(p["files"] for p in partitions)),
+        "bytes": int(sum(p["bytes"] for p in partitions))
+    }
+
+
+def compact_table(
+    client: TrinoClient,
+    table_name: str,
+    partition_column: Optional[str],
+    partitions: List[Dict[str, Any]],
+    min_small_files: int = MIN_SMALL_FILES
+) -> int:
+    compacted = 0
+    for partition in partitions:
+        if partition["small_files"] < min_small_files:
+            continue
+        where = ""
+        if partition_column and partition["partition_value"] is not None:
+            where = f" WHERE {partition_column} = DATE '{partition['partition_value']}'"
+        print(
+            f"Compacting {table_name}{where}: {int(partition['files'])} files, "
+            f"{int(partition['small_files'])} below {SMALL_FILE_BYTES} bytes"
+        )
+        # file_size_threshold only selects the files to rewrite, the session's target_max_file_size sizes the output
+        client.execute_query(
+            f"ALTER TABLE {table_name} EXECUTE optimize(file_size_threshold => '{SMALL_FILE_BYTES}B'){where}"
+        )
+        compacted += 1
+    return compacted
+
+
+def maintain_table(client: TrinoClient, table_name: str, partition_column: Optional[str]) -> None:
+    try:
+        before = partition_file_stats(client, table_name, partition_column)
+    except Exception as e:
+        print(f"Skipping {table_name}: {e}")
+        return
+
+    compacted = compact_table(client, table_name, partition_column, before)
+    # Compaction leaves the replaced files referenced by old snapshots, expiring them is what frees the space
+    client.execute_query(
+        f"ALTER TABLE {table_name} EXECUTE expire_snapshots(retention_threshold => '{SNAPSHOT_RETENTION}')"
+    )
+    client.execute_query(
+        f"ALTER TABLE {table_name} EXECUTE remove_orphan_files(retention_threshold => '{ORPHAN_RETENTION}')"
+    )
+
+    before_totals = totals(before)
+    after_totals = totals(partition_file_stats(client, table_name, partition_column))
+    print(
+        f"{table_name}: {compacted} partitions compacted, "
+        f"files {before_totals['files']} -> {after_totals['files']}, "
+        f"MB {before_totals['bytes'] / 1024 / 1024:.1f} -> {after_totals['bytes'] / 1024 / 1024:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact, expire snapshots and remove orphan files of the Iceberg tables")
+    parser.add_argument("tables", nargs="*", help="fully qualified table names, all known tables by default")
+    args = parser.parse_args()
+
+    trino_client = TrinoClient(session_properties={"iceberg.target_max_file_size": TARGET_FILE_SIZE})
+    with stage_run("table_maintenance"):
+        for table_name in args.tables or TABLES:
+            maintain_table(trino_client, table_name, TABLES.get(table_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import argparse
+import multiprocessing
+from collections import Counter
+from dotenv import load_dotenv
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+from utils import (
+    TrinoClient,
+    MinioClient,
+    GitHubClient,
+    METRICS,
+    BlobStore,
+    BufferedLandingWriter,
+    PatchError,
+    ShardSpec,
+    add_shard_argument,
+    get_landing_writer,
+    git_blob_sha,
+    print_shard_summary,
+    reconstruct_before,
+    stage_run
+)
+from utils.github import ACCEPT_RAW
+from extract_blob_files import create_blob_store
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+
+load_dotenv()
+
+# Threads reading after-states and fetching fallbacks, processes reverse-applying the patches
+RECONSTRUCT_WORKERS: int = int(os.getenv("RECONSTRUCT_WORKERS", "10"))
+RECONSTRUCT_PROCESSES: int = int(os.getenv("RECONSTRUCT_PROCESSES", str(os.cpu_count() or 1)))
+
+BEFORE_STATES_TABLE = "iceberg.landing.commit_file_before_states"
+
+# How the before-state of a file was obtained
+ADDED = "added"  # The file did not exist before the commit
+UNCHANGED = "unchanged"  # Renamed without changes, the before-state is the after-state
+PATCH = "patch"  # The patch reverse-applied to the after-state blob
+PARENT = "parent"  # Fetched at the parent commit, the patch was missing or did not apply
+FAILED = "failed"
+
+
+def fetch_files_from_trino(
+    client: TrinoClient,
+    ingestion_date: str,
+    shard: ShardSpec = ShardSpec()
+) -> Iterator[Dict[str, Any]]:
+    # The patch and previous name are only in the landed payload, the parent only in curated.commits
+    query = f"""
+        SELECT
+            f.id,
+            f.repo_id,
+            f.commit_sha,
+            f.filename AS file_path,
+            f.blob_sha,
+            f.status,
+            f.additions,
+            f.deletions,
+            f.changes,
+            json_extract_scalar(f.raw_payload, '$.previous_filename') AS previous_file_path,
+            json_extract_scalar(f.raw_payload, '$.patch') AS patch,
+            c.parent_sha
+        FROM (
+            SELECT
+                *,
+                ROW_NUMBER() OVER (PARTITION BY repo_id, id ORDER BY ingestion_date DESC) AS copy_rank
+            FROM iceberg.landing.commit_files
+            WHERE ingestion_date = DATE '{ingestion_date}'
+              AND {shard.sql_predicate('repo_id')}
+        ) f
+        LEFT JOIN iceberg.curated.commits c
+            ON c.commit_sha = f.commit_sha AND CONCAT(c.owner, '/', c.repo) = f.repo_id
+        WHERE f.copy_rank = 1
+    """
+    return client.iter_rows(query)
+
+
+def fetch_parent_content(github: GitHubClient, file: Dict[str, Any], file_path: str) -> bytes:
+    url = f"/repos/{file['repo_id']}/contents/{file_path}"
+    response = github.get(url, params={"ref": file["parent_sha"]}, accept=ACCEPT_RAW, use_cache=False)
+    response.raise_for_status()
+    return response.content
+
+
+def reconstruct_file(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    pool: Executor,
+    file: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Before-state record of a changed file, its content is put in the blob
+    store. The patch is reverse-applied to the after-state blob in `pool` and
+    the file is only fetched at the parent commit when that is not possible."""
+    status = file["status"]
+    before_path = file["previous_file_path"] or file["file_path"]
+    record = {
+        "id": file["id"],
+        "repo_id": file["repo_id"],
+        "commit_sha": file["commit_sha"],
+        "parent_sha": file["parent_sha"],
+        "file_path": file["file_path"],
+        "before_file_path": before_path,
+        "before_blob_sha": None,
+        "method": ADDED,
+        "ingestion_date": date.today().isoformat()
+    }
+    if status == "added":
+        return record
+    if status == "renamed" and not file["changes"]:
+        record.update(before_blob_sha=file["blob_sha"], method=UNCHANGED)
+        return record
+
+    before: Optional[bytes] = None
+    if file["patch"]:
+        # A removed file has no after-state, its patch removes every line
+        after = b"" if status == "removed" else blob_store.get(file["blob_sha"])
+        if after is not None:
+            try:
+                before, before_sha = pool.submit(
+                    reconstruct_before, after, file["patch"], file["additions"], file["deletions"]
+                ).result()
+            except PatchError as e:
+                print(f"Patch of '{file['file_path']}' at '{file['commit_sha']}' does not apply: {e}")
+        # The sha of a removed file is the one of its before-state, which checks the reconstruction
+        if before is not None and status == "removed" and before_sha != file["blob_sha"]:
+            before = None
+
+    method = PATCH
+    if before is None:
+        if not file["parent_sha"]:
+            raise ValueError("the patch does not apply and the commit has no parent")
+        before = fetch_parent_content(github, file, before_path)
+        before_sha = git_blob_sha(before)
+        method = PARENT
+
+    if not blob_store.has(before_sha):
+        blob_store.put(before_sha, before)
+    if file["parent_sha"]:
+        # The before-state is the file as it was at the parent commit
+        blob_store.link([(file["repo_id"], file["parent_sha"], before_path, before_sha)])
+    record.update(before_blob_sha=before_sha, method=method)
+    return record
+
+
+def process_file(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    pool: Executor,
+    writer: BufferedLandingWriter,
+    file: Dict[str, Any]
+) -> str:
+    try:
+        record = reconstruct_file(github, blob_store, pool, file)
+    except Exception as e:
+        print(f"Failed to reconstruct '{file['file_path']}' before commit '{file['commit_sha']}': {e}")
+        METRICS.inc("pipeline_items_total", kind="before_state", result=FAILED)
+        return FAILED
+    writer.add([record])
+    METRICS.inc("pipeline_items_total", kind="before_state", result=record["method"])
+    return record["method"]
+
+
+def process_files(
+    executor: ThreadPoolExecutor,
+    github: GitHubClient,
+    blob_store: BlobStore,
+    pool: Executor,
+    writer: BufferedLandingWriter,
+    files: Iterable[Dict[str, Any]],
+    max_in_flight: int
+) -> Counter:
+    # Files are submitted while they stream in, with a bounded number in flight
+    methods: Counter = Counter()
+    pending = set()
+    for file in files:
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            methods.update(future.result() for future in done)
+        pending.add(executor.submit(process_file, github, blob_store, pool, writer, file))
+    methods.update(future.result() for future in as_completed(pending))
+    return methods
+
+
+def reconstruct_before_states(
+    github: GitHubClient,
+    blob_store: BlobStore,
+    writer: Any,
+    files: Iterable[Dict[str, Any]],
+    max_workers: int = RECONSTRUCT_WORKERS,
+    processes: int = RECONSTRUCT_PROCESSES
+) -> Tuple[Counter, BufferedLandingWriter]:
+    buffered_writer = BufferedLandingWriter(writer, BEFORE_STATES_TABLE, id_field="id")
+    # Workers are spawned, forking a process already running the MinIO, Trino and writer threads is not safe
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+    with buffered_writer, pool, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        methods = process_files(executor, github, blob_store, pool, buffered_writer, files, max_workers * 4)
+    return methods, buffered_writer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruct the state before the commit of the files changed today")
+    add_shard_argument(parser)
+    args = parser.parse_args()
+
+    trino_client = TrinoClient()
+    writer = get_landing_writer(trino_client, buffered=True)
+    minio_client = MinioClient(max_pool_connections=RECONSTRUCT_WORKERS, upload_workers=RECONSTRUCT_WORKERS)
+    blob_store = create_blob_store(minio_client)
+    github = GitHubClient(pool_maxsize=RECONSTRUCT_WORKERS)
+    today_str = date.today().isoformat()
+
+    with stage_run("before_states", shard=str(args.shard)):
+        files = fetch_files_from_trino(trino_client, today_str, args.shard)
+        try:
+            methods, buffered_writer = reconstruct_before_states(github, blob_store, writer, files)
+        finally:
+            # Uploads the open shards and the manifest in packed mode
+            blob_store.close()
+            minio_client.close()
+
+        print(
+            f"Reconstructed {sum(methods.values()) - methods[FAILED]} before-states: "
+            f"{methods[PATCH]} from patches, {methods[PARENT]} fetched at the parent commit, "
+            f"{methods[ADDED]} added, {methods[UNCHANGED]} unchanged, {methods[FAILED]} failed"
+        )
+        print(buffered_writer.report())
+        print(f"MinIO uploads: {minio_client.upload_throughput()}")
+        github.print_stats()
+    print_shard_summary(
+        "before_states",
+        args.shard,
+        files=sum(methods.values()),
+        from_patch=methods[PATCH],
+        from_parent=methods[PARENT],
+        failed=methods[FAILED],
+        rows=int(buffered_writer.stats["rows"]),
+        failed_rows=int(buffered_writer.stats["failed_rows"])
+    )
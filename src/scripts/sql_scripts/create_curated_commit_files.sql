@@ -1,20 +1,24 @@
 CREATE TABLE iceberg.curated.commit_files AS
-
 SELECT
     id,
     ingestion_date,
-    json_extract_scalar(json_parse(raw_payload), '$.repo_id') AS repo_id,
-    json_extract_scalar(json_parse(raw_payload), '$.commit_sha') AS commit_sha,
-    json_extract_scalar(json_parse(raw_payload), '$.sha') AS blob_sha,
-    json_extract_scalar(json_parse(raw_payload), '$.filename') AS file_path,
-    json_extract_scalar(json_parse(raw_payload), '$.status') AS status,
-    CAST(json_extract_scalar(json_parse(raw_payload), '$.additions') AS INTEGER) AS lines_added,
-    CAST(json_extract_scalar(json_parse(raw_payload), '$.deletions') AS INTEGER) AS lines_removed,
-    CAST(json_extract_scalar(json_parse(raw_payload), '$.changes') AS INTEGER) AS total_changes,
-	SUBSTR(
-		id,
-	    STRPOS(id, '.') + 1
-	  ) AS file_format
-FROM iceberg.landing.commit_files
-
-
+    repo_id,
+    commit_sha,
+    blob_sha,
+    filename AS file_path,
+    status,
+    additions AS lines_added,
+    deletions AS lines_removed,
+    changes AS total_changes,
+    SUBSTR(
+        id,
+        STRPOS(id, '.') + 1
+    ) AS file_format,
+    CONCAT('repositories/blobs/', SUBSTR(blob_sha, 1, 2), '/', blob_sha) AS s3_path
+FROM (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY repo_id, id ORDER BY ingestion_date DESC) AS copy_rank
+    FROM iceberg.landing.commit_files
+)
+WHERE copy_rank = 1
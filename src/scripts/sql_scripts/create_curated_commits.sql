@@ -1,12 +1,18 @@
 CREATE TABLE iceberg.curated.commits AS
 SELECT
-    CAST(json_extract_scalar(raw_payload, '$.sha') AS VARCHAR) AS commit_sha,
-    json_extract_scalar(raw_payload, '$.commit.author.name') AS author_name,
-    json_extract_scalar(raw_payload, '$.commit.author.email') AS author_email,
-    json_extract_scalar(raw_payload, '$.commit.message') AS message,
-    json_extract_scalar(raw_payload, '$.commit.author.date') AS timestamp,
-    json_extract_scalar(raw_payload, '$.owner') AS owner,
-    json_extract_scalar(raw_payload, '$.repo') AS repo,
-    json_extract_scalar(raw_payload, '$.parents[0].sha') AS parent_sha,
+    commit_sha,
+    author_name,
+    author_email,
+    message,
+    author_date AS timestamp,
+    owner,
+    repo,
+    parent_sha,
     ingestion_date
-FROM iceberg.landing.commits
+FROM (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (PARTITION BY owner, repo, id ORDER BY ingestion_date DESC) AS copy_rank
+    FROM iceberg.landing.commits
+)
+WHERE copy_rank = 1
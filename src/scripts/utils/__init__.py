@@ -1 +1,18 @@
 from .storage import TrinoClient, MinioClient
+from .iceberg_writer import IcebergWriter, get_landing_writer
+from .github import GitHubClient, GitHubResponse
+from .http_cache import ResponseCache
+from .watermarks import WatermarkStore
+from .github_graphql import GraphQLCommitFetcher, RepoHistoryState
+from .blob_store import BlobStore, blob_object_name
+from .blob_shards import BlobShardReader, PackedBlobStore
+from .streaming import AsyncStreamReader
+from .archive import BlobMismatchError, VerifiedBlobReader, iter_archive_files
+from .landing_schema import LANDING_COLUMNS, LandingColumn, landing_columns
+from .buffered_writer import BufferedLandingWriter, table_write_report
+from .trino_pool import AsyncTrinoClient, TrinoConnectionPool
+from .sharding import ShardSpec, add_shard_argument, print_shard_summary
+from .metrics import METRICS, MetricsRegistry, stage_run
+from .payload_index import IdempotentLandingWriter, PayloadIndex
+from .work_ledger import WorkLedger, is_retryable
+from .patches import PatchError, git_blob_sha, reconstruct_before, reverse_patch
@@ -0,0 +1,70 @@
+import tarfile
+from io import BytesIO
+from typing import IO, Collection, Iterator, Optional, Tuple
+from .patches import git_blob_hasher
+
+
+class BlobMismatchError(ValueError):
+    """Archive member whose content is not the blob of the commit, e.g. changed by export-subst or eol attributes."""
+
+
+def strip_top_directory(name: str) -> Optional[str]:
+    # GitHub archives wrap the tree in a single `{owner}-{repo}-{short sha}/` directory
+    parts = name.split("/", 1)
+    return parts[1] if len(parts) == 2 and parts[1] else None
+
+
+def iter_archive_files(
+    fileobj: IO[bytes],
+    wanted_paths: Collection[str]
+) -> Iterator[Tuple[str, IO[bytes], int]]:
+    """Yields (path, content, size) for the wanted paths of a repository tarball.
+
+    The archive is read as a stream, so each content must be consumed before
+    the next item is requested, and reading stops once every wanted path was
+    seen instead of downloading the rest of the archive.
+    """
+    remaining = set(wanted_paths)
+    # "r|*" also accepts a body already decompressed in transit
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            path = strip_top_directory(member.name)
+            if path is None or path not in remaining:
+                continue
+            if member.issym():
+                # Git stores a symlink as a blob holding the link target
+                target = member.linkname.encode("utf-8")
+                yield path, BytesIO(target), len(target)
+            elif member.isfile():
+                yield path, archive.extractfile(member), member.size
+            else:
+                continue
+            remaining.discard(path)
+            if not remaining:
+                return
+
+
+class VerifiedBlobReader:
+    """Reads the `size` bytes of an archive member while computing their git
+    blob SHA, and raises BlobMismatchError on the last read when it is not
+    `blob_sha`, so the upload consuming it fails instead of storing them."""
+
+    def __init__(self, fileobj: IO[bytes], blob_sha: str, size: int):
+        self.fileobj = fileobj
+        self.blob_sha = blob_sha
+        self.size = size
+        self.bytes_read = 0
+        self._hasher = git_blob_hasher(size)
+        self._checked = False
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self._hasher.update(data)
+        self.bytes_read += len(data)
+        # Uploads with a known length stop reading at the last byte, the check cannot wait for EOF
+        if not self._checked and (self.bytes_read >= self.size or not data):
+            self._checked = True
+            actual = self._hasher.hexdigest()
+            if self.bytes_read != self.size or actual != self.blob_sha:
+                raise BlobMismatchError(f"archive content has blob SHA '{actual}', expected '{self.blob_sha}'")
+        return data
@@ -0,0 +1,306 @@
+import os
+import uuid
+import asyncio
+import tempfile
+import threading
+from datetime import date
+from io import BytesIO
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from .blob_store import BLOB_INDEX_PATH, BlobStore, blob_object_name
+from .storage import MinioClient
+
+# Shards are uploaded once they hold this many compressed bytes
+BLOB_SHARD_BYTES: int = int(os.getenv("BLOB_SHARD_BYTES", str(64 * 1024 * 1024)))
+BLOB_ZSTD_LEVEL: int = int(os.getenv("BLOB_ZSTD_LEVEL", "3"))
+SHARD_PREFIX = "blob-shards"
+MANIFEST_PREFIX = "blob-manifests"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+ZSTD = "zstd"
+UNCOMPRESSED = "none"  # Blobs stored as their own object before packing was enabled
+
+MANIFEST_SCHEMA = pa.schema([
+    pa.field("blob_sha", pa.string()),
+    pa.field("repo_id", pa.string()),
+    pa.field("commit_sha", pa.string()),
+    pa.field("file_path", pa.string()),
+    pa.field("shard_key", pa.string()),
+    pa.field("offset", pa.int64()),
+    pa.field("length", pa.int64()),  # Stored bytes to read from offset
+    pa.field("size", pa.int64()),  # Blob size once decompressed
+    pa.field("codec", pa.string())
+])
+
+# (shard_key, offset, length, size, codec)
+BlobLocation = Tuple[str, int, int, int, str]
+
+
+def iter_manifests(minio_client: MinioClient, bucket_name: str, prefix: str = MANIFEST_PREFIX) -> Iterator[pa.Table]:
+    if not minio_client.client.bucket_exists(bucket_name):
+        return
+    for obj in minio_client.client.list_objects(bucket_name, prefix=f"{prefix}/", recursive=True):
+        if obj.object_name.endswith(".parquet"):
+            data = minio_client.download_bytes(bucket_name, obj.object_name)
+            if data is not None:
+                yield pq.read_table(BytesIO(data))
+
+
+def manifest_locations(manifest: pa.Table) -> Iterator[Tuple[str, BlobLocation]]:
+    columns = [
+        manifest.column(name).to_pylist()
+        for name in ("blob_sha", "shard_key", "offset", "length", "size", "codec")
+    ]
+    for blob_sha, shard_key, offset, length, size, codec in zip(*columns):
+        yield blob_sha, (shard_key, offset, length, size, codec)
+
+
+class OpenShard:
+    """Shard being filled on disk, one zstd frame per blob."""
+
+    def __init__(self, level: int):
+        self.key = f"{SHARD_PREFIX}/{date.today().isoformat()}/{uuid.uuid4().hex}.zst"
+        self.file = tempfile.TemporaryFile()
+        # Compressors are not thread safe, a shard is only written by one thread at a time
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.blobs: List[Tuple[str, int, int, int]] = []  # (blob_sha, offset, length, size)
+
+
+class PackedBlobStore(BlobStore):
+    """BlobStore packing blobs into zstd compressed shards instead of one
+    object per blob, so a run makes a few large PUTs.
+
+    Every blob is its own zstd frame, readable alone with one range request.
+    Each uploading thread fills its own shard in a temporary file, uploaded
+    once it reaches `shard_bytes`; `flush()` uploads the rest and writes a
+    Parquet manifest of the files linked since the previous flush. A blob only
+    counts as stored once its shard is uploaded, so a crash fetches it again.
+    """
+
+    def __init__(
+        self,
+        minio_client: MinioClient,
+        bucket_name: str = "repositories",
+        index_path: str = BLOB_INDEX_PATH,
+        shard_bytes: int = BLOB_SHARD_BYTES,
+        level: int = BLOB_ZSTD_LEVEL
+    ):
+        self.shard_bytes = shard_bytes
+        self.level = level
+        self._idle: List[OpenShard] = []
+        self._refs: List[Tuple[str, str, str, str]] = []
+        self._accepted: Set[str] = set()  # Blobs written to a shard that is not uploaded yet
+        self._shards_lock = threading.Lock()
+        super().__init__(minio_client, bucket_name, index_path)
+
+    def _create_tables(self) -> None:
+        super()._create_tables()
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blob_locations (
+                blob_sha TEXT PRIMARY KEY,
+                shard_key TEXT,
+                offset INTEGER,
+                length INTEGER,
+                size INTEGER
+            )
+            """
+        )
+
+    def refresh_index(self) -> int:
+        seeded = super().refresh_index()
+        # Packed blobs are not objects of their own, the manifests are the only listing of them
+        for manifest in iter_manifests(self.minio_client, self.bucket_name):
+            packed = [
+                (blob_sha, *location[:4])
+                for blob_sha, location in dict(manifest_locations(manifest)).items()
+                if location[4] == ZSTD
+            ]
+            with self._lock:
+                self.conn.executemany("INSERT OR IGNORE INTO blob_locations VALUES (?, ?, ?, ?, ?)", packed)
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?)", ((row[0], row[4]) for row in packed)
+                )
+                seeded += self.conn.total_changes - before
+                self.conn.commit()
+        return seeded
+
+    def _checkout(self) -> OpenShard:
+        with self._shards_lock:
+            return self._idle.pop() if self._idle else OpenShard(self.level)
+
+    def _upload(self, shard: OpenShard) -> None:
+        length = shard.file.tell()
+        shard.file.seek(0)
+        try:
+            self.minio_client.upload_stream(
+                self.bucket_name, shard.key, shard.file, length=length, content_type="application/zstd"
+            )
+        finally:
+            shard.file.close()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO blob_locations VALUES (?, ?, ?, ?, ?)",
+                ((blob_sha, shard.key, offset, stored, size) for blob_sha, offset, stored, size in shard.blobs)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?)", ((blob[0], blob[3]) for blob in shard.blobs)
+            )
+            self.conn.commit()
+
+    def get(self, blob_sha: str) -> Optional[bytes]:
+        # Only blobs whose shard is uploaded have a location, like they are the only ones `has` knows
+        location = self._locations({blob_sha}).get(blob_sha)
+        if location is None:
+            return None
+        shard_key, offset, length, _, codec = location
+        return BlobShardReader(self.minio_client, self.bucket_name).read_location(shard_key, offset, length, codec)
+
+    def put(self, blob_sha: str, data: bytes) -> None:
+        self.put_stream(blob_sha, BytesIO(data), len(data))
+
+    def put_stream(
+        self,
+        blob_sha: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024
+    ) -> None:
+        shard = self._checkout()
+        offset = shard.file.tell()
+        size = 0
+        try:
+            with shard.compressor.stream_writer(shard.file, size=length, closefd=False) as writer:
+                while True:
+                    chunk = data_stream.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            # A partial frame must not stay in the shard
+            shard.file.seek(offset)
+            shard.file.truncate()
+            with self._shards_lock:
+                self._idle.append(shard)
+            raise
+        shard.blobs.append((blob_sha, offset, shard.file.tell() - offset, size))
+        with self._shards_lock:
+            self._accepted.add(blob_sha)
+
+        if shard.file.tell() >= self.shard_bytes:
+            self._upload(shard)
+        else:
+            with self._shards_lock:
+                self._idle.append(shard)
+
+    async def put_stream_async(
+        self,
+        blob_sha: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024
+    ) -> None:
+        # The stream is read from an upload thread like the MinIO client does, keeping the event loop free
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self.minio_client.executor, self.put_stream, blob_sha, data_stream, length, part_size
+        )
+
+    def accepted(self, blob_sha: str) -> bool:
+        # Files linked to a blob still in an open shard go into the manifest the flush writes with the shard
+        with self._shards_lock:
+            if blob_sha in self._accepted:
+                return True
+        return self.has(blob_sha)
+
+    def link(self, refs: Iterable[Tuple[str, str, str, str]]) -> None:
+        refs = list(refs)
+        super().link(refs)
+        with self._shards_lock:
+            self._refs.extend(refs)
+
+    def _locations(self, blob_shas: Set[str]) -> Dict[str, BlobLocation]:
+        shas = list(blob_shas)
+        locations: Dict[str, BlobLocation] = {}
+        with self._lock:
+            for start in range(0, len(shas), 500):
+                chunk = shas[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                for blob_sha, shard_key, offset, length, size in self.conn.execute(
+                    f"SELECT * FROM blob_locations WHERE blob_sha IN ({placeholders})", chunk
+                ):
+                    locations[blob_sha] = (shard_key, offset, length, size, ZSTD)
+                for blob_sha, size in self.conn.execute(
+                    f"SELECT blob_sha, size FROM blobs WHERE blob_sha IN ({placeholders})", chunk
+                ):
+                    if blob_sha not in locations:
+                        locations[blob_sha] = (blob_object_name(blob_sha), 0, size, size, UNCOMPRESSED)
+        return locations
+
+    def _write_manifest(self, refs: List[Tuple[str, str, str, str]]) -> None:
+        locations = self._locations({ref[3] for ref in refs})
+        # Files whose shard failed to upload are left out, their blob is fetched again next run
+        rows = [ref + locations[ref[3]] for ref in refs if ref[3] in locations]
+        if not rows:
+            return
+        repo_ids, commit_shas, file_paths, blob_shas, shard_keys, offsets, lengths, sizes, codecs = zip(*rows)
+        manifest = pa.table(
+            [blob_shas, repo_ids, commit_shas, file_paths, shard_keys, offsets, lengths, sizes, codecs],
+            schema=MANIFEST_SCHEMA
+        )
+        buffer = BytesIO()
+        pq.write_table(manifest, buffer, compression="zstd")
+        self.minio_client.upload_bytes(
+            self.bucket_name,
+            f"{MANIFEST_PREFIX}/ingestion_date={date.today().isoformat()}/{uuid.uuid4().hex}.parquet",
+            buffer.getvalue(),
+            "application/vnd.apache.parquet"
+        )
+
+    def flush(self) -> None:
+        with self._shards_lock:
+            shards, self._idle = self._idle, []
+            refs, self._refs = self._refs, []
+            self._accepted = set()
+        for shard in shards:
+            if shard.blobs:
+                self._upload(shard)
+            else:
+                shard.file.close()
+        if refs:
+            self._write_manifest(refs)
+
+
+class BlobShardReader:
+    """Reads single blobs back with one ranged GET each, wherever the manifests
+    say they are: in a packed shard or in their own object."""
+
+    def __init__(self, minio_client: MinioClient, bucket_name: str = "repositories"):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        self.locations: Dict[str, BlobLocation] = {}
+
+    def load_manifests(self, prefix: str = MANIFEST_PREFIX) -> int:
+        # e.g. prefix="blob-manifests/ingestion_date=2024-01-31" for the blobs of one day
+        for manifest in iter_manifests(self.minio_client, self.bucket_name, prefix):
+            self.locations.update(manifest_locations(manifest))
+        return len(self.locations)
+
+    def read_location(self, shard_key: str, offset: int, length: int, codec: str = ZSTD) -> bytes:
+        data = self.minio_client.download_range(self.bucket_name, shard_key, offset, length)
+        if codec == UNCOMPRESSED:
+            return data
+        # Frames may not record their content size, decompressobj does not need it
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+    def read(self, blob_sha: str) -> Optional[bytes]:
+        location = self.locations.get(blob_sha)
+        if location is None:
+            return None
+        shard_key, offset, length, _, codec = location
+        return self.read_location(shard_key, offset, length, codec)
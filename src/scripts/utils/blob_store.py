@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, Optional, Tuple
+from .storage import MinioClient
+
+BLOB_INDEX_PATH: str = os.getenv(
+    "BLOB_INDEX_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "repositories_extraction", "blob_index.sqlite")
+)
+BLOB_PREFIX = "blobs"
+
+
+def blob_object_name(blob_sha: str) -> str:
+    # Two character fan-out keeps listings of a single prefix small
+    return f"{BLOB_PREFIX}/{blob_sha[:2]}/{blob_sha}"
+
+
+class BlobStore:
+    """Content-addressed blob storage keyed by the git blob SHA.
+
+    A local SQLite index records which blobs are already in the bucket and which
+    (repo, commit, path) points to which blob, so known blobs are neither
+    downloaded nor uploaded again. The index is seeded from a bucket listing
+    when it is empty, e.g. on a fresh worker.
+    """
+
+    def __init__(
+        self,
+        minio_client: MinioClient,
+        bucket_name: str = "repositories",
+        index_path: str = BLOB_INDEX_PATH
+    ):
+        self.minio_client = minio_client
+        self.bucket_name = bucket_name
+        directory = os.path.dirname(index_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(index_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+        self.conn.commit()
+        self._lock = threading.Lock()
+        if self.conn.execute("SELECT 1 FROM blobs LIMIT 1").fetchone() is None:
+            self.refresh_index()
+
+    def _create_tables(self) -> None:
+        self.conn.execute("CREATE TABLE IF NOT EXISTS blobs (blob_sha TEXT PRIMARY KEY, size INTEGER)")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS blob_refs (
+                repo_id TEXT,
+                commit_sha TEXT,
+                file_path TEXT,
+                blob_sha TEXT,
+                PRIMARY KEY (repo_id, commit_sha, file_path)
+            )
+            """
+        )
+
+    def refresh_index(self) -> int:
+        if not self.minio_client.client.bucket_exists(self.bucket_name):
+            return 0
+        objects = self.minio_client.client.list_objects(
+            self.bucket_name, prefix=f"{BLOB_PREFIX}/", recursive=True
+        )
+        rows = ((obj.object_name.rsplit("/", 1)[-1], obj.size) for obj in objects)
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO blobs VALUES (?, ?)", rows)
+            self.conn.commit()
+            return self.conn.total_changes - before
+
+    def has(self, blob_sha: str) -> bool:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM blobs WHERE blob_sha = ?", (blob_sha,)
+            ).fetchone() is not None
+
+    def accepted(self, blob_sha: str) -> bool:
+        # Stored, or written this run and stored by the next flush; every put is stored before it returns here
+        return self.has(blob_sha)
+
+    def lookup(self, repo_id: str, commit_sha: str, file_path: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT blob_sha FROM blob_refs WHERE repo_id = ? AND commit_sha = ? AND file_path = ?",
+                (repo_id, commit_sha, file_path)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, blob_sha: str) -> Optional[bytes]:
+        return self.minio_client.download_bytes(self.bucket_name, blob_object_name(blob_sha))
+
+    def put(self, blob_sha: str, data: bytes) -> None:
+        self.minio_client.upload_bytes(
+            self.bucket_name,
+            blob_object_name(blob_sha),
+            data,
+            "application/octet-stream"
+        )
+        self.mark_stored(blob_sha, len(data))
+
+    def put_stream(
+        self,
+        blob_sha: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024
+    ) -> None:
+        self.minio_client.upload_stream(
+            self.bucket_name,
+            blob_object_name(blob_sha),
+            data_stream,
+            length=length,
+            part_size=part_size
+        )
+        self.mark_stored(blob_sha, length if length >= 0 else data_stream.bytes_read)
+
+    async def put_stream_async(
+        self,
+        blob_sha: str,
+        data_stream: Any,
+        length: int = -1,
+        part_size: int = 5 * 1024 * 1024
+    ) -> None:
+        await self.minio_client.upload_stream_async(
+            self.bucket_name,
+            blob_object_name(blob_sha),
+            data_stream,
+            length=length,
+            part_size=part_size
+        )
+        self.mark_stored(blob_sha, length if length >= 0 else data_stream.bytes_read)
+
+    def mark_stored(self, blob_sha: str, size: int) -> None:
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (blob_sha, size))
+            self.conn.commit()
+
+    def link(self, refs: Iterable[Tuple[str, str, str, str]]) -> None:
+        # refs are (repo_id, commit_sha, file_path, blob_sha)
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO blob_refs VALUES (?, ?, ?, ?)", refs)
+            self.conn.commit()
+
+    def flush(self) -> None:
+        # Every blob is its own object, uploaded before put returns: nothing is left to write
+        pass
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
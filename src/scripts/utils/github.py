@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+from dotenv import load_dotenv
+from .rate_limit import RATE_LIMIT_STATUSES, RateLimitScheduler, resource_for_path
+from .http_cache import HTTP_CACHE_PATH, CacheEntry, ResponseCache, is_immutable
+from .metrics import METRICS
+
+load_dotenv()
+
+GITHUB_TOKEN: Optional[str] = os.getenv("GITHUB_TOKEN")
+# Comma separated pool of tokens, requests are spread across them by the rate limit scheduler
+GITHUB_TOKENS: List[str] = [
+    token.strip() for token in os.getenv("GITHUB_TOKENS", GITHUB_TOKEN or "").split(",") if token.strip()
+]
+GITHUB_API_URL: str = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+ACCEPT_JSON = "application/vnd.github+json"
+ACCEPT_RAW = "application/vnd.github.v3.raw"
+
+
+def endpoint_name(path: str) -> str:
+    # Collapse owner/repo/ref/path segments so stats are grouped per endpoint, not per URL.
+    # Renamed or transferred repositories are addressed by id, e.g. in pagination links
+    parts = path.split("?")[0].strip("/").split("/")
+    if parts[0] == "repos" and len(parts) >= 3:
+        parts[1:3] = ["{owner}", "{repo}"]
+        resource = 3
+    elif parts[0] == "repositories" and len(parts) >= 2:
+        parts[1] = "{repo_id}"
+        resource = 2
+    else:
+        return "/" + "/".join(parts)
+    if len(parts) > resource + 1:
+        parts = parts[:resource + 1] + ["{path}" if parts[resource] == "contents" else "{ref}"]
+    return "/" + "/".join(parts)
+
+
+class GitHubResponse:
+    def __init__(self, url: str, status: int, headers: CaseInsensitiveDict, content: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def links(self) -> Dict[str, Dict[str, str]]:
+        link_header = self.headers.get("Link")
+        if not link_header:
+            return {}
+        return {link.get("rel"): link for link in parse_header_links(link_header)}
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status} Error for url: {self.url}", response=self)
+
+
+class GitHubClient:
+    """GitHub REST client shared by the extractors.
+
+    Keeps pooled keep-alive connections for both the requests (sync) and the
+    aiohttp (async) paths and records call latency per endpoint. Every call
+    takes a token from the rate limit scheduler and rate limited responses
+    are retried once the scheduler allows it. Responses go through an on-disk
+    ETag cache: repeated calls are revalidated with If-None-Match, and 304s,
+    which do not count against the rate limit, are served from the cache.
+    """
+
+    def __init__(
+        self,
+        tokens: Optional[List[str]] = None,
+        base_url: str = GITHUB_API_URL,
+        pool_connections: int = 10,
+        pool_maxsize: int = 20,
+        async_pool_size: int = 20,
+        timeout: float = 60,
+        scheduler: Optional[RateLimitScheduler] = None,
+        max_retries: int = 5,
+        cache: Optional[ResponseCache] = None
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.headers: Dict[str, str] = {"Accept": ACCEPT_JSON}
+        self.scheduler = scheduler or RateLimitScheduler(tokens if tokens is not None else GITHUB_TOKENS)
+        self.max_retries = max_retries
+        # Set GITHUB_CACHE_PATH to an empty value to disable the response cache
+        self.cache = cache if cache is not None else (ResponseCache() if HTTP_CACHE_PATH else None)
+        self.timeout = timeout
+        self.async_pool_size = async_pool_size
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+
+        self._async_session: Optional[aiohttp.ClientSession] = None
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+
+    def _url(self, path: str) -> str:
+        return path if path.startswith("http") else f"{self.base_url}/{path.lstrip('/')}"
+
+    @staticmethod
+    def _request_headers(
+        token: Optional[str],
+        accept: Optional[str],
+        entry: Optional[CacheEntry]
+    ) -> Dict[str, str]:
+        headers = entry.conditional_headers() if entry else {}
+        if accept:
+            headers["Accept"] = accept
+        if token:
+            headers["Authorization"] = f"token {token}"
+        return headers
+
+    def _cache_lookup(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        accept: Optional[str],
+        use_cache: bool
+    ) -> Tuple[Optional[str], Optional[CacheEntry]]:
+        if self.cache is None or not use_cache:
+            return None, None
+        key = self.cache.key(url, params, accept)
+        return key, self.cache.lookup(key)
+
+    def _cache_response(
+        self,
+        key: Optional[str],
+        entry: Optional[CacheEntry],
+        url: str,
+        response: GitHubResponse
+    ) -> GitHubResponse:
+        if key is None:
+            return response
+        if response.status == 304 and entry is not None:
+            self.cache.record_hit(revalidated=True)
+            return GitHubResponse(response.url, entry.status, CaseInsensitiveDict(entry.headers), entry.content)
+        if entry is not None:
+            self.cache.record_miss()
+        if response.status == 200:
+            self.cache.store(key, response.status, response.headers, response.content, is_immutable(url))
+        return response
+
+    def _record(self, url: str, status: int, seconds: float) -> None:
+        endpoint = endpoint_name(url[len(self.base_url):] if url.startswith(self.base_url) else url)
+        with self._stats_lock:
+            stats = self._stats.setdefault(
+                endpoint, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+            )
+            stats["calls"] += 1
+            stats["errors"] += status >= 400
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        METRICS.inc("github_requests_total", endpoint=endpoint, status=status)
+        METRICS.observe("github_request_duration_seconds", seconds, endpoint=endpoint)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._stats_lock:
+            return {
+                endpoint: {**stats, "avg_seconds": stats["total_seconds"] / stats["calls"]}
+                for endpoint, stats in self._stats.items()
+            }
+
+    def print_stats(self) -> None:
+        for endpoint, stats in sorted(self.stats().items()):
+            print(
+                f"{endpoint}: {int(stats['calls'])} calls, {int(stats['errors'])} errors, "
+                f"avg {stats['avg_seconds'] * 1000:.1f} ms, max {stats['max_seconds'] * 1000:.1f} ms"
+            )
+        if self.cache is not None:
+            cache_stats = self.cache.stats()
+            print(
+                f"response cache: {cache_stats['hits']} hits, {cache_stats['revalidated']} revalidated, "
+                f"{cache_stats['misses']} misses, {cache_stats['evictions']} evictions"
+            )
+        for budget, state in sorted(self.scheduler.snapshot().items()):
+            print(f"rate limit {budget}: {state['remaining']}/{state['limit']} remaining")
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]] = None,
+        json_body: Optional[Dict[str, Any]] = None,
+        accept: Optional[str] = None,
+        entry: Optional[CacheEntry] = None
+    ) -> GitHubResponse:
+        resource = resource_for_path(url)
+        for attempt in range(self.max_retries + 1):
+            token = self.scheduler.acquire(resource)
+            start = time.perf_counter()
+            response = self.session.request(
+                method,
+                url,
+                params=params,
+                json=json_body,
+                headers=self._request_headers(token, accept, entry),
+                timeout=self.timeout
+            )
+            self._record(url, response.status_code, time.perf_counter() - start)
+            retry = self.scheduler.update(
+                token, resource, response.status_code, response.headers, response.content
+            )
+            if not retry or attempt == self.max_retries:
+                break
+        return GitHubResponse(response.url, response.status_code, response.headers, response.content)
+
+    def get(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        accept: Optional[str] = None,
+        use_cache: bool = True
+    ) -> GitHubResponse:
+        url = self._url(path)
+        key, entry = self._cache_lookup(url, params, accept, use_cache)
+        if entry is not None and entry.immutable:
+            return GitHubResponse(url, entry.status, CaseInsensitiveDict(entry.headers), entry.content)
+        response = self._send("GET", url, params=params, accept=accept, entry=entry)
+        return self._cache_response(key, entry, url, response)
+
+    def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        # Returns the whole body, partial `errors` are left to the caller
+        response = self._send(
+            "POST", self._url("/graphql"), json_body={"query": query, "variables": variables or {}}
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        response = self.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_pages(self, path: str, params: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+        # Follows the Link rel="next" headers, yielding each page as soon as it arrives
+        url: Optional[str] = path
+        while url:
+            response = self.get(url, params=params)
+            response.raise_for_status()
+            yield response.json()
+            url = response.links.get("next", {}).get("url")
+            params = None  # The next link already carries the query string
+
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        # Created lazily so it binds to the running event loop
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.async_pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._async_session
+
+    async def aget(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        accept: Optional[str] = None,
+        use_cache: bool = True
+    ) -> GitHubResponse:
+        url = self._url(path)
+        key, entry = self._cache_lookup(url, params, accept, use_cache)
+        if entry is not None and entry.immutable:
+            return GitHubResponse(url, entry.status, CaseInsensitiveDict(entry.headers), entry.content)
+
+        resource = resource_for_path(url)
+        for attempt in range(self.max_retries + 1):
+            token = await self.scheduler.acquire_async(resource)
+            start = time.perf_counter()
+            async with self._get_async_session().get(
+                url, params=params, headers=self._request_headers(token, accept, entry)
+            ) as response:
+                content = await response.read()
+            self._record(url, response.status, time.perf_counter() - start)
+            headers = CaseInsensitiveDict(response.headers)
+            retry = self.scheduler.update(token, resource, response.status, headers, content)
+            if not retry or attempt == self.max_retries:
+                break
+        return self._cache_response(
+            key, entry, url, GitHubResponse(str(response.url), response.status, headers, content)
+        )
+
+    @asynccontextmanager
+    async def astream(
+        self,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        accept: Optional[str] = None
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        # Yields the response once headers arrive, the body is left for the caller to stream
+        url = self._url(path)
+        resource = resource_for_path(url)
+        for attempt in range(self.max_retries + 1):
+            token = await self.scheduler.acquire_async(resource)
+            start = time.perf_counter()
+            response = await self._get_async_session().get(
+                url, params=params, headers=self._request_headers(token, accept, None)
+            )
+            self._record(url, response.status, time.perf_counter() - start)
+            content = await response.read() if response.status in RATE_LIMIT_STATUSES else b""
+            retry = self.scheduler.update(
+                token, resource, response.status, CaseInsensitiveDict(response.headers), content
+            )
+            if not retry or attempt == self.max_retries:
+                break
+            response.release()
+        try:
+            yield response
+        finally:
+            response.release()
+
+    async def aget_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        response = await self.aget(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self) -> None:
+        if self._async_session is not None:
+            await self._async_session.close()
+
+    def close(self) -> None:
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
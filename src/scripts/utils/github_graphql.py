@@ -0,0 +1,188 @@
+import json
+import math
+import requests
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from .github import GitHubClient
+
+COMMIT_FIELDS = """
+fragment CommitFields on Commit {
+  oid
+  url
+  message
+  additions
+  deletions
+  changedFilesIfAvailable
+  author { name email date user { login } }
+  committer { name email date user { login } }
+  parents(first: 5) { nodes { oid } }
+}
+"""
+
+
+class RepoHistoryState:
+    def __init__(
+        self,
+        owner_repo: str,
+        limit: Optional[int] = None,
+        since: Optional[str] = None,
+        stop_sha: Optional[str] = None
+    ):
+        self.owner_repo = owner_repo
+        self.limit = limit
+        self.since = since
+        self.stop_sha = stop_sha
+        self.cursor: Optional[str] = None
+        self.fetched = 0
+
+    def page_size(self, per_page: int) -> int:
+        if self.limit is None:
+            return per_page
+        return max(min(per_page, self.limit - self.fetched), 1)
+
+
+def build_history_query(states: List[RepoHistoryState], per_page: int) -> str:
+    repositories = []
+    for index, state in enumerate(states):
+        owner, name = state.owner_repo.split("/")
+        arguments = [f"first: {state.page_size(per_page)}"]
+        if state.since:
+            arguments.append(f"since: {json.dumps(state.since)}")
+        if state.cursor:
+            arguments.append(f"after: {json.dumps(state.cursor)}")
+        repositories.append(
+            f"""
+  r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{
+    defaultBranchRef {{
+      target {{
+        ... on Commit {{
+          history({", ".join(arguments)}) {{
+            pageInfo {{ hasNextPage endCursor }}
+            nodes {{ ...CommitFields }}
+          }}
+        }}
+      }}
+    }}
+  }}"""
+        )
+    return "query {\n  rateLimit { cost remaining resetAt }" + "".join(repositories) + "\n}\n" + COMMIT_FIELDS
+
+
+def _user(person: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    user = (person or {}).get("user")
+    return {"login": user["login"]} if user else None
+
+
+def commit_node_to_payload(node: Dict[str, Any]) -> Dict[str, Any]:
+    # Same shape as the REST commit payload the curated layer reads from landing.commits
+    author = node.get("author") or {}
+    committer = node.get("committer") or {}
+    additions = node.get("additions") or 0
+    deletions = node.get("deletions") or 0
+    return {
+        "sha": node["oid"],
+        "html_url": node.get("url"),
+        "commit": {
+            "author": {"name": author.get("name"), "email": author.get("email"), "date": author.get("date")},
+            "committer": {
+                "name": committer.get("name"),
+                "email": committer.get("email"),
+                "date": committer.get("date")
+            },
+            "message": node.get("message")
+        },
+        "author": _user(author),
+        "committer": _user(committer),
+        "parents": [{"sha": parent["oid"]} for parent in node["parents"]["nodes"]],
+        "stats": {"additions": additions, "deletions": deletions, "total": additions + deletions},
+        "changedFiles": node.get("changedFilesIfAvailable")
+    }
+
+
+class GraphQLCommitFetcher:
+    """Fetches commit history for many repositories per GraphQL query.
+
+    Queries start at `initial_batch_size` repositories. The batch only shrinks
+    when the `rateLimit.cost` of a query goes over `target_cost` points, or is
+    halved when GitHub times out on a query, and grows back by doubling.
+    """
+
+    def __init__(
+        self,
+        github: GitHubClient,
+        per_page: int = 100,
+        target_cost: int = 100,
+        initial_batch_size: int = 50,
+        max_batch_size: int = 50
+    ):
+        self.github = github
+        self.per_page = per_page
+        self.target_cost = target_cost
+        self.batch_size = initial_batch_size
+        self.max_batch_size = max_batch_size
+        self.queries = 0
+        self.total_cost = 0
+        self.pages = 0  # Repository history pages fetched, to report the points per page
+
+    def _adjust_batch_size(self, batch_size: int, cost: int) -> None:
+        cost_per_repo = max(cost, 1) / batch_size
+        fits = math.floor(self.target_cost / cost_per_repo)
+        self.batch_size = max(1, min(self.max_batch_size, fits, batch_size * 2))
+
+    def iter_batches(
+        self,
+        states: List[RepoHistoryState]
+    ) -> Iterator[List[Tuple[str, List[Dict[str, Any]], bool]]]:
+        # Yields, per query, (owner_repo, commits, finished) for every repository in the batch.
+        # A repository whose history failed is not finished, so its watermark stays where it was
+        queue: Deque[RepoHistoryState] = deque(states)
+        while queue:
+            batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+            try:
+                body = self.github.graphql(build_history_query(batch, self.per_page))
+                error = None if body.get("data") else body.get("errors")
+            except requests.HTTPError as e:
+                error = e
+
+            if error:
+                if len(batch) == 1:
+                    print(f"Failed to fetch commits for {batch[0].owner_repo}: {error}")
+                    yield [(batch[0].owner_repo, [], False)]
+                    continue
+                # Large queries time out on GitHub's side, retry with smaller batches
+                self.batch_size = max(1, len(batch) // 2)
+                queue.extendleft(reversed(batch))
+                continue
+
+            data = body["data"]
+            cost = (data.get("rateLimit") or {}).get("cost", 1)
+            self.queries += 1
+            self.total_cost += cost
+            self.pages += len(batch)
+            self._adjust_batch_size(len(batch), cost)
+
+            results = []
+            for index, state in enumerate(batch):
+                repository = data.get(f"r{index}")
+                history = (((repository or {}).get("defaultBranchRef") or {}).get("target") or {}).get("history")
+                if history is None:
+                    print(f"No commit history returned for {state.owner_repo}.")
+                    results.append((state.owner_repo, [], False))
+                    continue
+
+                commits = []
+                finished = not history["pageInfo"]["hasNextPage"]
+                for node in history["nodes"]:
+                    if node["oid"] == state.stop_sha or (state.limit and state.fetched >= state.limit):
+                        finished = True
+                        break
+                    commits.append(commit_node_to_payload(node))
+                    state.fetched += 1
+                if state.limit and state.fetched >= state.limit:
+                    finished = True
+
+                if not finished:
+                    state.cursor = history["pageInfo"]["endCursor"]
+                    queue.append(state)
+                results.append((state.owner_repo, commits, finished))
+            yield results
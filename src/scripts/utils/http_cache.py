@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Mapping, Optional
+
+HTTP_CACHE_PATH: str = os.getenv(
+    "GITHUB_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "repositories_extraction", "github.sqlite")
+)
+HTTP_CACHE_MAX_BYTES: int = int(os.getenv("GITHUB_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Response headers that callers read back from cached responses
+CACHED_HEADERS = ("Content-Type", "Link")
+
+# A commit addressed by its full SHA can never change, whether the repository is named or addressed by id
+IMMUTABLE_URL = re.compile(r"/(?:repos/[^/]+/[^/]+|repositories/\d+)/commits/[0-9a-f]{40}$")
+
+
+def is_immutable(url: str) -> bool:
+    return bool(IMMUTABLE_URL.search(url.split("?")[0]))
+
+
+class CacheEntry:
+    def __init__(
+        self,
+        key: str,
+        status: int,
+        headers: Dict[str, str],
+        content: bytes,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        immutable: bool
+    ):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.immutable = immutable
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """SQLite backed cache of GitHub responses with ETag/Last-Modified validators.
+
+    Entries are evicted least recently used first once the stored bodies exceed
+    `max_bytes`.
+    """
+
+    def __init__(self, path: str = HTTP_CACHE_PATH, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER,
+                headers TEXT,
+                content BLOB,
+                etag TEXT,
+                last_modified TEXT,
+                immutable INTEGER,
+                size INTEGER,
+                last_access REAL
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.counters: Dict[str, int] = {"hits": 0, "revalidated": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def key(url: str, params: Optional[Mapping[str, Any]] = None, accept: Optional[str] = None) -> str:
+        params_str = json.dumps(sorted((params or {}).items()), default=str)
+        return hashlib.sha256(f"{url}\n{params_str}\n{accept or ''}".encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT status, headers, content, etag, last_modified, immutable FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        status, headers, content, etag, last_modified, immutable = row
+        entry = CacheEntry(key, status, json.loads(headers), content, etag, last_modified, bool(immutable))
+        if entry.immutable:
+            self.record_hit()
+        return entry
+
+    def record_hit(self, revalidated: bool = False) -> None:
+        with self._lock:
+            self.counters["revalidated" if revalidated else "hits"] += 1
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.counters["misses"] += 1
+
+    def store(
+        self,
+        key: str,
+        status: int,
+        headers: Mapping[str, str],
+        content: bytes,
+        immutable: bool = False
+    ) -> None:
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not (immutable or etag or last_modified) or len(content) > self.max_bytes:
+            return
+        kept_headers = {name: headers[name] for name in CACHED_HEADERS if name in headers}
+        with self._lock:
+            previous = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, status, json.dumps(kept_headers), content, etag, last_modified,
+                    int(immutable), len(content), time.time()
+                )
+            )
+            self._size += len(content) - (previous[0] if previous else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        while self._size > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self.counters["evictions"] += 1
+                if self._size <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, "bytes": self._size}
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,227 @@
+import os
+import time
+import json
+import itertools
+from datetime import date
+from functools import reduce
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+from pyiceberg.catalog import Catalog, load_catalog
+from pyiceberg.expressions import AlwaysFalse, And, BooleanExpression, EqualTo, In, IsNull, Or
+from .landing_schema import (
+    LANDING_SCHEMA,
+    LandingColumn,
+    landing_arrow_schema,
+    landing_columns,
+    payload_hash,
+    repo_key_columns
+)
+from .metrics import METRICS
+from .payload_index import PAYLOAD_INDEX_PATH, IdempotentLandingWriter, PayloadIndex
+
+RECORD_BATCH_ROWS: int = 10_000
+TARGET_FILE_SIZE_BYTES: int = 128 * 1024 * 1024
+
+
+def iter_record_batches(
+    rows: Iterable[Dict[str, Any]],
+    id_field: str,
+    ingestion_date: date,
+    batch_rows: int = RECORD_BATCH_ROWS,
+    columns: Sequence[LandingColumn] = (),
+    payload_hashes: Optional[Iterable[str]] = None
+) -> Iterator[pa.RecordBatch]:
+    schema = pa.schema(list(LANDING_SCHEMA) + [pa.field(column.name, column.arrow_type) for column in columns])
+    hash_iterator = iter(payload_hashes) if payload_hashes is not None else None
+    ids: List[Optional[str]] = []
+    payloads: List[str] = []
+    hashes: List[str] = []
+    values: List[List[Any]] = [[] for _ in columns]
+
+    def build() -> pa.RecordBatch:
+        return pa.RecordBatch.from_arrays(
+            [
+                pa.array(ids, type=pa.string()),
+                pa.array([ingestion_date] * len(ids), type=pa.date32()),
+                pa.array(payloads, type=pa.string()),
+                pa.array(hashes, type=pa.string())
+            ] + [pa.array(column_values, type=column.arrow_type) for column, column_values in zip(columns, values)],
+            schema=schema
+        )
+
+    for row in rows:
+        record_id = row.get(id_field)
+        ids.append(None if record_id is None else str(record_id))
+        payloads.append(json.dumps(row))
+        hashes.append(next(hash_iterator) if hash_iterator is not None else payload_hash(row))
+        for column, column_values in zip(columns, values):
+            column_values.append(column.extract(row))
+        if len(ids) >= batch_rows:
+            yield build()
+            ids, payloads, hashes = [], [], []
+            values = [[] for _ in columns]
+
+    if ids:
+        yield build()
+
+
+def iter_tables(batches: Iterable[pa.RecordBatch], schema: pa.Schema, max_bytes: int) -> Iterator[pa.Table]:
+    # Groups the record batches into tables of about max_bytes of Arrow memory, appended one at a time
+    chunk: List[pa.RecordBatch] = []
+    size = 0
+    for batch in batches:
+        chunk.append(batch)
+        size += batch.nbytes
+        if size >= max_bytes:
+            yield pa.Table.from_batches(chunk, schema=schema)
+            chunk, size = [], 0
+    if chunk:
+        yield pa.Table.from_batches(chunk, schema=schema)
+
+
+def upsert_filter(rows: Iterable[Dict[str, Any]], id_field: str, table_name: str) -> BooleanExpression:
+    # Landed rows replaced by `rows`: the same ids in the same repository, forks share commit SHAs
+    columns = repo_key_columns(table_name)
+    ids_by_repo: Dict[Tuple[Any, ...], List[str]] = {}
+    for row in rows:
+        if row.get(id_field) is not None:
+            repo = tuple(column.extract(row) for column in columns)
+            ids_by_repo.setdefault(repo, []).append(str(row[id_field]))
+    predicates = [
+        reduce(
+            And,
+            [
+                IsNull(column.name) if value is None else EqualTo(column.name, value)
+                for column, value in zip(columns, repo)
+            ],
+            In("id", ids)
+        )
+        for repo, ids in ids_by_repo.items()
+    ]
+    return reduce(Or, predicates) if predicates else AlwaysFalse()
+
+
+def added_data_files(table: Any, since_snapshot_id: Optional[int]) -> int:
+    # Files added by the snapshots committed after `since_snapshot_id`, a commit can hold several
+    files = 0
+    snapshot = table.current_snapshot()
+    while snapshot is not None and snapshot.snapshot_id != since_snapshot_id:
+        files += int(snapshot.summary.get("added-data-files", 0)) if snapshot.summary else 0
+        snapshot = table.snapshot_by_id(snapshot.parent_snapshot_id) if snapshot.parent_snapshot_id else None
+    return files
+
+
+class IcebergWriter:
+    """Writes landing payloads as Parquet files straight to the warehouse and
+    commits them through the Iceberg catalog, without going through Trino."""
+
+    def __init__(
+        self,
+        catalog: Optional[Catalog] = None,
+        catalog_name: str = "iceberg",
+        uri: str = "http://catalog:19120/iceberg",
+        s3_endpoint: str = "http://storage:9000",
+        access_key: str = "admin",
+        secret_key: str = "password",
+        region: str = "us-east-1",
+        batch_rows: int = RECORD_BATCH_ROWS,
+        target_file_size_bytes: Optional[int] = TARGET_FILE_SIZE_BYTES
+    ):
+        self.catalog_name = catalog_name
+        self.catalog = catalog or load_catalog(
+            catalog_name,
+            **{
+                "type": "rest",
+                "uri": uri,
+                "s3.endpoint": s3_endpoint,
+                "s3.access-key-id": access_key,
+                "s3.secret-access-key": secret_key,
+                "s3.region": region,
+                "s3.path-style-access": "true"
+            }
+        )
+        self.batch_rows = batch_rows
+        self.target_file_size_bytes = target_file_size_bytes
+
+    def _identifier(self, table_name: str) -> str:
+        # Accept the same fully qualified names used with Trino, e.g. iceberg.landing.commits
+        prefix = f"{self.catalog_name}."
+        return table_name[len(prefix):] if table_name.startswith(prefix) else table_name
+
+    def insert_raw_payloads(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str,
+        payload_hashes: Optional[Iterable[str]] = None,
+        upsert: bool = False
+    ) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        columns = landing_columns(table_name)
+        if upsert:
+            # Only changed rows are upserted, few enough to be kept to build the delete filter
+            rows = list(rows)
+            delete_filter = upsert_filter(rows, id_field, table_name)
+        batches = iter_record_batches(rows, id_field, date.today(), self.batch_rows, columns, payload_hashes)
+        first = next(batches, None)
+        if first is None:
+            return []
+
+        table = self.catalog.load_table(self._identifier(table_name))
+        previous = table.current_snapshot()
+        row_count = 0
+        size = 0
+
+        # Property update, delete and appends go into one transaction, committed to the catalog at once. Every
+        # operation still makes its own snapshot, readers only see them together
+        with table.transaction() as transaction:
+            target = str(self.target_file_size_bytes) if self.target_file_size_bytes else None
+            if target and table.properties.get("write.target-file-size-bytes") != target:
+                transaction.set_properties({"write.target-file-size-bytes": target})
+            if upsert:
+                # Copy-on-write delete of the previous rows with these ids, committed with the append
+                transaction.delete(delete_filter)
+            # Batches are appended as they are built instead of being collected first
+            for chunk in iter_tables(
+                itertools.chain([first], batches),
+                landing_arrow_schema(table_name),
+                self.target_file_size_bytes or TARGET_FILE_SIZE_BYTES
+            ):
+                transaction.append(chunk)
+                row_count += chunk.num_rows
+                size += chunk.nbytes
+
+        table.refresh()
+        snapshot = table.current_snapshot()
+        METRICS.inc("landing_inserted_rows_total", row_count, table=table_name, writer="iceberg")
+        METRICS.inc("landing_inserted_bytes_total", size, table=table_name, writer="iceberg")
+        return [{
+            "batch": 0,
+            "rows": row_count,
+            "bytes": size,
+            "seconds": time.perf_counter() - start,
+            "snapshot_id": snapshot.snapshot_id if snapshot else None,
+            "files": added_data_files(table, previous.snapshot_id if previous else None)
+        }]
+
+    def upsert_raw_payloads(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str,
+        **kwargs: Any
+    ) -> List[Dict[str, Any]]:
+        return self.insert_raw_payloads(table_name, rows, id_field, upsert=True, **kwargs)
+
+
+def get_landing_writer(trino_client, payload_index_path: str = PAYLOAD_INDEX_PATH, buffered: bool = False):
+    # LANDING_WRITER=iceberg switches the extractors to the direct Parquet writer. Buffered writers use it by
+    # default: Trino caps a statement at about 1 MB, so a large flush through Trino is many INSERTs, each with
+    # its own files and snapshot, where the Parquet writer commits the whole flush at once
+    default = "iceberg" if buffered else "trino"
+    writer = IcebergWriter() if os.getenv("LANDING_WRITER", default).lower() == "iceberg" else trino_client
+    # LANDING_WRITE_MODE=append lands every row again, even when the same payload is already there
+    if os.getenv("LANDING_WRITE_MODE", "idempotent").lower() == "append":
+        return writer
+    return IdempotentLandingWriter(writer, PayloadIndex(trino_client, payload_index_path))
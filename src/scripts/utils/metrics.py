@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Directory scraped by node_exporter's textfile collector, one .prom file per stage
+METRICS_TEXTFILE_DIR: Optional[str] = os.getenv("METRICS_TEXTFILE_DIR") or None
+# Directory receiving a JSON report of every run
+METRICS_REPORT_DIR: Optional[str] = os.getenv("METRICS_REPORT_DIR") or None
+
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP: Dict[str, str] = {
+    "github_requests_total": "GitHub API calls by endpoint and status",
+    "github_request_duration_seconds": "GitHub API call latency by endpoint, until the headers for streamed bodies",
+    "github_rate_limit_remaining": "Requests left in the current rate limit window per resource and token",
+    "github_rate_limit_limit": "Size of the rate limit window per resource and token",
+    "github_rate_limited_total": "Responses that parked a token until its rate limit allowed a retry",
+    "trino_query_duration_seconds": "Trino statement latency by statement kind",
+    "trino_pool_wait_seconds": "Time spent waiting for a pooled Trino connection",
+    "landing_inserted_rows_total": "Rows written to landing tables by table and writer",
+    "landing_inserted_bytes_total": "Statement or Arrow bytes written to landing tables by table and writer",
+    "landing_skipped_rows_total": "Rows not landed again because the same payload is already landed for their id",
+    "landing_upserted_rows_total": "Rows replacing the landed row of their id because the payload changed",
+    "minio_uploaded_objects_total": "Objects uploaded to MinIO by bucket",
+    "minio_uploaded_bytes_total": "Bytes uploaded to MinIO by bucket",
+    "minio_upload_duration_seconds": "MinIO upload latency by bucket",
+    "pipeline_items_total": "Items handled by a stage by kind and result",
+    "pipeline_stage_duration_seconds": "Wall time of the last run of a stage",
+    "pipeline_stage_peak_rss_bytes": "Peak resident memory of the last run of a stage",
+    "pipeline_stage_last_run_timestamp_seconds": "End time of the last run of a stage",
+    "pipeline_stage_success": "1 when the last run of a stage finished without an exception"
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def series_name(name: str, labels: LabelKey) -> str:
+    if not labels:
+        return name
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return name + "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def format_number(value: float) -> str:
+    # Exact digits for counters, byte sizes and timestamps, which "%g" would round
+    if float(value).is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Linear interpolation inside the bucket holding the rank, like PromQL's histogram_quantile
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """Counters, gauges and latency histograms kept in process memory.
+
+    Recording is a dictionary update under a lock, cheap enough for every
+    HTTP call and statement. Nothing is sent anywhere while the run goes on:
+    the values are exported once per stage, as a Prometheus textfile and/or a
+    JSON run report (see `stage_run`).
+    """
+
+    def __init__(self):
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, LabelKey]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, seconds: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        described = set()
+
+        def describe(name: str, kind: str) -> None:
+            if name not in described:
+                described.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                describe(name, "counter")
+                lines.append(f"{series_name(name, labels)} {format_number(value)}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                describe(name, "gauge")
+                lines.append(f"{series_name(name, labels)} {format_number(value)}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                describe(name, "histogram")
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{series_name(name + '_bucket', labels + (('le', le),))} {cumulative}")
+                lines.append(f"{series_name(name + '_sum', labels)} {format_number(histogram.sum)}")
+                lines.append(f"{series_name(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": {series_name(name, labels): value for (name, labels), value in sorted(self._counters.items())},
+                "gauges": {series_name(name, labels): value for (name, labels), value in sorted(self._gauges.items())},
+                "histograms": {
+                    series_name(name, labels): {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p99": histogram.quantile(0.99)
+                    }
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                }
+            }
+
+    def time_breakdown(self) -> Dict[str, float]:
+        # Seconds spent per histogram, all labels together, to see where a run's time goes
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for (name, _), histogram in self._histograms.items():
+                totals[name] = totals.get(name, 0.0) + histogram.sum
+        return totals
+
+
+METRICS = MetricsRegistry()
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # The textfile collector may read at any time, it must never see a partial file
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+def export_metrics(
+    stage: str,
+    shard: Optional[str] = None,
+    report: Optional[Dict[str, Any]] = None,
+    registry: MetricsRegistry = METRICS,
+    textfile_dir: Optional[str] = METRICS_TEXTFILE_DIR,
+    report_dir: Optional[str] = METRICS_REPORT_DIR
+) -> None:
+    name = stage if shard is None else f"{stage}_shard_{shard.replace('/', '_of_')}"
+    if textfile_dir:
+        _write_atomically(os.path.join(textfile_dir, f"repositories_extraction_{name}.prom"), registry.to_prometheus())
+    if report_dir:
+        finished = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        payload = {**(report or {}), **registry.to_dict(), "time_breakdown_seconds": registry.time_breakdown()}
+        _write_atomically(os.path.join(report_dir, f"{name}_{finished}.json"), json.dumps(payload, indent=2))
+
+
+@contextmanager
+def stage_run(stage: str, shard: Optional[str] = None, registry: MetricsRegistry = METRICS) -> Iterator[MetricsRegistry]:
+    """Times a pipeline stage, records its peak RSS and exports the metrics when it
+    ends, also when it fails. Nothing is printed unless the export fails, the
+    sharded stages print their Airflow summary after the block."""
+    labels = {"stage": stage} if shard is None else {"stage": stage, "shard": shard}
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    success = False
+    try:
+        yield registry
+        success = True
+    finally:
+        duration = time.perf_counter() - start
+        registry.set("pipeline_stage_duration_seconds", duration, **labels)
+        registry.set("pipeline_stage_peak_rss_bytes", peak_rss_bytes(), **labels)
+        registry.set("pipeline_stage_last_run_timestamp_seconds", time.time(), **labels)
+        registry.set("pipeline_stage_success", int(success), **labels)
+        try:
+            export_metrics(stage, shard, {
+                **labels,
+                "started_at": started_at.isoformat(),
+                "duration_seconds": duration,
+                "peak_rss_bytes": peak_rss_bytes(),
+                "success": success
+            }, registry)
+        except OSError as e:
+            # Metrics must never fail the run they describe
+            print(f"Failed to export metrics for stage {stage}: {e}")
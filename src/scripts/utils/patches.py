@@ -0,0 +1,125 @@
+import re
+import hashlib
+from typing import Any, Iterator, List, Optional, Tuple
+
+HUNK_HEADER = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+NO_NEWLINE_MARKER = b"\\"  # "\ No newline at end of file" after the line it applies to
+
+# (old_start, old_count, new_start, new_count, [(tag, line)])
+Hunk = Tuple[int, int, int, int, List[Tuple[bytes, bytes]]]
+
+
+class PatchError(ValueError):
+    """Patch that cannot be reverse-applied, e.g. truncated or not made against this content."""
+
+
+def git_blob_hasher(size: int) -> Any:
+    # Fed the `size` bytes of a content, gives its git blob SHA
+    return hashlib.sha1(b"blob %d\x00" % size)
+
+
+def git_blob_sha(content: bytes) -> str:
+    # SHA git gives the content, as in the `sha` of the commit files
+    hasher = git_blob_hasher(len(content))
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+def split_lines(data: bytes) -> List[bytes]:
+    # Only "\n" ends a line, like in the patches, a "\r" stays part of its line
+    lines = [line + b"\n" for line in data.split(b"\n")]
+    lines[-1] = lines[-1][:-1]
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+
+def iter_hunks(patch: str) -> Iterator[Hunk]:
+    """Hunks of a unified diff as GitHub returns it in the `patch` of commit
+    files: no file headers, lines joined by "\n"."""
+    raw = patch.encode("utf-8").split(b"\n")
+    if raw and not raw[-1]:
+        raw.pop()
+    i = 0
+    while i < len(raw):
+        header = HUNK_HEADER.match(raw[i])
+        if header is None:
+            raise PatchError(f"expected a hunk header, got {raw[i][:80]!r}")
+        old_start, old_count, new_start, new_count = (
+            int(value) if value is not None else 1 for value in header.groups()
+        )
+        lines: List[Tuple[bytes, bytes]] = []
+        old_seen = new_seen = 0
+        i += 1
+        while i < len(raw):
+            line = raw[i]
+            if line.startswith(NO_NEWLINE_MARKER):
+                if not lines:
+                    raise PatchError("newline marker before any line")
+                tag, content = lines[-1]
+                lines[-1] = (tag, content[:-1])
+                i += 1
+                continue
+            if old_seen >= old_count and new_seen >= new_count:
+                break
+            # Some tools strip the space of empty context lines
+            tag, content = (line[:1], line[1:]) if line else (b" ", b"")
+            if tag not in (b" ", b"-", b"+"):
+                raise PatchError(f"unexpected line {line[:80]!r}")
+            lines.append((tag, content + b"\n"))
+            old_seen += tag != b"+"
+            new_seen += tag != b"-"
+            i += 1
+        if old_seen != old_count or new_seen != new_count:
+            raise PatchError(
+                f"hunk -{old_start},{old_count} +{new_start},{new_count} is truncated "
+                f"({old_seen} old and {new_seen} new lines)"
+            )
+        yield old_start, old_count, new_start, new_count, lines
+
+
+def reverse_patch(
+    after: bytes,
+    patch: str,
+    additions: Optional[int] = None,
+    deletions: Optional[int] = None
+) -> bytes:
+    """Content before the change, from the content after it and the patch
+    between both. Every context and added line is checked against `after`,
+    and the changed lines against the `additions` and `deletions` of the
+    commit file when given, which catches a patch cut between two hunks."""
+    after_lines = split_lines(after)
+    before: List[bytes] = []
+    position = 0  # Next line of `after` not copied yet
+    added = deleted = 0
+    for _, _, new_start, new_count, lines in iter_hunks(patch):
+        # An empty range starts after line new_start instead of at it
+        start = new_start - 1 if new_count else new_start
+        if start < position or start > len(after_lines):
+            raise PatchError(f"hunk at line {new_start} is out of order or past the end")
+        before.extend(after_lines[position:start])
+        position = start
+        for tag, line in lines:
+            if tag != b"-":
+                if position >= len(after_lines) or after_lines[position] != line:
+                    raise PatchError(f"line {position + 1} does not match the patch")
+                position += 1
+            if tag != b"+":
+                before.append(line)
+            added += tag == b"+"
+            deleted += tag == b"-"
+    if (additions is not None and added != additions) or (deletions is not None and deleted != deletions):
+        raise PatchError(f"patch has +{added} -{deleted} lines, the commit file +{additions} -{deletions}")
+    before.extend(after_lines[position:])
+    return b"".join(before)
+
+
+def reconstruct_before(
+    after: bytes,
+    patch: str,
+    additions: Optional[int] = None,
+    deletions: Optional[int] = None
+) -> Tuple[bytes, str]:
+    # Runs in the process pool: the content and its blob SHA are both CPU bound
+    before = reverse_patch(after, patch, additions, deletions)
+    return before, git_blob_sha(before)
@@ -0,0 +1,175 @@
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+from .landing_schema import payload_hash, repo_key, repo_key_columns, repo_key_sql
+from .metrics import METRICS
+
+PAYLOAD_INDEX_PATH: str = os.getenv(
+    "PAYLOAD_INDEX_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "repositories_extraction", "payload_index.sqlite")
+)
+
+# (repo, id, row, payload hash)
+HashedRow = Tuple[str, str, Dict[str, Any], str]
+
+
+class PayloadIndex:
+    """Hash of the latest payload landed for every (repository, id) of the
+    landing tables, ids like commit SHAs being shared by forks.
+
+    Kept in a local SQLite file like the blob index, so deciding whether a row
+    is new, changed or already landed never scans the table. A table is seeded
+    once from its `payload_hash` column the first time this index sees it, e.g.
+    on a fresh worker; rows landed before that column existed count as changed
+    the next time they are written.
+    """
+
+    def __init__(self, trino_client: Any, path: str = PAYLOAD_INDEX_PATH):
+        self.trino_client = trino_client
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # Indexes written before rows were keyed by repository are seeded again
+        self.conn.execute("DROP TABLE IF EXISTS payload_hashes")
+        self.conn.execute("DROP TABLE IF EXISTS seeded_tables")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS landed_payloads (
+                table_name TEXT,
+                repo TEXT,
+                id TEXT,
+                payload_hash TEXT,
+                PRIMARY KEY (table_name, repo, id)
+            )
+            """
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seeded_landing_tables (table_name TEXT PRIMARY KEY)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._seeded = {row[0] for row in self.conn.execute("SELECT table_name FROM seeded_landing_tables")}
+
+    def refresh(self, table_name: str) -> int:
+        # Latest copy of every id, an empty hash stands for a row landed without one
+        repo = repo_key_sql(repo_key_columns(table_name))
+        rows = self.trino_client.iter_rows(
+            f"""
+            SELECT {repo} AS repo, id, MAX_BY(payload_hash, ingestion_date) AS payload_hash
+            FROM {table_name}
+            WHERE id IS NOT NULL
+            GROUP BY {repo}, id
+            """
+        )
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO landed_payloads VALUES (?, ?, ?, ?)",
+                ((table_name, row["repo"], row["id"], row["payload_hash"] or "") for row in rows)
+            )
+            seeded = self.conn.total_changes - before
+            self.conn.execute("INSERT OR IGNORE INTO seeded_landing_tables VALUES (?)", (table_name,))
+            self.conn.commit()
+            self._seeded.add(table_name)
+        return seeded
+
+    def _known_hashes(self, table_name: str, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+        ids = list({row_id for _, row_id in keys})
+        known: Dict[Tuple[str, str], str] = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                for repo, row_id, row_hash in self.conn.execute(
+                    f"""
+                    SELECT repo, id, payload_hash FROM landed_payloads
+                    WHERE table_name = ? AND id IN ({", ".join("?" * len(chunk))})
+                    """,
+                    (table_name, *chunk)
+                ):
+                    known[(repo, row_id)] = row_hash
+        return known
+
+    def classify(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str
+    ) -> Tuple[List[HashedRow], List[HashedRow], int]:
+        """Splits rows into new keys, changed payloads and the number of
+        unchanged rows to skip. The last copy of a key repeated in `rows` wins."""
+        if table_name not in self._seeded:
+            self.refresh(table_name)
+        repo_columns = repo_key_columns(table_name)
+        latest: Dict[Tuple[str, str], Tuple[Dict[str, Any], str]] = {}
+        unkeyed: List[HashedRow] = []
+        total = 0
+        for row in rows:
+            total += 1
+            row_id = row.get(id_field)
+            if row_id is None:
+                # Nothing to compare a row without id with, it is landed as before
+                unkeyed.append(("", "", row, payload_hash(row)))
+            else:
+                latest[(repo_key(repo_columns, row), str(row_id))] = (row, payload_hash(row))
+
+        known = self._known_hashes(table_name, list(latest))
+        new, changed = unkeyed, []
+        for (repo, row_id), (row, row_hash) in latest.items():
+            if (repo, row_id) not in known:
+                new.append((repo, row_id, row, row_hash))
+            elif known[(repo, row_id)] != row_hash:
+                changed.append((repo, row_id, row, row_hash))
+        return new, changed, total - len(new) - len(changed)
+
+    def record(self, table_name: str, rows: List[HashedRow]) -> None:
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO landed_payloads VALUES (?, ?, ?, ?)",
+                ((table_name, repo, row_id, row_hash) for repo, row_id, _, row_hash in rows if row_id)
+            )
+            self.conn.commit()
+
+
+class IdempotentLandingWriter:
+    """Landing writer wrapper that lands every payload once: rows with a new
+    (repository, id) are inserted, rows whose payload changed replace the
+    landed ones (MERGE with Trino, a delete and an append in one commit with
+    the Iceberg writer) and unchanged rows are skipped. Has the
+    `insert_raw_payloads` of the writer it wraps, so the extractors and
+    `BufferedLandingWriter` use it unchanged.
+
+    Only the changed rows go through the MERGE, which joins the whole table:
+    new ids are plain appends that neither scan the table nor conflict with the
+    commits of the other shards.
+    """
+
+    def __init__(self, writer: Any, index: PayloadIndex):
+        self.writer = writer
+        self.index = index
+
+    def insert_raw_payloads(
+        self,
+        table_name: str,
+        rows: Iterable[Dict[str, Any]],
+        id_field: str,
+        **kwargs: Any
+    ) -> List[Dict[str, Any]]:
+        new, changed, skipped = self.index.classify(table_name, rows, id_field)
+        METRICS.inc("landing_skipped_rows_total", skipped, table=table_name)
+        results: List[Dict[str, Any]] = []
+        # The index only learns about rows once they are written, a failed write is tried again in full next time
+        if new:
+            results.extend(self.writer.insert_raw_payloads(
+                table_name, [row for _, _, row, _ in new], id_field,
+                payload_hashes=[row_hash for _, _, _, row_hash in new], **kwargs
+            ))
+            self.index.record(table_name, new)
+        if changed:
+            results.extend(self.writer.upsert_raw_payloads(
+                table_name, [row for _, _, row, _ in changed], id_field,
+                payload_hashes=[row_hash for _, _, _, row_hash in changed], **kwargs
+            ))
+            self.index.record(table_name, changed)
+            METRICS.inc("landing_upserted_rows_total", len(changed), table=table_name)
+        return results
@@ -0,0 +1,147 @@
+import time
+import asyncio
+import threading
+from typing import Dict, List, Mapping, Optional, Tuple
+from .metrics import METRICS
+
+# Secondary rate limits do not always send Retry-After, GitHub recommends waiting at least a minute
+DEFAULT_RETRY_AFTER_SECONDS: float = 60.0
+RATE_LIMIT_STATUSES = (403, 429)
+
+
+def resource_for_path(path: str) -> str:
+    if "/search/" in path:
+        return "search"
+    if path.rstrip("/").endswith("/graphql"):
+        return "graphql"
+    return "core"
+
+
+class TokenBudget:
+    def __init__(self, token: Optional[str], resource: str):
+        self.token = token
+        self.resource = resource
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None  # Unknown until the first response
+        self.reset_at: float = 0.0
+        self.parked_until: float = 0.0
+        self.next_request_at: float = 0.0
+
+    def available_at(self, now: float, reserve: int) -> float:
+        if self.remaining is not None and now >= self.reset_at > 0:
+            # The window rolled over since the last response
+            self.remaining = self.limit
+            self.reset_at = 0.0
+        ready_at = max(self.parked_until, self.next_request_at)
+        if self.remaining is not None and self.remaining <= reserve:
+            ready_at = max(ready_at, self.reset_at)
+        return ready_at
+
+
+class RateLimitScheduler:
+    """Hands out tokens per GitHub resource (core, search, graphql) based on the
+    X-RateLimit-* headers of previous responses.
+
+    The token with the most remaining budget is picked first. When a budget gets
+    below `pacing_threshold` of its limit, the remaining calls are spread evenly
+    until the reset time, and exhausted or rate limited tokens are parked until
+    they can be used again instead of failing the request.
+    """
+
+    def __init__(
+        self,
+        tokens: List[Optional[str]],
+        reserve: int = 0,
+        pacing_threshold: float = 0.1,
+        clock=time.time
+    ):
+        self.tokens = tokens or [None]
+        self.reserve = reserve
+        self.pacing_threshold = pacing_threshold
+        self.clock = clock
+        self._budgets: Dict[Tuple[Optional[str], str], TokenBudget] = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, token: Optional[str], resource: str) -> TokenBudget:
+        key = (token, resource)
+        if key not in self._budgets:
+            self._budgets[key] = TokenBudget(token, resource)
+        return self._budgets[key]
+
+    def reserve_token(self, resource: str) -> Tuple[Optional[str], float]:
+        # Returns a token to use now, or None and the number of seconds to wait
+        with self._lock:
+            now = self.clock()
+            budgets = [self._budget(token, resource) for token in self.tokens]
+            ready = [b for b in budgets if b.available_at(now, self.reserve) <= now]
+            if not ready:
+                return None, min(b.available_at(now, self.reserve) for b in budgets) - now
+
+            budget = max(ready, key=lambda b: float("inf") if b.remaining is None else b.remaining)
+            if budget.remaining is not None:
+                budget.remaining -= 1
+                if budget.limit and budget.remaining < budget.limit * self.pacing_threshold:
+                    window = max(budget.reset_at - now, 0.0)
+                    budget.next_request_at = now + window / max(budget.remaining - self.reserve, 1)
+            return budget.token, 0.0
+
+    def acquire(self, resource: str) -> Optional[str]:
+        while True:
+            token, delay = self.reserve_token(resource)
+            if delay <= 0:
+                return token
+            time.sleep(delay)
+
+    async def acquire_async(self, resource: str) -> Optional[str]:
+        while True:
+            token, delay = self.reserve_token(resource)
+            if delay <= 0:
+                return token
+            await asyncio.sleep(delay)
+
+    def update(
+        self,
+        token: Optional[str],
+        resource: str,
+        status: int,
+        headers: Mapping[str, str],
+        content: bytes = b""
+    ) -> bool:
+        # Records the budget reported by GitHub, returns True when the request should be retried
+        with self._lock:
+            now = self.clock()
+            budget = self._budget(token, resource)
+            if "X-RateLimit-Remaining" in headers:
+                budget.remaining = int(headers["X-RateLimit-Remaining"])
+                budget.limit = int(headers.get("X-RateLimit-Limit", budget.limit or budget.remaining))
+                budget.reset_at = float(headers.get("X-RateLimit-Reset", budget.reset_at))
+                # Tokens are identified by their position in the pool, never by value
+                token_index = self.tokens.index(token)
+                METRICS.set("github_rate_limit_remaining", budget.remaining, resource=resource, token=token_index)
+                METRICS.set("github_rate_limit_limit", budget.limit, resource=resource, token=token_index)
+
+            if status not in RATE_LIMIT_STATUSES:
+                return False
+
+            if "Retry-After" in headers:
+                budget.parked_until = now + float(headers["Retry-After"])
+            elif budget.remaining == 0:
+                budget.parked_until = budget.reset_at
+            elif status == 429 or b"rate limit" in content[:1024].lower():
+                budget.parked_until = now + DEFAULT_RETRY_AFTER_SECONDS
+            else:
+                return False  # A plain 403 (permissions, blocked repo) is not retryable
+            METRICS.inc("github_rate_limited_total", resource=resource)
+            return True
+
+    def snapshot(self) -> Dict[str, Dict[str, Optional[float]]]:
+        with self._lock:
+            return {
+                f"{resource}[{index}]": {
+                    "remaining": budget.remaining,
+                    "limit": budget.limit,
+                    "reset_at": budget.reset_at
+                }
+                for (token, resource), budget in self._budgets.items()
+                for index in [self.tokens.index(token)]
+            }
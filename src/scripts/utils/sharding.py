@@ -0,0 +1,62 @@
+import os
+import json
+import hashlib
+import argparse
+from typing import Any, Optional
+
+# Low 63 bits of the first 8 bytes of the MD5, so Python and Trino agree on the shard of a key
+_HASH_MASK = 0x7FFF_FFFF_FFFF_FFFF
+
+
+def stable_hash(key: Optional[str]) -> int:
+    digest = hashlib.md5((key or "").encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & _HASH_MASK
+
+
+class ShardSpec:
+    """Selects the share of the work one process handles: the keys (repo ids)
+    whose stable hash modulo `count` equals `index`. The default 0/1 owns
+    everything, so unsharded runs behave as before."""
+
+    def __init__(self, index: int = 0, count: int = 1):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value: str) -> "ShardSpec":
+        # "2/8" is the third of eight shards
+        index, _, count = value.partition("/")
+        return cls(int(index), int(count or 1))
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    @property
+    def sharded(self) -> bool:
+        return self.count > 1
+
+    def owns(self, key: Optional[str]) -> bool:
+        return not self.sharded or stable_hash(key) % self.count == self.index
+
+    def sql_predicate(self, expression: str) -> str:
+        # Same hash as stable_hash, evaluated by Trino so only this shard's rows are read
+        if not self.sharded:
+            return "TRUE"
+        hashed = f"bitwise_and(from_big_endian_64(substr(md5(to_utf8(COALESCE({expression}, ''))), 1, 8)), {_HASH_MASK})"
+        return f"{hashed} % {self.count} = {self.index}"
+
+
+def add_shard_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--shard",
+        type=ShardSpec.parse,
+        default=ShardSpec.parse(os.getenv("SHARD", "0/1")),
+        help="process only the repositories of shard INDEX/COUNT, e.g. 0/4 (default: everything)"
+    )
+
+
+def print_shard_summary(stage: str, shard: ShardSpec, **counts: Any) -> None:
+    # Must stay the last line of the output: Airflow pushes it to XCom for the merge task
+    print(json.dumps({"stage": stage, "shard": str(shard), **counts}))
@@ -0,0 +1,166 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from trino.dbapi import connect
+from .metrics import METRICS
+
+TRINO_POOL_SIZE: int = int(os.getenv("TRINO_POOL_SIZE", "8"))
+# Connections idle for longer than this are checked with SELECT 1 before being handed out
+TRINO_HEALTH_CHECK_SECONDS: float = float(os.getenv("TRINO_HEALTH_CHECK_SECONDS", "60"))
+
+
+class TrinoConnectionPool:
+    """Bounded pool of trino.dbapi connections.
+
+    A connection is checked out by one thread or task at a time through
+    `connection()`, so statements from different workers never share a
+    connection and run concurrently up to `size`. Idle connections are health
+    checked before reuse and replaced when the check fails. Time spent waiting
+    for a connection and query latency are recorded for `stats()`.
+    """
+
+    def __init__(
+        self,
+        connect_kwargs: Dict[str, Any],
+        size: int = TRINO_POOL_SIZE,
+        health_check_seconds: float = TRINO_HEALTH_CHECK_SECONDS,
+        connection_factory: Callable[..., Any] = connect
+    ):
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self.health_check_seconds = health_check_seconds
+        self.connection_factory = connection_factory
+        # LIFO keeps the most recently used connections warm and lets the others go idle
+        self._idle: "queue.LifoQueue[Tuple[Any, float]]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+            "queries": 0, "query_seconds": 0.0, "max_query_seconds": 0.0,
+            "created": 0, "replaced": 0
+        }
+
+    def _new_connection(self) -> Any:
+        with self._lock:
+            self._stats["created"] += 1
+        return self.connection_factory(**self.connect_kwargs)
+
+    def _healthy(self, conn: Any) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _fill_slot(self) -> Any:
+        # The slot is already counted in _created, it is given back when the connection cannot be opened
+        try:
+            return self._new_connection()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _acquire(self) -> Any:
+        with self._lock:
+            can_create = self._idle.empty() and self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            return self._fill_slot()
+
+        conn, released_at = self._idle.get()
+        if time.monotonic() - released_at >= self.health_check_seconds and not self._healthy(conn):
+            self._close(conn)
+            with self._lock:
+                self._stats["replaced"] += 1
+            conn = self._fill_slot()
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        start = time.perf_counter()
+        conn = self._acquire()
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        METRICS.observe("trino_pool_wait_seconds", waited)
+        try:
+            yield conn
+        finally:
+            self._idle.put((conn, time.monotonic()))
+
+    def record_query(self, seconds: float) -> None:
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["query_seconds"] += seconds
+            self._stats["max_query_seconds"] = max(self._stats["max_query_seconds"], seconds)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / max(stats["checkouts"], 1)
+        stats["avg_query_seconds"] = stats["query_seconds"] / max(stats["queries"], 1)
+        return stats
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (
+            f"trino pool: {int(stats['created'])} connections opened ({self.size} open at most), "
+            f"{int(stats['checkouts'])} checkouts, avg wait {stats['avg_wait_seconds'] * 1000:.1f} ms, "
+            f"max wait {stats['max_wait_seconds'] * 1000:.1f} ms, {int(stats['queries'])} queries, "
+            f"avg {stats['avg_query_seconds'] * 1000:.1f} ms, max {stats['max_query_seconds'] * 1000:.1f} ms"
+        )
+
+    @staticmethod
+    def _close(conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(conn)
+
+
+class AsyncTrinoClient:
+    """Runs TrinoClient calls on a thread pool sized like its connection pool, so
+    asyncio extractors can await queries and inserts while HTTP work goes on."""
+
+    def __init__(self, client: Any, max_workers: Optional[int] = None):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or client.pool.size)
+
+    async def run(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args, **kwargs))
+
+    async def read_sql(self, query: str, **kwargs: Any) -> Any:
+        return await self.run(self.client.read_sql, query, **kwargs)
+
+    async def read_arrow(self, query: str, **kwargs: Any) -> Any:
+        return await self.run(self.client.read_arrow, query, **kwargs)
+
+    async def execute_query(self, query: str) -> None:
+        await self.run(self.client.execute_query, query)
+
+    async def insert_raw_payloads(self, table_name: str, rows: Any, id_field: str, **kwargs: Any) -> Any:
+        return await self.run(self.client.insert_raw_payloads, table_name, list(rows), id_field, **kwargs)
+
+    def close(self) -> None:
+        self.executor.shutdown()
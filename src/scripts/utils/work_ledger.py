@@ -0,0 +1,273 @@
+import os
+import json
+import asyncio
+import time
+import random
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+WORK_LEDGER_PATH: str = os.getenv(
+    "WORK_LEDGER_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "repositories_extraction", "work_ledger.sqlite")
+)
+LEDGER_MAX_ATTEMPTS: int = int(os.getenv("LEDGER_MAX_ATTEMPTS", "5"))
+LEDGER_BACKOFF_SECONDS: float = float(os.getenv("LEDGER_BACKOFF_SECONDS", "30"))
+LEDGER_MAX_BACKOFF_SECONDS: float = float(os.getenv("LEDGER_MAX_BACKOFF_SECONDS", "600"))
+# Longest a run waits for backoffs to elapse before leaving the remaining retries to the next run
+LEDGER_MAX_RETRY_WAIT_SECONDS: float = float(os.getenv("LEDGER_MAX_RETRY_WAIT_SECONDS", "900"))
+# State changes are written to SQLite in batches of this many items
+LEDGER_CHECKPOINT_ITEMS: int = int(os.getenv("LEDGER_CHECKPOINT_ITEMS", "500"))
+
+PENDING = "pending"
+DONE = "done"
+RETRYABLE = "retryable"
+FAILED = "failed"
+
+
+# Answers that will not change by asking again: missing or empty repositories, commits or files
+NON_RETRYABLE_STATUSES = (404, 409, 410, 422, 451)
+
+
+def is_retryable(error: Any) -> bool:
+    # `error` is an HTTP status or an exception, those raised by GitHubResponse.raise_for_status carry the response
+    status = error if isinstance(error, int) else getattr(getattr(error, "response", None), "status", None)
+    return status not in NON_RETRYABLE_STATUSES
+
+
+def backoff_delay(attempts: int, base: float, cap: float) -> float:
+    # Exponential backoff with equal jitter: at least half of the delay, so retries never come back at once
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class WorkLedger:
+    """Durable state of the work items (commits, blobs...) of one stage run.
+
+    Items are keyed within a run, e.g. the ingestion date and shard, so a
+    restarted or retried run skips what is already done or failed for good
+    and only redoes unfinished items. Failed items are retried with
+    exponential backoff and jitter until `max_attempts`, then marked failed.
+
+    State changes are buffered and checkpointed to SQLite every
+    `checkpoint_items` changes (and by `flush()`), a crash only loses the last
+    batch of marks and those items are done again.
+    """
+
+    def __init__(
+        self,
+        stage: str,
+        run_key: str,
+        path: str = WORK_LEDGER_PATH,
+        max_attempts: int = LEDGER_MAX_ATTEMPTS,
+        backoff_seconds: float = LEDGER_BACKOFF_SECONDS,
+        max_backoff_seconds: float = LEDGER_MAX_BACKOFF_SECONDS,
+        checkpoint_items: int = LEDGER_CHECKPOINT_ITEMS
+    ):
+        self.stage = stage
+        self.run_key = run_key
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.checkpoint_items = checkpoint_items
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS work_items (
+                stage TEXT,
+                run_key TEXT,
+                item_key TEXT,
+                state TEXT,
+                attempts INTEGER,
+                next_attempt_at REAL,
+                last_error TEXT,
+                payload TEXT,
+                updated_at REAL,
+                PRIMARY KEY (stage, run_key, item_key)
+            )
+            """
+        )
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._changes: Dict[str, Tuple[str, Optional[str], Optional[Dict[str, Any]]]] = {}
+        # Attempts of the items seen in this process, read once from SQLite
+        self._attempts: Dict[str, int] = {}
+
+    def finished_keys(self, states: Tuple[str, ...] = (DONE, FAILED)) -> Set[str]:
+        # Items a restarted run must not fetch again
+        with self._lock:
+            rows = self.conn.execute(
+                f"""
+                SELECT item_key FROM work_items
+                WHERE stage = ? AND run_key = ? AND state IN ({", ".join("?" * len(states))})
+                """,
+                (self.stage, self.run_key, *states)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def pending(
+        self,
+        items: Iterable[Dict[str, Any]],
+        item_key: Callable[[Dict[str, Any]], str]
+    ) -> Iterator[Dict[str, Any]]:
+        # Leaves out finished items, unfinished and retryable ones from an earlier attempt are done again
+        finished = self.finished_keys()
+        for item in items:
+            if item_key(item) not in finished:
+                yield item
+
+    def _change(self, item_key: str, state: str, error: Optional[str], payload: Optional[Dict[str, Any]]) -> None:
+        with self._lock:
+            previous = self._changes.get(item_key)
+            if previous is not None and payload is None:
+                payload = previous[2]
+            self._changes[item_key] = (state, error, payload)
+            due = len(self._changes) >= self.checkpoint_items
+        if due:
+            self.flush()
+
+    def start(self, item_key: str, payload: Optional[Dict[str, Any]] = None) -> None:
+        # Registers the item as pending, with what is needed to retry it
+        self._change(item_key, PENDING, None, payload)
+
+    def done(self, item_key: str) -> None:
+        self._change(item_key, DONE, None, None)
+
+    def fail(self, item_key: str, error: Any, retryable: bool = True, payload: Optional[Dict[str, Any]] = None) -> None:
+        self._change(item_key, RETRYABLE if retryable else FAILED, str(error)[:1000], payload)
+
+    def _load_attempts(self, keys: List[str]) -> None:
+        missing = [key for key in keys if key not in self._attempts]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self.conn.execute(
+                f"""
+                SELECT item_key, attempts FROM work_items
+                WHERE stage = ? AND run_key = ? AND item_key IN ({", ".join("?" * len(chunk))})
+                """,
+                (self.stage, self.run_key, *chunk)
+            ).fetchall()
+            found = dict(rows)
+            for key in chunk:
+                self._attempts[key] = found.get(key, 0)
+
+    def flush(self) -> None:
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            if not changes:
+                return
+            self._load_attempts([key for key, (state, _, _) in changes.items() if state in (RETRYABLE, FAILED)])
+            now = time.time()
+            rows = []
+            for item_key, (state, error, payload) in changes.items():
+                next_attempt_at = None
+                attempts = self._attempts.get(item_key, 0)
+                if state in (RETRYABLE, FAILED):
+                    attempts += 1
+                    self._attempts[item_key] = attempts
+                    if state == RETRYABLE and attempts >= self.max_attempts:
+                        state = FAILED
+                    if state == RETRYABLE:
+                        next_attempt_at = now + backoff_delay(attempts, self.backoff_seconds, self.max_backoff_seconds)
+                rows.append((
+                    self.stage, self.run_key, item_key, state, attempts, next_attempt_at, error,
+                    None if payload is None else json.dumps(payload), now
+                ))
+            # A payload that is not given again is kept, so retries still know what to fetch
+            self.conn.executemany(
+                """
+                INSERT INTO work_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (stage, run_key, item_key) DO UPDATE SET
+                    state = excluded.state,
+                    attempts = MAX(excluded.attempts, work_items.attempts),
+                    next_attempt_at = excluded.next_attempt_at,
+                    last_error = excluded.last_error,
+                    payload = COALESCE(excluded.payload, work_items.payload),
+                    updated_at = excluded.updated_at
+                """,
+                rows
+            )
+            self.conn.commit()
+
+    def next_retries(self) -> Tuple[Optional[float], List[Tuple[str, Dict[str, Any]]]]:
+        # (None, []) once nothing is left to retry, else the seconds until the next item is due and the due items
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT item_key, payload, next_attempt_at FROM work_items
+                WHERE stage = ? AND run_key = ? AND state = ?
+                ORDER BY next_attempt_at
+                """,
+                (self.stage, self.run_key, RETRYABLE)
+            ).fetchall()
+        if not rows:
+            return None, []
+        now = time.time()
+        due = [(key, json.loads(payload) if payload else {}) for key, payload, due_at in rows if due_at <= now]
+        return (0.0 if due else rows[0][2] - now), due
+
+    def _give_up(self, waited: float, delay: float, max_wait_seconds: float) -> bool:
+        if waited + delay <= max_wait_seconds:
+            return False
+        print(f"{self.stage}: retries left for a later run, see {self.report()}")
+        return True
+
+    def retry_batches(
+        self,
+        max_wait_seconds: float = LEDGER_MAX_RETRY_WAIT_SECONDS
+    ) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+        """Yields the retryable items as (key, payload) pairs once their backoff
+        elapsed, until none is left or the next one would make the run wait
+        longer than `max_wait_seconds` in total. Each item must be marked done or
+        failed again before the next batch is asked for."""
+        waited = 0.0
+        while True:
+            delay, due = self.next_retries()
+            if delay is None or self._give_up(waited, delay, max_wait_seconds):
+                return
+            if delay:
+                time.sleep(delay)
+                waited += delay
+            else:
+                yield due
+
+    async def aretry_batches(
+        self,
+        max_wait_seconds: float = LEDGER_MAX_RETRY_WAIT_SECONDS
+    ) -> AsyncIterator[List[Tuple[str, Dict[str, Any]]]]:
+        # retry_batches for asyncio callers, the backoff waits do not block the event loop
+        waited = 0.0
+        while True:
+            delay, due = self.next_retries()
+            if delay is None or self._give_up(waited, delay, max_wait_seconds):
+                return
+            if delay:
+                await asyncio.sleep(delay)
+                waited += delay
+            else:
+                yield due
+
+    def counts(self) -> Dict[str, int]:
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT state, COUNT(*) FROM work_items WHERE stage = ? AND run_key = ? GROUP BY state",
+                (self.stage, self.run_key)
+            ).fetchall()
+        return dict(rows)
+
+    def report(self) -> str:
+        counts = self.counts()
+        return f"{self.stage} ledger ({self.run_key}): " + ", ".join(
+            f"{counts.get(state, 0)} {state}" for state in (DONE, PENDING, RETRYABLE, FAILED)
+        )
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,58 @@
+import io
+import tarfile
+
+import pytest
+
+from utils.archive import BlobMismatchError, VerifiedBlobReader, iter_archive_files
+from utils.patches import git_blob_sha
+
+
+def make_tarball(files) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for path, content in files.items():
+            info = tarfile.TarInfo(f"owner-repo-abc1234/{path}")
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+        link = tarfile.TarInfo("owner-repo-abc1234/link")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "src/a.py"
+        archive.addfile(link)
+    buffer.seek(0)
+    return buffer
+
+
+def test_only_the_wanted_paths_are_yielded():
+    files = {"src/a.py": b"a = 1\n", "src/b.py": b"b = 2\n", "README.md": b"# readme\n"}
+    found = {
+        path: (content.read(), size)
+        for path, content, size in iter_archive_files(make_tarball(files), {"src/b.py", "link", "missing"})
+    }
+
+    assert found == {"src/b.py": (b"b = 2\n", 6), "link": (b"src/a.py", 8)}
+
+
+def test_verified_reader_passes_the_blob_through():
+    content = b"x" * 1000
+    reader = VerifiedBlobReader(io.BytesIO(content), git_blob_sha(content), len(content))
+
+    assert b"".join(iter(lambda: reader.read(64), b"")) == content
+    assert reader.bytes_read == 1000
+
+
+def test_verified_reader_raises_on_the_last_read():
+    content = b"$Format:%H$\n"
+    reader = VerifiedBlobReader(io.BytesIO(b"0123456789ab"), git_blob_sha(content), len(content))
+
+    assert reader.read(8) == b"01234567"
+    with pytest.raises(BlobMismatchError):
+        reader.read(8)
+
+
+def test_verified_reader_raises_on_short_content():
+    content = b"full content\n"
+    reader = VerifiedBlobReader(io.BytesIO(content[:5]), git_blob_sha(content), len(content))
+
+    reader.read(5)
+    with pytest.raises(BlobMismatchError):
+        reader.read(5)
@@ -0,0 +1,66 @@
+import pyarrow as pa
+
+from benchmarks.stand_ins import InMemoryMinioClient
+from extract_blob_files import FetchPlan
+from utils.blob_shards import BlobShardReader, PackedBlobStore, iter_manifests
+from utils.patches import git_blob_sha
+
+
+def packed_store(tmp_path, minio=None):
+    minio = minio or InMemoryMinioClient()
+    return PackedBlobStore(minio, "repositories", index_path=str(tmp_path / "blob_index.sqlite"))
+
+
+def manifest_files(store):
+    manifest = pa.concat_tables(iter_manifests(store.minio_client, store.bucket_name))
+    return sorted(zip(manifest.column("commit_sha").to_pylist(), manifest.column("file_path").to_pylist()))
+
+
+def test_blobs_are_stored_once_their_shard_is_flushed(tmp_path):
+    store = packed_store(tmp_path)
+    content = b"print('hello')\n"
+    blob_sha = git_blob_sha(content)
+    store.put(blob_sha, content)
+
+    assert not store.has(blob_sha)
+    assert store.accepted(blob_sha)
+
+    store.link([("owner/repo", "c1", "a.py", blob_sha)])
+    store.flush()
+
+    assert store.has(blob_sha)
+    assert store.get(blob_sha) == content
+    reader = BlobShardReader(store.minio_client, store.bucket_name)
+    assert reader.load_manifests() == 1
+    assert reader.read(blob_sha) == content
+
+
+def test_fresh_index_is_seeded_from_the_manifests(tmp_path):
+    store = packed_store(tmp_path)
+    blob_sha = git_blob_sha(b"a\n")
+    store.put(blob_sha, b"a\n")
+    store.link([("owner/repo", "c1", "a.txt", blob_sha)])
+    store.close()
+
+    reopened = PackedBlobStore(store.minio_client, "repositories", index_path=str(tmp_path / "other.sqlite"))
+    assert reopened.has(blob_sha)
+    assert reopened.get(blob_sha) == b"a\n"
+
+
+def test_files_of_a_blob_queued_by_an_earlier_commit_reach_the_manifest(tmp_path):
+    store = packed_store(tmp_path)
+    content = b"same content\n"
+    blob_sha = git_blob_sha(content)
+    rows = [
+        {"repo_id": "owner/repo", "commit_sha": "c1", "file_path": "a.txt", "blob_sha": blob_sha},
+        {"repo_id": "owner/repo", "commit_sha": "c2", "file_path": "a.txt", "blob_sha": blob_sha},
+    ]
+    plan = FetchPlan(store, min_files=0)
+    # Fetched like stream_blob does: stored, then linked to the files of its item
+    for _, (item_sha, files) in plan.iter_items(rows):
+        store.put(item_sha, content)
+        store.link((f["repo_id"], f["commit_sha"], f["file_path"], item_sha) for f in files)
+    plan.link_duplicates()
+    store.close()
+
+    assert manifest_files(store) == [("c1", "a.txt"), ("c2", "a.txt")]
@@ -0,0 +1,33 @@
+from utils.buffered_writer import BufferedLandingWriter
+
+
+class ResultWriter:
+    # Returns one result per commit like the landing writers, with or without the files it made
+    def __init__(self, results):
+        self.results = results
+        self.rows = []
+
+    def insert_raw_payloads(self, table_name, rows, id_field):
+        self.rows.extend(rows)
+        return self.results
+
+
+def test_flush_counts_the_commits_and_files_written():
+    writer = ResultWriter([{"rows": 2, "files": 1}, {"rows": 1, "files": 2}])
+    with BufferedLandingWriter(writer, "iceberg.landing.commit_files", "id", max_seconds=60) as buffered:
+        buffered.add([{"id": "a"}, {"id": "b"}, {"id": "c"}])
+
+    assert len(writer.rows) == 3
+    assert buffered.stats["flushes"] == 1
+    assert buffered.stats["commits"] == 2
+    assert buffered.stats["files"] == 3
+    assert "2 commits, 3 data files" in buffered.report()
+
+
+def test_statements_without_file_count_are_reported_as_a_lower_bound():
+    writer = ResultWriter([{"rows": 1000}, {"rows": 1000}, {"rows": 500}])
+    with BufferedLandingWriter(writer, "iceberg.landing.commit_files", "id", max_seconds=60) as buffered:
+        buffered.add([{"id": str(i)} for i in range(2500)])
+
+    assert buffered.stats["commits"] == 3
+    assert "at least 3 data files" in buffered.report()
@@ -0,0 +1,132 @@
+import re
+
+import requests
+
+from benchmarks.stand_ins import InMemoryMinioClient
+from extract_commits_from_github import extract_with_graphql
+from utils.github_graphql import GraphQLCommitFetcher, RepoHistoryState
+from utils.watermarks import WatermarkStore
+
+REPOSITORY = re.compile(r'(r\d+): repository\(owner: "([^"]+)", name: "([^"]+)"\) \{.*?history\(([^)]*)\)', re.S)
+
+
+def commit_node(repo, n):
+    return {
+        "oid": f"{repo}-{n}",
+        "url": None,
+        "message": "m",
+        "additions": 1,
+        "deletions": 0,
+        "changedFilesIfAvailable": 1,
+        "author": {"name": "a", "email": "a@x", "date": "2024-01-01T00:00:00Z", "user": None},
+        "committer": {"name": "a", "email": "a@x", "date": f"2024-01-{n + 1:02d}T00:00:00Z", "user": None},
+        "parents": {"nodes": []}
+    }
+
+
+class FakeGraphQL:
+    """Serves `pages` pages of `per_page` commits per repository, newest first.
+    Repositories in `failing` error from their second page on."""
+
+    def __init__(self, pages=2, failing=(), cost_per_repo=1):
+        self.pages = pages
+        self.failing = set(failing)
+        self.cost_per_repo = cost_per_repo
+        self.batch_sizes = []
+
+    def graphql(self, query):
+        matches = REPOSITORY.findall(query)
+        self.batch_sizes.append(len(matches))
+        data = {"rateLimit": {"cost": self.cost_per_repo * len(matches)}}
+        for alias, owner, name, arguments in matches:
+            repo = f"{owner}/{name}"
+            page = int(re.search(r'after: "(\d+)"', arguments).group(1)) if "after" in arguments else 0
+            if page and repo in self.failing:
+                raise requests.HTTPError("502 Bad Gateway")
+            first = int(re.search(r"first: (\d+)", arguments).group(1))
+            nodes = [commit_node(repo, self.pages * first - page * first - i) for i in range(first)]
+            data[alias] = {"defaultBranchRef": {"target": {"history": {
+                "pageInfo": {"hasNextPage": page + 1 < self.pages, "endCursor": str(page + 1)},
+                "nodes": nodes
+            }}}}
+        return {"data": data}
+
+
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def insert_raw_payloads(self, table_name, rows, id_field):
+        self.rows.extend(rows)
+
+
+def states(count):
+    return [RepoHistoryState(f"owner/repo{i}") for i in range(count)]
+
+
+def test_queries_start_at_the_maximum_batch():
+    github = FakeGraphQL(pages=1)
+    fetcher = GraphQLCommitFetcher(github, per_page=2)
+    list(fetcher.iter_batches(states(120)))
+
+    assert github.batch_sizes == [50, 50, 20]
+    assert fetcher.pages == 120
+
+
+def test_batch_shrinks_when_a_query_costs_more_than_the_target():
+    github = FakeGraphQL(pages=1, cost_per_repo=4)
+    fetcher = GraphQLCommitFetcher(github, per_page=2)
+    list(fetcher.iter_batches(states(100)))
+
+    assert github.batch_sizes[:3] == [50, 25, 25]
+
+
+def test_failed_batch_is_halved_and_retried():
+    github = FakeGraphQL(pages=2, failing={"owner/repo0"})
+    fetcher = GraphQLCommitFetcher(github, per_page=2)
+    results = [result for batch in fetcher.iter_batches(states(4)) for result in batch]
+
+    assert github.batch_sizes == [4, 4, 2, 1, 1, 2]
+    assert ("owner/repo0", [], False) in results
+    assert sum(len(commits) for _, commits, _ in results) == 4 * 4 - 2
+
+
+def test_watermark_is_not_advanced_when_a_later_page_fails():
+    minio = InMemoryMinioClient()
+    watermarks = WatermarkStore(minio)
+    for repo in ("owner/ok", "owner/broken"):
+        watermarks.advance(repo, "old-sha", "2023-12-31T00:00:00Z")
+    github = FakeGraphQL(pages=3, failing={"owner/broken"})
+    writer = ListWriter()
+
+    extract_with_graphql(github, writer, watermarks, ["owner/ok", "owner/broken"])
+
+    assert watermarks.get("owner/ok")["sha"] == "owner/ok-300"
+    # Its first page was landed, but the older commits were not: the next run starts from the old mark again
+    assert any(row["sha"].startswith("owner/broken") for row in writer.rows)
+    assert watermarks.get("owner/broken")["sha"] == "old-sha"
+
+
+class FailingWriter:
+    def insert_raw_payloads(self, table_name, rows, id_field):
+        raise RuntimeError("insert failed")
+
+
+def test_watermark_is_not_advanced_when_the_insert_fails():
+    watermarks = WatermarkStore(InMemoryMinioClient())
+    watermarks.advance("owner/repo", "old-sha", "2023-12-31T00:00:00Z")
+
+    extract_with_graphql(FakeGraphQL(pages=1), FailingWriter(), watermarks, ["owner/repo"])
+
+    assert watermarks.get("owner/repo")["sha"] == "old-sha"
+
+
+def test_next_run_stops_at_the_watermark():
+    watermarks = WatermarkStore(InMemoryMinioClient())
+    watermarks.advance("owner/repo", "owner/repo-97", "2024-01-01T00:00:00Z")
+    writer = ListWriter()
+
+    extract_with_graphql(FakeGraphQL(pages=1), writer, watermarks, ["owner/repo"])
+
+    assert [row["sha"] for row in writer.rows] == ["owner/repo-100", "owner/repo-99", "owner/repo-98"]
+    assert watermarks.get("owner/repo")["sha"] == "owner/repo-100"
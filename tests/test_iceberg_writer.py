@@ -0,0 +1,61 @@
+import pytest
+
+from utils.iceberg_writer import IcebergWriter
+from utils.landing_schema import landing_arrow_schema
+
+pytest.importorskip("sqlalchemy")
+from pyiceberg.catalog.sql import SqlCatalog  # noqa: E402
+
+TABLE = "iceberg.landing.commits"
+
+
+@pytest.fixture
+def writer(tmp_path):
+    catalog = SqlCatalog("iceberg", uri=f"sqlite:///{tmp_path}/catalog.db", warehouse=f"file://{tmp_path}/warehouse")
+    catalog.create_namespace("landing")
+    catalog.create_table("landing.commits", schema=landing_arrow_schema(TABLE))
+    return IcebergWriter(catalog=catalog)
+
+
+def landed(writer):
+    table = writer.catalog.load_table("landing.commits").scan().to_arrow()
+    return sorted(zip(table.column("owner").to_pylist(), table.column("id").to_pylist(), table.column("message").to_pylist()))
+
+
+def commit(owner, sha, message):
+    return {"sha": sha, "owner": owner, "repo": "repo", "commit": {"message": message}}
+
+
+def test_rows_are_appended_with_their_projected_columns(writer):
+    results = writer.insert_raw_payloads(TABLE, [commit("owner", "a", "first"), commit("owner", "b", "second")], "sha")
+
+    assert sum(result["rows"] for result in results) == 2
+    assert landed(writer) == [("owner", "a", "first"), ("owner", "b", "second")]
+
+
+def test_upsert_replaces_the_row_of_the_same_repository_only(writer):
+    writer.insert_raw_payloads(TABLE, [commit("owner", "a", "first"), commit("fork", "a", "first")], "sha")
+    writer.upsert_raw_payloads(TABLE, [commit("fork", "a", "rebased")], "sha")
+
+    assert landed(writer) == [("fork", "a", "rebased"), ("owner", "a", "first")]
+
+
+def test_result_counts_the_data_files_of_the_commit(writer):
+    results = writer.insert_raw_payloads(TABLE, [commit("owner", str(sha), "message") for sha in range(100)], "sha")
+
+    assert [result["files"] for result in results] == [1]
+
+
+def test_batches_are_streamed_into_one_catalog_commit(writer):
+    writer.batch_rows = 10
+    writer.target_file_size_bytes = 1  # Every batch is appended on its own
+    table = writer.catalog.load_table("landing.commits")
+
+    logged = len(table.metadata.metadata_log)
+    results = writer.insert_raw_payloads(TABLE, [commit("owner", str(sha), "message") for sha in range(35)], "sha")
+
+    assert [result["rows"] for result in results] == [35]
+    assert results[0]["files"] >= 4
+    # One new metadata file for the four appends, each of them a snapshot of its own
+    assert len(table.refresh().metadata.metadata_log) == logged + 1
+    assert len(table.snapshots()) == 4
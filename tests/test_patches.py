@@ -0,0 +1,79 @@
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from utils.patches import PatchError, git_blob_sha, reconstruct_before, reverse_patch
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+
+def git_patch(tmp_path, before: bytes, after: bytes) -> str:
+    # The patch as GitHub returns it in the commit files: the hunks, without the file headers
+    (tmp_path / "before").write_bytes(before)
+    (tmp_path / "after").write_bytes(after)
+    diff = subprocess.run(
+        ["git", "diff", "--no-index", "--no-color", "before", "after"],
+        cwd=tmp_path, capture_output=True, check=False
+    ).stdout.decode("utf-8")
+    return diff[diff.index("@@"):]
+
+
+def edit(lines, rng):
+    lines = list(lines)
+    for _ in range(rng.randint(1, 6)):
+        position = rng.randint(0, len(lines))
+        action = rng.choice(["insert", "delete", "replace"])
+        if action == "insert" or not lines:
+            lines[position:position] = [f"new line {rng.random()}\n" for _ in range(rng.randint(1, 3))]
+        elif action == "delete":
+            del lines[min(position, len(lines) - 1)]
+        else:
+            lines[min(position, len(lines) - 1)] = f"changed {rng.random()}\n"
+    return lines
+
+
+def test_reverse_patch_restores_the_before_state(tmp_path):
+    rng = random.Random(42)
+    for _ in range(30):
+        before_lines = [f"line {i}\n" for i in range(rng.randint(1, 80))]
+        after_lines = edit(before_lines, rng)
+        before = "".join(before_lines).encode()
+        # Files without a final newline get the "\ No newline at end of file" marker
+        after = "".join(after_lines).rstrip("\n").encode() if rng.random() < 0.3 else "".join(after_lines).encode()
+        if before == after:
+            continue
+        patch = git_patch(tmp_path, before, after)
+
+        assert reverse_patch(after, patch) == before
+        assert reconstruct_before(after, patch) == (before, git_blob_sha(before))
+
+
+def test_git_blob_sha_matches_git(tmp_path):
+    (tmp_path / "file").write_bytes(b"hello\r\nworld")
+    expected = subprocess.run(
+        ["git", "hash-object", "file"], cwd=tmp_path, capture_output=True, check=True
+    ).stdout.decode().strip()
+
+    assert git_blob_sha(b"hello\r\nworld") == expected
+
+
+def test_patch_against_other_content_is_rejected(tmp_path):
+    before = "".join(f"line {i}\n" for i in range(20)).encode()
+    after = before.replace(b"line 10\n", b"line ten\n")
+    patch = git_patch(tmp_path, before, after)
+
+    with pytest.raises(PatchError):
+        reverse_patch(after.replace(b"line 9\n", b"line nine\n"), patch)
+
+
+def test_patch_cut_between_hunks_is_rejected(tmp_path):
+    before = "".join(f"line {i}\n" for i in range(60)).encode()
+    after = before.replace(b"line 5\n", b"line five\n").replace(b"line 50\n", b"line fifty\n")
+    patch = git_patch(tmp_path, before, after)
+    first_hunk = patch[:patch.index("\n@@") + 1]
+
+    assert reverse_patch(after, first_hunk) != before
+    with pytest.raises(PatchError):
+        reverse_patch(after, first_hunk, additions=2, deletions=2)
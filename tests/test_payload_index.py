@@ -0,0 +1,105 @@
+from utils.landing_schema import payload_hash
+from utils.payload_index import IdempotentLandingWriter, PayloadIndex
+
+TABLE = "iceberg.landing.commits"
+
+
+class SeedTrino:
+    """Trino client answering the seed query of the index with `landed` rows."""
+
+    def __init__(self, landed=()):
+        self.landed = list(landed)
+        self.queries = []
+
+    def iter_rows(self, query):
+        self.queries.append(query)
+        return iter(self.landed)
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.calls = []
+
+    def insert_raw_payloads(self, table_name, rows, id_field, payload_hashes=None):
+        self.calls.append(("insert", [row[id_field] for row in rows]))
+        return []
+
+    def upsert_raw_payloads(self, table_name, rows, id_field, payload_hashes=None):
+        self.calls.append(("upsert", [row[id_field] for row in rows]))
+        return []
+
+
+def commit(sha, message="m"):
+    return {"sha": sha, "owner": "owner", "repo": "repo", "commit": {"message": message}}
+
+
+def landing_writer(tmp_path, trino=None):
+    writer = RecordingWriter()
+    index = PayloadIndex(trino or SeedTrino(), str(tmp_path / "payload_index.sqlite"))
+    return IdempotentLandingWriter(writer, index), writer
+
+
+def test_new_ids_are_inserted_and_changed_ones_merged(tmp_path):
+    landing, writer = landing_writer(tmp_path)
+    landing.insert_raw_payloads(TABLE, [commit("a"), commit("b")], "sha")
+    landing.insert_raw_payloads(TABLE, [commit("a"), commit("b", "amended"), commit("c")], "sha")
+
+    assert writer.calls == [("insert", ["a", "b"]), ("insert", ["c"]), ("upsert", ["b"])]
+
+
+def test_unchanged_rows_are_skipped(tmp_path):
+    landing, writer = landing_writer(tmp_path)
+    landing.insert_raw_payloads(TABLE, [commit("a")], "sha")
+    # The ingestion date is stamped by the extractors and is not part of the payload
+    landing.insert_raw_payloads(TABLE, [dict(commit("a"), ingestion_date="2024-02-01")], "sha")
+
+    assert writer.calls == [("insert", ["a"])]
+
+
+def test_index_is_seeded_once_per_table(tmp_path):
+    landed = commit("a")
+    trino = SeedTrino([{"repo": "owner/repo", "id": "a", "payload_hash": payload_hash(landed)}])
+    landing, writer = landing_writer(tmp_path, trino)
+
+    landing.insert_raw_payloads(TABLE, [landed, commit("b")], "sha")
+    landing.insert_raw_payloads(TABLE, [commit("c")], "sha")
+
+    assert len(trino.queries) == 1
+    assert writer.calls == [("insert", ["b"]), ("insert", ["c"])]
+
+
+def test_failed_write_is_not_recorded(tmp_path):
+    landing, writer = landing_writer(tmp_path)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("Trino is down")
+
+    writer.insert_raw_payloads = fail
+    try:
+        landing.insert_raw_payloads(TABLE, [commit("a")], "sha")
+    except RuntimeError:
+        pass
+    new, changed, skipped = landing.index.classify(TABLE, [commit("a")], "sha")
+
+    assert [row_id for _, row_id, _, _ in new] == ["a"]
+
+
+def test_forks_sharing_a_sha_are_kept_apart(tmp_path):
+    landing, writer = landing_writer(tmp_path)
+    fork = dict(commit("a"), owner="fork")
+    landing.insert_raw_payloads(TABLE, [commit("a")], "sha")
+    landing.insert_raw_payloads(TABLE, [fork, commit("a")], "sha")
+    landing.insert_raw_payloads(TABLE, [dict(fork, commit={"message": "rebased"})], "sha")
+
+    assert writer.calls == [("insert", ["a"]), ("insert", ["a"]), ("upsert", ["a"])]
+
+
+def test_index_is_seeded_per_repository(tmp_path):
+    landed = commit("a")
+    trino = SeedTrino([{"repo": "owner/repo", "id": "a", "payload_hash": payload_hash(landed)}])
+    landing, writer = landing_writer(tmp_path, trino)
+
+    landing.insert_raw_payloads(TABLE, [landed, dict(landed, owner="fork")], "sha")
+
+    assert "COALESCE(owner, '') || '/' || COALESCE(repo, '')" in trino.queries[0]
+    assert writer.calls == [("insert", ["a"])]
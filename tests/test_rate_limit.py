@@ -0,0 +1,84 @@
+from utils.rate_limit import RateLimitScheduler
+
+
+class FakeClock:
+    def __init__(self, now: float = 1_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def headers(remaining: int, limit: int = 5000, reset: float = 4_600.0):
+    return {
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Limit": str(limit),
+        "X-RateLimit-Reset": str(reset)
+    }
+
+
+def test_token_with_the_most_remaining_budget_is_picked():
+    scheduler = RateLimitScheduler(["a", "b"], clock=FakeClock())
+    scheduler.update("a", "core", 200, headers(100))
+    scheduler.update("b", "core", 200, headers(4000))
+
+    assert scheduler.reserve_token("core") == ("b", 0.0)
+
+
+def test_calls_are_spread_until_the_reset_below_the_threshold():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(["a"], pacing_threshold=0.1, clock=clock)
+    # 11 calls left for the 3600 seconds until the reset, below 10% of the limit
+    scheduler.update("a", "core", 200, headers(11, limit=1000, reset=clock.now + 3600))
+
+    assert scheduler.reserve_token("core") == ("a", 0.0)
+    token, delay = scheduler.reserve_token("core")
+    assert token is None
+    assert delay == 360.0
+
+
+def test_no_pacing_above_the_threshold():
+    scheduler = RateLimitScheduler(["a"], clock=FakeClock())
+    scheduler.update("a", "core", 200, headers(4000))
+
+    for _ in range(10):
+        assert scheduler.reserve_token("core") == ("a", 0.0)
+
+
+def test_exhausted_token_is_parked_until_the_reset():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(["a", "b"], clock=clock)
+    scheduler.update("b", "core", 200, headers(10))
+
+    assert scheduler.update("a", "core", 403, headers(0, reset=clock.now + 600), b"API rate limit exceeded")
+    assert scheduler.reserve_token("core") == ("b", 0.0)
+
+    scheduler.update("b", "core", 200, headers(0, reset=clock.now + 900))
+    assert scheduler.reserve_token("core") == (None, 600.0)
+
+    clock.now += 600
+    assert scheduler.reserve_token("core") == ("a", 0.0)
+
+
+def test_retry_after_parks_the_token():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(["a"], clock=clock)
+
+    assert scheduler.update("a", "core", 429, {"Retry-After": "30"})
+    assert scheduler.reserve_token("core") == (None, 30.0)
+
+
+def test_plain_forbidden_is_not_retried():
+    scheduler = RateLimitScheduler(["a"], clock=FakeClock())
+
+    assert not scheduler.update("a", "core", 403, headers(4000), b"Resource not accessible")
+    assert scheduler.reserve_token("core") == ("a", 0.0)
+
+
+def test_resources_have_their_own_budget():
+    clock = FakeClock()
+    scheduler = RateLimitScheduler(["a"], clock=clock)
+    scheduler.update("a", "search", 403, headers(0, limit=30, reset=clock.now + 60))
+
+    assert scheduler.reserve_token("core") == ("a", 0.0)
+    assert scheduler.reserve_token("search") == (None, 60.0)
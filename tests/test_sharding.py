@@ -0,0 +1,44 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+from utils.sharding import ShardSpec
+
+KEYS = [f"owner-{i}/repo-{i * 7}" for i in range(500)] + ["", "ünïcode/répo", None]
+
+
+def trino_functions() -> sqlite3.Connection:
+    # The Trino functions used by sql_predicate, so sqlite evaluates the predicate as written
+    conn = sqlite3.connect(":memory:")
+    conn.create_function("to_utf8", 1, lambda value: value.encode("utf-8"))
+    conn.create_function("md5", 1, lambda value: hashlib.md5(value).digest())
+    conn.create_function("from_big_endian_64", 1, lambda value: int.from_bytes(value, "big", signed=True))
+    conn.create_function("bitwise_and", 2, lambda left, right: left & right)
+    conn.execute("CREATE TABLE repos (repo_id TEXT)")
+    conn.executemany("INSERT INTO repos VALUES (?)", [(key,) for key in KEYS])
+    return conn
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 8])
+def test_sql_predicate_selects_the_keys_owned_in_python(count):
+    conn = trino_functions()
+    for index in range(count):
+        shard = ShardSpec(index, count)
+        selected = conn.execute(f"SELECT repo_id FROM repos WHERE {shard.sql_predicate('repo_id')}").fetchall()
+
+        assert sorted(selected, key=str) == sorted([(key,) for key in KEYS if shard.owns(key)], key=str)
+
+
+def test_every_key_has_exactly_one_shard():
+    shards = [ShardSpec(index, 4) for index in range(4)]
+
+    for key in KEYS:
+        assert sum(shard.owns(key) for shard in shards) == 1
+
+
+def test_parse():
+    assert str(ShardSpec.parse("2/8")) == "2/8"
+    assert not ShardSpec.parse("0").sharded
+    with pytest.raises(ValueError):
+        ShardSpec.parse("4/4")
@@ -0,0 +1,62 @@
+from utils.storage import iter_insert_statements
+
+TABLE = "iceberg.landing.repositories"
+
+
+def make_rows(count, payload_size=100):
+    return [{"id": f"repo-{i}", "name": "x" * payload_size} for i in range(count)]
+
+
+def test_statements_stay_under_the_byte_limit():
+    statements = list(iter_insert_statements(TABLE, make_rows(200), "id", "2024-01-01", max_statement_bytes=5_000))
+
+    assert len(statements) > 1
+    assert sum(rows for _, rows, _ in statements) == 200
+    for statement, _, size in statements:
+        assert size == len(statement.encode("utf-8"))
+        assert size <= 5_000
+
+
+def test_statements_stay_under_the_row_limit():
+    statements = list(iter_insert_statements(TABLE, make_rows(25), "id", "2024-01-01", max_rows=10))
+
+    assert [rows for _, rows, _ in statements] == [10, 10, 5]
+
+
+def test_row_larger_than_the_limit_gets_its_own_statement():
+    rows = make_rows(1) + make_rows(1, payload_size=10_000) + make_rows(1)
+    statements = list(iter_insert_statements(TABLE, rows, "id", "2024-01-01", max_statement_bytes=5_000))
+
+    assert [rows for _, rows, _ in statements] == [1, 1, 1]
+
+
+def test_non_ascii_values_are_measured_in_bytes():
+    rows = [{"id": f"répo-{i}-" + "é" * 50, "name": "n"} for i in range(50)]
+    statements = list(iter_insert_statements(TABLE, rows, "id", "2024-01-01", max_statement_bytes=2_000))
+
+    for statement, _, size in statements:
+        assert size == len(statement.encode("utf-8"))
+        assert size <= 2_000
+
+
+def test_quotes_are_escaped():
+    rows = [{"id": "it's", "name": "O'Brien"}]
+    (statement, _, _), = iter_insert_statements(TABLE, rows, "id", "2024-01-01")
+
+    assert "'it''s'" in statement
+    assert "O''Brien" in statement
+
+
+def test_upsert_builds_a_merge_on_id():
+    (statement, rows, _), = iter_insert_statements(TABLE, make_rows(3), "id", "2024-01-01", upsert=True)
+
+    assert statement.startswith(f"MERGE INTO {TABLE} t")
+    assert "ON t.id = s.id" in statement
+    assert rows == 3
+
+
+def test_upsert_matches_ids_within_their_repository():
+    rows = [{"sha": "abc", "owner": "fork", "repo": "repo"}]
+    (statement, _, _), = iter_insert_statements("iceberg.landing.commits", rows, "sha", "2024-01-01", upsert=True)
+
+    assert "ON t.id = s.id AND t.owner IS NOT DISTINCT FROM s.owner AND t.repo IS NOT DISTINCT FROM s.repo" in statement
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import requests
+
+from extract_commits_details_from_github import commit_key, ledger_callback
+from utils.work_ledger import DONE, FAILED, PENDING, RETRYABLE, WorkLedger, is_retryable
+
+
+def ledger(tmp_path, **kwargs):
+    # No backoff, so retries are due at once
+    kwargs.setdefault("backoff_seconds", 0)
+    return WorkLedger("commit_details", "2024-01-31#0", path=str(tmp_path / "ledger.sqlite"), **kwargs)
+
+
+def state(ledger, key):
+    ledger.flush()
+    return ledger.conn.execute("SELECT state FROM work_items WHERE item_key = ?", (key,)).fetchone()[0]
+
+
+def test_restarted_run_skips_done_and_failed_items(tmp_path):
+    first = ledger(tmp_path)
+    for key in "abcd":
+        first.start(key)
+    first.done("a")
+    first.fail("b", "not found", retryable=False)
+    first.fail("c", "timeout")
+    first.close()
+
+    restarted = ledger(tmp_path)
+    items = [{"key": key} for key in "abcde"]
+
+    assert [item["key"] for item in restarted.pending(items, lambda item: item["key"])] == ["c", "d", "e"]
+
+
+def test_retryable_item_fails_for_good_after_max_attempts(tmp_path):
+    work = ledger(tmp_path, max_attempts=3)
+    work.start("a", payload={"sha": "a"})
+    for _ in range(2):
+        work.fail("a", "timeout")
+        assert state(work, "a") == RETRYABLE
+    work.fail("a", "timeout")
+
+    assert state(work, "a") == FAILED
+
+
+def test_retry_batches_yield_the_payload_given_at_start(tmp_path):
+    work = ledger(tmp_path)
+    work.start("a", payload={"sha": "a"})
+    work.fail("a", "timeout")
+
+    batches = work.retry_batches(max_wait_seconds=0)
+    assert next(batches) == [("a", {"sha": "a"})]
+    work.done("a")
+
+    assert list(batches) == []
+    assert work.counts() == {DONE: 1}
+
+
+def test_changes_are_checkpointed_in_batches(tmp_path):
+    work = ledger(tmp_path, checkpoint_items=2)
+    work.start("a")
+    assert work.conn.execute("SELECT COUNT(*) FROM work_items").fetchone()[0] == 0
+    work.start("b")
+
+    assert work.conn.execute("SELECT COUNT(*) FROM work_items").fetchone()[0] == 2
+
+
+def test_missing_items_are_not_retried():
+    assert not is_retryable(404)
+    # Errors raised by GitHubResponse.raise_for_status carry the response and its status
+    assert not is_retryable(requests.HTTPError("410 Error", response=SimpleNamespace(status=410)))
+    assert is_retryable(502)
+    assert is_retryable(TimeoutError())
+
+
+def test_commit_is_done_once_its_rows_are_written(tmp_path):
+    work = ledger(tmp_path)
+    commit = {"repo_id": "owner/repo", "sha": "a"}
+    work.start(commit_key(commit), payload=commit)
+    on_written = ledger_callback(work, commit)
+    assert state(work, commit_key(commit)) == PENDING
+
+    on_written(None)
+
+    assert state(work, commit_key(commit)) == DONE
+
+
+def test_failed_write_leaves_the_commit_to_retry(tmp_path):
+    work = ledger(tmp_path)
+    commit = {"repo_id": "owner/repo", "sha": "a"}
+    ledger_callback(work, commit)(RuntimeError("insert failed"))
+
+    assert state(work, commit_key(commit)) == RETRYABLE
+    assert next(work.retry_batches(max_wait_seconds=0)) == [(commit_key(commit), commit)]
+
+
+def test_forks_are_separate_items():
+    assert commit_key({"repo_id": "owner/repo", "sha": "a"}) != commit_key({"repo_id": "fork/repo", "sha": "a"})
+
+
+def test_no_callback_without_a_ledger():
+    assert ledger_callback(None, {"repo_id": "owner/repo", "sha": "a"}) is None